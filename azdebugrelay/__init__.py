@@ -1,12 +1,43 @@
-from .debug_relay import DebugRelay, DebugMode
+from .debug_relay import DebugRelay, DebugMode, DebugRelayTimeoutError, RelayEngine
+from .relay_supervisor import RestartPolicy
 from .debugpyex import DebugPyEx
+from .relay_metrics import enable_metrics, disable_metrics
+from .rank_policy import RankPolicy, RankSelection, RankInfo
+from .debug_breakpoints import Breakpoint, breakpoint, arm_breakpoints, disarm_breakpoints
+from .debug_trigger import DebugTrigger
+from .relay_config import ConfigResolver, SecretCache, SecretProvider, LocalSecretProvider, default_resolver
 
 __all__ = [
     "DebugRelay",
     "DebugMode",
+    "DebugRelayTimeoutError",
+    "RelayEngine",
+    "RestartPolicy",
+    "enable_metrics",
+    "disable_metrics",
+    "RankPolicy",
+    "RankSelection",
+    "RankInfo",
+    "Breakpoint",
+    "breakpoint",
+    "arm_breakpoints",
+    "disarm_breakpoints",
+    "DebugTrigger",
+    "ConfigResolver",
+    "SecretCache",
+    "SecretProvider",
+    "LocalSecretProvider",
+    "default_resolver",
     "debugpy_connect_with_timeout"
 ]
 
 
-def debugpy_connect_with_timeout(host, port, connect_timeout_seconds):
-    return DebugPyEx.connect(str(host), int(port), float(connect_timeout_seconds))
\ No newline at end of file
+def debugpy_connect_with_timeout(host, port, connect_timeout_seconds, debug_relay=None, cancel_event=None):
+    """Connects debugpy to a listening debugger with a timeout.
+    If debug_relay is given, opens it first unless it is already running
+    (returns at once if it has been prewarmed with DebugRelay.prewarm() and is connected).
+    Waiting stops early once cancel_event (threading.Event) is set.
+    """
+    if debug_relay is not None and (debug_relay.prewarm_future is not None or not debug_relay.is_running()):
+        debug_relay.open()
+    return DebugPyEx.connect(str(host), int(port), float(connect_timeout_seconds), cancel_event)
\ No newline at end of file
@@ -0,0 +1,17 @@
+"""`python -m azdebugrelay [options]` runs Azure Debugging Relay CLI (see debug_relay._cli_main),
+`python -m azdebugrelay bench [options]` runs the tunnel latency and throughput probe (see relay_bench._cli_main).
+"""
+import sys
+
+
+def main(argv):
+    if argv and argv[0] == "bench":
+        from .relay_bench import _cli_main as bench_main
+        bench_main(argv[1:])
+    else:
+        from .debug_relay import _cli_main
+        _cli_main(argv)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,532 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import typing
+
+
+# Manifest file written into every complete Azure Relay Bridge installation
+MANIFEST_FILE_NAME = ".azdebugrelay-manifest.json"
+
+
+class FileLock(object):
+    """Exclusive inter-process lock on a lock file.
+    Waiting processes block in the OS (flock on POSIX, LK_LOCK on Windows) instead of polling.
+    With `remove`, the lock file is deleted on release, so it doesn't linger in shared directories.
+    """
+    def __init__(self, lock_file: str, remove: bool = False):
+        self.lock_file = lock_file
+        self.remove = remove
+        self._file = None
+
+
+    def acquire(self):
+        while True:
+            self._file = open(self.lock_file, "a+")
+            if os.name == "nt":
+                import msvcrt
+                while True:
+                    try:
+                        # LK_LOCK retries for ~10 seconds before giving up
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.1)
+                return
+            import fcntl
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            if not self.remove:
+                return
+            # the previous holder may have removed the file while we were waiting on it
+            try:
+                if os.stat(self.lock_file).st_ino == os.fstat(self._file.fileno()).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            self._file.close()
+
+
+    def release(self):
+        if self._file is not None:
+            if self.remove:
+                try:
+                    os.remove(self.lock_file)
+                except OSError:
+                    # still open by a waiting process on Windows
+                    pass
+            if os.name == "nt":
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def write_manifest(folder: str, version: str):
+    """Records every file of an installation (with its size) in the manifest file.
+    """
+    files = {}
+    for root, _, file_names in os.walk(folder):
+        for file_name in file_names:
+            path = os.path.join(root, file_name)
+            files[os.path.relpath(path, folder).replace(os.sep, "/")] = os.path.getsize(path)
+    files.pop(MANIFEST_FILE_NAME, None)
+    with open(os.path.join(folder, MANIFEST_FILE_NAME), "w") as manifest_file:
+        json.dump({"version": version, "files": files}, manifest_file)
+
+
+def verify_manifest(folder: str, version: str) -> bool:
+    """Checks that an installation is complete:
+    the manifest exists, matches the version, and all files listed in it exist with the recorded sizes.
+    """
+    try:
+        with open(os.path.join(folder, MANIFEST_FILE_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get("version") != version:
+            return False
+        for relative_path, size in manifest["files"].items():
+            if os.path.getsize(os.path.join(folder, relative_path)) != size:
+                return False
+    except (OSError, ValueError, KeyError, AttributeError):
+        return False
+    return True
+
+
+def install_atomically(folder: str, version: str, populate: typing.Callable[[str], None]) -> bool:
+    """Installs into `folder` exactly once per machine, safely across processes.
+
+    The installation is populated in a temporary sibling directory, recorded in a manifest,
+    and renamed into place, so no process ever sees a half-installed folder.
+    Concurrent callers wait on a lock file and reuse the installation made by the lock holder.
+
+    Args:
+        folder (str): Installation folder
+        version (str): Version recorded in the manifest
+        populate (typing.Callable[[str], None]): Function that fills a given (temporary) directory
+
+    Returns:
+        bool: True if this call installed, False if a complete installation was already there.
+    """
+    if verify_manifest(folder, version):
+        return False
+    parent = os.path.dirname(os.path.abspath(folder))
+    name = os.path.basename(os.path.abspath(folder))
+    os.makedirs(parent, exist_ok=True)
+    with FileLock(os.path.join(parent, f".{name}.lock")):
+        # another process may have finished installing while we were waiting
+        if verify_manifest(folder, version):
+            return False
+        staging = tempfile.mkdtemp(prefix=f".{name}-", dir=parent)
+        try:
+            populate(staging)
+            write_manifest(staging, version)
+            if os.path.exists(folder):
+                # incomplete or outdated installation
+                stale = tempfile.mkdtemp(prefix=f".{name}-stale-", dir=parent)
+                os.rename(folder, os.path.join(stale, name))
+                shutil.rmtree(stale, ignore_errors=True)
+            os.rename(staging, folder)
+        finally:
+            if os.path.exists(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+    return True
+
+
+# Bundle index file name
+BUNDLE_INDEX_FILE_NAME = "bundle.json"
+# Local bundle directory, archive file, or HTTP(S) mirror to install Azure Relay Bridge from
+BRIDGE_SOURCE_ENV = "AZDEBUGRELAY_BRIDGE_SOURCE"
+# Directory (e.g. on a shared filesystem) where downloaded Azure Relay Bridge archives are cached
+BRIDGE_CACHE_ENV = "AZDEBUGRELAY_BRIDGE_CACHE"
+# Expected SHA-256 of the archive when the source doesn't provide one
+BRIDGE_SHA256_ENV = "AZDEBUGRELAY_BRIDGE_SHA256"
+
+_COPY_BUFFER_SIZE = 256 * 1024
+
+
+class BridgeArchive(typing.NamedTuple):
+    """Where to get an Azure Relay Bridge archive from.
+    """
+    # URL or local path
+    location: str
+    # Archive file name (.zip or .tar.gz)
+    file_name: str
+    # Expected SHA-256 hex digest, None if unknown
+    sha256: typing.Optional[str]
+
+
+def _is_url(location: str) -> bool:
+    return location.lower().startswith(("http://", "https://"))
+
+
+def _is_archive(location: str) -> bool:
+    return location.lower().endswith((".zip", ".tar.gz", ".tgz"))
+
+
+def _urlopen(url: str):
+    import urllib.request
+    return urllib.request.urlopen(url)
+
+
+def _read_bundle_index(source: str, version: str) -> typing.Dict[str, typing.Any]:
+    if _is_url(source):
+        with _urlopen(f"{source.rstrip('/')}/{BUNDLE_INDEX_FILE_NAME}") as index_stream:
+            index = json.loads(index_stream.read().decode())
+    else:
+        with open(os.path.join(source, BUNDLE_INDEX_FILE_NAME)) as index_file:
+            index = json.load(index_file)
+    if index.get("version") != version:
+        raise ValueError(
+            f"Azure Relay Bridge bundle {source} has version {index.get('version')}, expected {version}.")
+    return index
+
+
+def resolve_archive(source: typing.Optional[str],
+                    platform_name: str,
+                    version: str,
+                    default_url: str,
+                    default_sha256: str = None) -> BridgeArchive:
+    """Finds the Azure Relay Bridge archive for a platform.
+
+    Args:
+        source (str): Bundle directory, archive file, HTTP(S) mirror of a bundle, or archive URL.
+            None means the default download URL.
+        platform_name (str): Platform name in the bundle (ubuntu, debian, macos or windows)
+        version (str): Expected Azure Relay Bridge version
+        default_url (str): Default download URL
+        default_sha256 (str, optional): Pinned SHA-256 of the default download. Defaults to None.
+
+    Raises:
+        ValueError: The bundle has another version or no archive for the platform.
+
+    Returns:
+        BridgeArchive: archive location and its expected checksum
+    """
+    sha256 = os.environ.get(BRIDGE_SHA256_ENV) or None
+    if not source or _is_archive(source):
+        location = source or default_url
+        if not source and sha256 is None:
+            sha256 = default_sha256
+        if not _is_url(location) and sha256 is None and os.path.exists(location + ".sha256"):
+            with open(location + ".sha256") as checksum_file:
+                sha256 = checksum_file.read().split()[0]
+        file_name = os.path.basename(location.split("?")[0])
+        return BridgeArchive(location, file_name, sha256)
+
+    index = _read_bundle_index(source, version)
+    entry = index.get("archives", {}).get(platform_name)
+    if entry is None:
+        raise ValueError(f"Azure Relay Bridge bundle {source} has no archive for {platform_name}.")
+    if _is_url(source):
+        location = f"{source.rstrip('/')}/{entry['file']}"
+    else:
+        location = os.path.join(source, entry["file"])
+    return BridgeArchive(location, entry["file"], entry.get("sha256"))
+
+
+class DownloadProgress(object):
+    """Progress and throughput of an archive download.
+    """
+    # How often progress is logged, in seconds
+    log_interval = 2.0
+
+    def __init__(self, file_name: str, logger: logging.Logger = logging.root):
+        self.file_name = file_name
+        self.logger = logger
+        # bytes of the archive passed through so far, including a resumed part
+        self.downloaded = 0
+        # bytes taken from a previously interrupted download
+        self.resumed_from = 0
+        # total archive size, None if unknown
+        self.total = None
+        self._started = time.monotonic()
+        self._last_logged = self._started
+
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second transferred from the source (excluding the resumed part)
+        """
+        elapsed = self.elapsed
+        return (self.downloaded - self.resumed_from) / elapsed if elapsed > 0 else 0.0
+
+
+    def update(self, byte_count: int):
+        self.downloaded += byte_count
+        now = time.monotonic()
+        if now - self._last_logged >= DownloadProgress.log_interval:
+            self._last_logged = now
+            self.report()
+
+
+    def report(self):
+        total = f" of {self.total / 1048576:.1f} MB" if self.total else ""
+        self.logger.info(f"{self.file_name}: {self.downloaded / 1048576:.1f} MB{total}, "
+                         f"{self.throughput / 1048576:.1f} MB/s")
+
+
+class _ArchiveStream(object):
+    """Read-only file-like object that archive extraction consumes.
+
+    Replays a partially downloaded file first, then continues with the source stream,
+    appending new bytes to the partial file. Everything that passes through is hashed.
+    """
+    def __init__(self, source, part_file, replay_bytes: int, progress: DownloadProgress):
+        self._source = source
+        self._part_file = part_file
+        self._replay_bytes = replay_bytes
+        self._progress = progress
+        self.digest = hashlib.sha256()
+
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = _COPY_BUFFER_SIZE
+        if self._replay_bytes > 0:
+            data = self._part_file.read(min(size, self._replay_bytes))
+            self._replay_bytes -= len(data)
+            if not data:
+                self._replay_bytes = 0
+        else:
+            data = self._source.read(size)
+            if not data and self._progress.total is not None \
+                    and self._progress.downloaded < self._progress.total:
+                # connections may close without an error, and HTTP responses end like complete ones
+                raise EOFError(f"{self._progress.file_name}: connection closed before the end of data.")
+            if data and self._part_file is not None:
+                self._part_file.write(data)
+        self.digest.update(data)
+        self._progress.update(len(data))
+        return data
+
+
+    def drain(self):
+        while self.read(_COPY_BUFFER_SIZE):
+            pass
+
+
+def _is_tar(file_name: str) -> bool:
+    return file_name.lower().endswith((".tar.gz", ".tgz"))
+
+
+def _open_source(location: str, offset: int) -> typing.Tuple[typing.Any, int, typing.Optional[int]]:
+    """Opens a URL or a local file at offset.
+    Returns the stream, the offset it actually starts at, and the total size (if known).
+    """
+    if not _is_url(location):
+        stream = open(location, "rb")
+        stream.seek(offset)
+        return stream, offset, os.path.getsize(location)
+    import urllib.error
+    import urllib.request
+    request = urllib.request.Request(location)
+    if offset > 0:
+        request.add_header("Range", f"bytes={offset}-")
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as ex:
+        if ex.code != 416 or offset == 0:
+            raise
+        # the partial file is complete or stale, start over
+        return _open_source(location, 0)
+    length = response.headers.get("Content-Length")
+    if offset > 0 and response.status == 206:
+        return response, offset, int(length) + offset if length else None
+    return response, 0, int(length) if length else None
+
+
+def _extract_stream(stream: _ArchiveStream, file_name: str, folder: str):
+    import tarfile
+    with tarfile.open(fileobj=stream, mode="r|gz") as tar_file:
+        if hasattr(tarfile, "data_filter"):
+            tar_file.extractall(folder, filter="data")
+        else:
+            tar_file.extractall(folder)
+
+
+def _stream_archive(location: str,
+                    file_name: str,
+                    part_path: typing.Optional[str],
+                    extract_to: typing.Optional[str],
+                    progress: DownloadProgress) -> str:
+    """Streams an archive once through hashing, the partial file (if any) and tar extraction (if any).
+    Returns SHA-256 hex digest of the whole archive.
+    """
+    offset = os.path.getsize(part_path) if part_path and os.path.exists(part_path) else 0
+    source, offset, progress.total = _open_source(location, offset)
+    part_file = None
+    try:
+        if part_path is not None:
+            # resume (r+b) or start over (w+b) when the source can't continue from the offset
+            part_file = open(part_path, "r+b" if offset else "w+b")
+            part_file.truncate(offset)
+        progress.downloaded = 0
+        progress.resumed_from = offset
+        stream = _ArchiveStream(source, part_file, offset, progress)
+        if extract_to is not None and _is_tar(file_name):
+            _extract_stream(stream, file_name, extract_to)
+        stream.drain()
+        return stream.digest.hexdigest()
+    finally:
+        source.close()
+        if part_file is not None:
+            part_file.close()
+
+
+def fetch_archive(archive: BridgeArchive,
+                  work_dir: str,
+                  cache_dir: str = None,
+                  extract_to: str = None,
+                  retries: int = 3,
+                  logger: logging.Logger = logging.root) -> str:
+    """Fetches an archive in a single streaming pass: the archive is hashed with SHA-256,
+    saved, and (for .tar.gz) extracted as it arrives, with bounded memory.
+
+    Interrupted downloads leave a `.part` file behind, which is resumed
+    with an HTTP Range request on the next attempt. Nothing is kept unless the checksum matches,
+    except files already extracted, so extract_to should be a staging folder (see install_atomically()).
+
+    Args:
+        archive (BridgeArchive): Archive to fetch
+        work_dir (str): Directory for downloaded and partially downloaded files when there is no cache
+        cache_dir (str, optional): Cache directory. Defaults to None.
+        extract_to (str, optional): Directory to extract the archive into. Defaults to None (don't extract).
+        retries (int, optional): How many times to resume a failed download. Defaults to 3.
+
+    Raises:
+        ValueError: The archive doesn't match its checksum.
+
+    Returns:
+        str: Local path of the verified archive
+    """
+    if cache_dir:
+        cached = os.path.join(cache_dir, archive.file_name)
+        if os.path.exists(cached):
+            expected = archive.sha256
+            if expected is None and os.path.exists(cached + ".sha256"):
+                with open(cached + ".sha256") as checksum_file:
+                    expected = checksum_file.read().split()[0]
+            if expected is not None:
+                progress = DownloadProgress(archive.file_name, logger)
+                if _stream_archive(cached, archive.file_name, None, extract_to, progress) == expected.lower():
+                    _extract_zip(cached, archive.file_name, extract_to)
+                    return cached
+                logger.warning(f"Cached {cached} doesn't match its checksum. Downloading again.")
+    if not _is_url(archive.location) and not cache_dir:
+        progress = DownloadProgress(archive.file_name, logger)
+        digest = _stream_archive(archive.location, archive.file_name, None, extract_to, progress)
+        if archive.sha256 is not None and digest != archive.sha256.lower():
+            raise ValueError(f"Checksum mismatch for {archive.location}.")
+        _extract_zip(archive.location, archive.file_name, extract_to)
+        return archive.location
+
+    if archive.sha256 is None:
+        logger.warning(f"No checksum is known for {archive.location}. "
+                       f"Set {BRIDGE_SHA256_ENV} to verify it.")
+    target_dir = cache_dir or work_dir
+    os.makedirs(target_dir, exist_ok=True)
+    path = os.path.join(target_dir, archive.file_name)
+    part_path = path + ".part"
+    import http.client
+    progress = DownloadProgress(archive.file_name, logger)
+    # a shared cache may be written by several machines at once
+    with FileLock(part_path + ".lock", remove=True):
+        attempt = 0
+        while True:
+            try:
+                digest = _stream_archive(archive.location, archive.file_name, part_path, extract_to, progress)
+                break
+            except (OSError, EOFError, http.client.HTTPException) as ex:
+                attempt += 1
+                # a missing or forbidden archive (HTTP 4xx) doesn't come back when resumed
+                if attempt > retries or 400 <= getattr(ex, "code", 0) < 500:
+                    raise
+                logger.warning(f"Downloading {archive.file_name} failed ({ex}). Resuming...")
+                time.sleep(min(0.5 * 2 ** (attempt - 1), 10))
+        progress.report()
+        if archive.sha256 is not None and digest != archive.sha256.lower():
+            os.remove(part_path)
+            raise ValueError(f"Checksum mismatch for {archive.location}.")
+        os.replace(part_path, path)
+    if cache_dir:
+        with open(path + ".sha256", "w") as checksum_file:
+            checksum_file.write(f"{digest}  {archive.file_name}\n")
+    _extract_zip(path, archive.file_name, extract_to)
+    return path
+
+
+def _extract_zip(path: str, file_name: str, folder: typing.Optional[str]):
+    # zip archives keep their directory at the end, so they can only be extracted once complete
+    if folder is not None and not _is_tar(file_name):
+        import zipfile
+        with zipfile.ZipFile(path, "r") as zip_file:
+            zip_file.extractall(folder)
+
+
+def make_bundle(output_dir: str,
+                version: str,
+                downloads: typing.Dict[str, str],
+                platforms: typing.List[str] = None,
+                logger: logging.Logger = logging.root) -> str:
+    """Builds a versioned Azure Relay Bridge bundle:
+    archives for the requested platforms and a `bundle.json` index with their checksums.
+    A bundle directory can be used directly, copied to a shared filesystem, or served over HTTP
+    as AZDEBUGRELAY_BRIDGE_SOURCE.
+    A platform that cannot be fetched is logged and left out of the bundle, so the others are still bundled.
+
+    Args:
+        output_dir (str): Bundle directory
+        version (str): Azure Relay Bridge version
+        downloads (typing.Dict[str, str]): Download URLs by platform name
+        platforms (typing.List[str], optional): Platforms to include. Defaults to all of them.
+
+    Raises:
+        RuntimeError: None of the platforms could be fetched.
+
+    Returns:
+        str: Path of the bundle index file
+    """
+    import http.client
+    index = {"version": version, "archives": {}}
+    platforms = platforms or list(downloads.keys())
+    for platform_name in platforms:
+        url = downloads.get(platform_name)
+        if url is None:
+            logger.error(f"Skipping {platform_name}: not a known platform ({', '.join(downloads.keys())}).")
+            continue
+        archive = BridgeArchive(url, os.path.basename(url), None)
+        try:
+            path = fetch_archive(archive, output_dir, cache_dir=output_dir, logger=logger)
+        except (OSError, ValueError, EOFError, http.client.HTTPException) as ex:
+            logger.error(f"Skipping {platform_name}: cannot fetch {url} ({ex}).")
+            continue
+        with open(path + ".sha256") as checksum_file:
+            sha256 = checksum_file.read().split()[0]
+        os.remove(path + ".sha256")
+        index["archives"][platform_name] = {"file": archive.file_name, "sha256": sha256}
+    if not index["archives"]:
+        raise RuntimeError(f"Cannot fetch Azure Relay Bridge for any of {', '.join(platforms)}.")
+    index_path = os.path.join(output_dir, BUNDLE_INDEX_FILE_NAME)
+    with open(index_path, "w") as index_file:
+        json.dump(index, index_file, indent=2)
+    return index_path
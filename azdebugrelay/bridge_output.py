@@ -0,0 +1,319 @@
+import collections
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import typing
+
+if __package__:
+    from . import relay_events
+else:
+    # launched as a script (e.g. by the VS Code extension)
+    import relay_events
+
+
+class ReadinessTracker(object):
+    """Tracks Azure Relay Bridge output lines
+    until both local and remote forwarders report they have started,
+    and measures how long each phase took (`durations`, seconds by phase name).
+    """
+    PHASE_PROCESS_START = "process start"
+    PHASE_LOCAL_FORWARD = "local forward"
+    PHASE_REMOTE_FORWARD = "remote forward"
+
+    def __init__(self):
+        self.output_started = False
+        self.local_forward_ready = False
+        self.remote_forward_ready = False
+        self.durations = {}
+        self._phase_start = time.monotonic()
+
+
+    @property
+    def ready(self) -> bool:
+        return self.local_forward_ready and self.remote_forward_ready
+
+
+    @property
+    def phase(self) -> typing.Optional[str]:
+        """The phase Azure Relay Bridge is currently in (None when ready):
+        `process start` until the bridge prints anything,
+        then `local forward` and `remote forward` until the respective forwarder starts.
+        """
+        if not self.output_started:
+            return ReadinessTracker.PHASE_PROCESS_START
+        elif not self.local_forward_ready:
+            return ReadinessTracker.PHASE_LOCAL_FORWARD
+        elif not self.remote_forward_ready:
+            return ReadinessTracker.PHASE_REMOTE_FORWARD
+        return None
+
+
+    def feed(self, line: str) -> bool:
+        """Processes an output line. Returns True when the bridge is ready.
+        """
+        phase = self.phase
+        self.output_started = True
+        if line.find("LocalForwardHostStart,") != -1:
+            self.local_forward_ready = True
+        elif line.find("RemoteForwardHostStart,") != -1:
+            self.remote_forward_ready = True
+        if self.phase != phase and phase is not None:
+            now = time.monotonic()
+            self.durations[phase] = now - self._phase_start
+            self._phase_start = now
+        return self.ready
+
+
+class BridgeOutputReader(object):
+    """Reads lines from a binary pipe with an optional timeout.
+
+    On POSIX, reads are driven by a selector, so a silent process never blocks
+    the caller past its deadline. On Windows, where pipes cannot be selected,
+    a daemon thread feeds lines into a queue.
+    """
+    _CHUNK_SIZE = 65536
+
+    def __init__(self, pipe: typing.BinaryIO, use_selector: bool = True):
+        self._pipe = pipe
+        self._buffer = b""
+        self._lines = collections.deque()
+        self._eof = False
+        self._selector = None
+        self._queue = None
+        if use_selector:
+            import selectors
+            self._fd = pipe.fileno()
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self._fd, selectors.EVENT_READ)
+        else:
+            self._queue = queue.Queue()
+            threading.Thread(target=self._pump, daemon=True).start()
+
+
+    def readline(self, timeout: typing.Optional[float] = None) -> typing.Optional[str]:
+        """Reads a line.
+
+        Args:
+            timeout (float, optional): Maximum time to wait, in seconds. None means no limit.
+
+        Returns:
+            str: A line (with its line break), an empty string at the end of the stream,
+                or None if the timeout expired before a whole line arrived.
+        """
+        if self._queue is not None:
+            if self._eof:
+                return ""
+            try:
+                line = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            if line == "":
+                self._eof = True
+            return line
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._lines:
+                return self._lines.popleft()
+            if self._eof:
+                line = self._buffer
+                self._buffer = b""
+                return line.decode(errors="replace")
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+            if not self._selector.select(remaining):
+                continue
+            chunk = os.read(self._fd, BridgeOutputReader._CHUNK_SIZE)
+            if not chunk:
+                self._eof = True
+                self._selector.close()
+                continue
+            # split a whole chunk at once rather than slicing the buffer line by line
+            lines = (self._buffer + chunk).split(b"\n")
+            self._buffer = lines.pop()
+            self._lines.extend(line.decode(errors="replace") + "\n" for line in lines)
+
+
+    def _pump(self):
+        for line in iter(self._pipe.readline, b""):
+            self._queue.put(line.decode(errors="replace"))
+        self._queue.put("")
+
+
+class OutputPolicy(object):
+    """How Azure Relay Bridge output is kept and logged.
+
+    Every line goes to a ring buffer of recent output.
+    Classified events (errors, forwarders starting and stopping, connections accepted and closed)
+    are logged at INFO (errors at WARNING), everything else at DEBUG.
+    Repetitive lines are rate-limited: at most `rate_limit_lines` similar lines
+    (with the same beginning, ignoring digits) are logged per `rate_limit_interval` seconds.
+    """
+    def __init__(self,
+                 buffer_lines: int = 1000,
+                 rate_limit_lines: int = 10,
+                 rate_limit_interval: float = 10,
+                 echo: bool = False):
+        """Initializes OutputPolicy object.
+
+        Args:
+            buffer_lines (int, optional): Number of recent lines to keep. Defaults to 1000.
+            rate_limit_lines (int, optional): Maximum number of similar lines logged per interval.
+                None disables rate limiting. Defaults to 10.
+            rate_limit_interval (float, optional): Rate limiting interval, in seconds. Defaults to 10.
+            echo (bool, optional): Also print logged lines to stdout. Defaults to False.
+        """
+        self.buffer_lines = buffer_lines
+        self.rate_limit_lines = rate_limit_lines
+        self.rate_limit_interval = rate_limit_interval
+        self.echo = echo
+
+
+class BridgeOutputLog(object):
+    """Applies OutputPolicy to Azure Relay Bridge output lines.
+    Thread-safe, and outlives bridge restarts, so recent output is available for post-mortems.
+    Classified lines (and lines reporting transferred bytes) are published to an optional EventStream.
+    """
+    EVENT_ERROR = relay_events.EVENT_ERROR
+    EVENT_FORWARD_START = relay_events.EVENT_FORWARD_START
+    EVENT_FORWARD_STOP = relay_events.EVENT_FORWARD_STOP
+    EVENT_CONNECTION_ACCEPTED = relay_events.EVENT_CONNECTION_ACCEPTED
+    EVENT_CONNECTION_CLOSED = relay_events.EVENT_CONNECTION_CLOSED
+
+    # lowercase keywords of every event, errors first (they take precedence)
+    _EVENT_KEYWORDS = [
+        (EVENT_ERROR, ("exception", "error", "fail", "unhandled")),
+        (EVENT_FORWARD_START, ("forwardhoststart", "forwardlistenerstart")),
+        (EVENT_FORWARD_STOP, ("forwardhoststop", "forwardlistenerstop")),
+        (EVENT_CONNECTION_ACCEPTED, ("accepted", "connected")),
+        (EVENT_CONNECTION_CLOSED, ("closed", "close,", "complete")),
+    ]
+    # lines are similar if they are equal in their first characters, ignoring digits
+    _SIMILARITY_PREFIX = 64
+    _DIGITS = str.maketrans("", "", "0123456789")
+    _MAX_RATE_KEYS = 1024
+    _BYTES = re.compile(r"(\d+)\s*bytes|bytes\w*\W{1,3}(\d+)", re.IGNORECASE)
+
+    def __init__(self,
+                 policy: OutputPolicy = None,
+                 logger: logging.Logger = logging.root,
+                 events: relay_events.EventStream = None):
+        self.policy = policy or OutputPolicy()
+        self.logger = logger
+        self.events = events
+        self._lines = collections.deque(maxlen=self.policy.buffer_lines)
+        self._lock = threading.Lock()
+        # similar line key -> [window start, lines logged in window, lines suppressed in window]
+        self._rates = {}
+
+
+    @staticmethod
+    def classify(line: str) -> typing.Optional[str]:
+        """Returns the event type (EVENT_*) of an output line, or None for unclassified lines.
+        """
+        return BridgeOutputLog._classify_lower(line.lower())
+
+
+    @staticmethod
+    def _classify_lower(line: str) -> typing.Optional[str]:
+        # plain substring tests are much cheaper than regular expressions on every line
+        for event, keywords in BridgeOutputLog._EVENT_KEYWORDS:
+            for keyword in keywords:
+                if keyword in line:
+                    return event
+        return None
+
+
+    def handle(self, line: str, log: bool = True) -> typing.Optional[str]:
+        """Buffers and logs an output line according to the policy.
+
+        Args:
+            line (str): Output line
+            log (bool, optional): Log the line (False only buffers it). Defaults to True.
+
+        Returns:
+            str: The event type of the line (see classify()), or None.
+        """
+        line = line.rstrip()
+        if not line:
+            return None
+        lower = line.lower()
+        event = BridgeOutputLog._classify_lower(lower)
+        if self.events is not None:
+            self._publish(event, line, lower)
+        with self._lock:
+            self._lines.append(line)
+            if not log:
+                return event
+            if event == BridgeOutputLog.EVENT_ERROR:
+                level = logging.WARNING
+            elif event is not None:
+                level = logging.INFO
+            else:
+                level = logging.DEBUG
+            # lines that wouldn't be logged anyway skip rate limiting
+            if not self.logger.isEnabledFor(level):
+                return event
+            log, suppressed = self._admit(line)
+        if suppressed:
+            self.logger.info(f"Azure Relay Bridge: {suppressed} similar lines suppressed")
+        if log:
+            self.logger.log(level, line)
+            if self.policy.echo:
+                print(line)
+        return event
+
+
+    def recent(self, lines: int = None) -> typing.List[str]:
+        """Returns recent output lines, oldest first.
+
+        Args:
+            lines (int, optional): Maximum number of lines to return. Defaults to all buffered lines.
+        """
+        with self._lock:
+            recent = list(self._lines)
+        if lines is not None:
+            recent = recent[-lines:] if lines > 0 else []
+        return recent
+
+
+    def _publish(self, event: typing.Optional[str], line: str, lower: str):
+        transferred = None
+        if "bytes" in lower:
+            match = BridgeOutputLog._BYTES.search(line)
+            if match is not None:
+                transferred = int(match.group(1) or match.group(2))
+        if event is not None:
+            self.events.publish(event, bytes=transferred, line=line)
+        elif transferred is not None:
+            self.events.publish(relay_events.EVENT_BYTES_TRANSFERRED, bytes=transferred, line=line)
+
+
+    def _admit(self, line: str) -> typing.Tuple[bool, int]:
+        """Rate limiting. Returns whether to log the line,
+        and how many similar lines were suppressed in the window that has just ended.
+        """
+        if self.policy.rate_limit_lines is None:
+            return True, 0
+        key = line[:BridgeOutputLog._SIMILARITY_PREFIX].translate(BridgeOutputLog._DIGITS)
+        now = time.monotonic()
+        rate = self._rates.get(key)
+        suppressed = 0
+        if rate is None or now - rate[0] >= self.policy.rate_limit_interval:
+            if rate is not None:
+                suppressed = rate[2]
+            elif len(self._rates) >= BridgeOutputLog._MAX_RATE_KEYS:
+                self._rates.clear()
+            rate = [now, 0, 0]
+            self._rates[key] = rate
+        if rate[1] < self.policy.rate_limit_lines:
+            rate[1] += 1
+            return True, suppressed
+        rate[2] += 1
+        return False, suppressed
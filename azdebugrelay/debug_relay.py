@@ -1,21 +1,65 @@
 from enum import Enum
 import os
 import signal
-import argparse
 import sys
 import logging
 import subprocess
 import stat
 import threading
-import urllib.request
-from pathlib import Path
-import ssl
-import platform
-import tarfile
 import time
 import typing
-import json
-import zipfile
+import weakref
+
+if __package__:
+    from .bridge_output import BridgeOutputReader, ReadinessTracker, OutputPolicy, BridgeOutputLog
+    from .relay_events import EventStream, RelayEvent
+    from .relay_supervisor import RestartPolicy, RelaySupervisor
+    from .exit_watcher import watch_exit
+    from .relay_registry import default_registry, wait_for_process
+    from .relay_config import ConfigResolver, default_resolver, HYBRID_CONNECTION_URL
+    from . import relay_metrics
+else:
+    # launched as a script (e.g. by the VS Code extension)
+    from bridge_output import BridgeOutputReader, ReadinessTracker, OutputPolicy, BridgeOutputLog
+    from relay_events import EventStream, RelayEvent
+    from relay_supervisor import RestartPolicy, RelaySupervisor
+    from exit_watcher import watch_exit
+    from relay_registry import default_registry, wait_for_process
+    from relay_config import ConfigResolver, default_resolver, HYBRID_CONNECTION_URL
+    import relay_metrics
+
+# asyncio, hashing, archives and downloads are only imported once a relay needs them,
+# so importing azdebugrelay stays cheap where debugging is disabled.
+
+# Azure Relay Bridge output line reporting a failure
+_BRIDGE_FAILURE_MARKER = "Microsoft.Azure.Relay.Bridge.EventTraceActivity, exception = "
+# How often the log file of a shared bridge is read while it connects, in seconds
+_SHARED_LOG_POLL_INTERVAL = 0.02
+# How much of the log file of a shared bridge is checked before adopting it, in bytes
+_SHARED_LOG_CHECK_SIZE = 65536
+# How often wait() checks a shared bridge launched by another process where it cannot sleep on a pidfd, in seconds
+_SHARED_WAIT_INTERVAL = 1.0
+
+
+def _hybrid_connection():
+    """hybrid_connection module (in-process forwarder), imported on first use
+    """
+    if __package__:
+        from . import hybrid_connection
+    else:
+        import hybrid_connection
+    return hybrid_connection
+
+
+def _bridge_installer():
+    """bridge_installer module, imported on first use
+    """
+    if __package__:
+        from . import bridge_installer
+    else:
+        import bridge_installer
+    return bridge_installer
+
 
 class DebugMode(Enum):
     """Debugging mode enum:
@@ -29,12 +73,31 @@ class DebugMode(Enum):
     Attach = Connect
 
 
+class RelayEngine(Enum):
+    """Tunneling engine enum:
+    Azure Relay Bridge subprocess, or an in-process Python forwarder
+    """
+    # Azure Relay Bridge (azbridge), downloaded and installed automatically
+    AzureRelayBridge = 1
+    # In-process Hybrid Connection forwarder (HybridConnectionForwarder), requires a connection string
+    # and the Python engine on the other end of the tunnel too
+    Python = 2
+
+class DebugRelayTimeoutError(TimeoutError):
+    """Azure Relay Bridge took too long to initialize and connect.
+    `phase` tells which phase stalled: process start, local forward or remote forward.
+    """
+    def __init__(self, msg: str, phase: str = None):
+        super().__init__(msg)
+        self.phase = phase
+
+
 class DebugRelay(object):
     """Initializes and controls Azure Relay Bridge process.
 
     Raises:
         ValueError: Invalid arguments.
-        TimeoutError: Azure Relay Bridge took too long to connect.
+        DebugRelayTimeoutError: Azure Relay Bridge took too long to connect.
     """
     # Azure Relay Bridge executable name
     relay_app_name = "azbridge"
@@ -43,19 +106,29 @@ class DebugRelay(object):
     # current Azure Debugging Relay build
     relay_version_name = "0.2.9"
     # are we running on Windows?
-    is_windows = platform.platform().lower().startswith("windows")
+    is_windows = os.name == "nt"
 
     DEFAULT_AZ_RELAY_BRIDGE_UBUNTU_DOWLOAD =\
-        "https://github.com/vladkol/azure-relay-bridge/releases/download/v0.2.9/azbridge.azrelay_folder-rel.ubuntu.18.04-x64.tar.gz"
+        "https://github.com/vladkol/azure-relay-bridge/releases/download/v0.2.9/azbridge.0.2.9-rel.ubuntu.18.04-x64.tar.gz"
     DEFAULT_AZ_RELAY_BRIDGE_MACOS_DOWLOAD =\
         "https://github.com/vladkol/azure-relay-bridge/releases/download/v0.2.9/azbridge.0.2.9-rel.osx-x64.tar.gz"
     DEFAULT_AZ_RELAY_BRIDGE_DEBIAN_DOWLOAD =\
         "https://github.com/vladkol/azure-relay-bridge/releases/download/v0.2.9/azbridge.0.2.9-rel.debian.10-x64.tar.gz"
     DEFAULT_AZ_RELAY_BRIDGE_WINDOWS_DOWLOAD =\
         "https://github.com/vladkol/azure-relay-bridge/releases/download/v0.2.9/azbridge.0.2.9-rel.win10-x64.zip"
+    # SHA-256 of the default downloads, checked unless AZDEBUGRELAY_BRIDGE_SHA256 overrides it:
+    # a download that doesn't match is rejected. Pin them together with the URLs above
+    # (`--make-bundle` records them in bundle.json); downloads without a pinned checksum are installed with a warning.
+    DEFAULT_AZ_RELAY_BRIDGE_UBUNTU_SHA256 = None
+    DEFAULT_AZ_RELAY_BRIDGE_MACOS_SHA256 = None
+    DEFAULT_AZ_RELAY_BRIDGE_DEBIAN_SHA256 = None
+    DEFAULT_AZ_RELAY_BRIDGE_WINDOWS_SHA256 = None
 
     _installed_az_relay = False
     _relay_config_file = None
+    _install_lock = threading.Lock()
+    # relays created by this process, for close_all()
+    _instances = weakref.WeakSet()
 
 
     def __init__(self,
@@ -66,7 +139,13 @@ class DebugRelay(object):
                  host: str ="127.0.0.1",
                  ports: typing.Union[str, int, typing.List[str], typing.List[int]] = "5678",
                  az_relay_connection_wait_time: float = 60,
-                 logger: logging.Logger = logging.root):
+                 logger: logging.Logger = logging.root,
+                 engine: RelayEngine = RelayEngine.AzureRelayBridge,
+                 bridge_source: str = None,
+                 bridge_cache: str = None,
+                 output_policy: OutputPolicy = None,
+                 restart_policy: RestartPolicy = None,
+                 shared: bool = False):
         """Initializes DebugRelay object. 
         
         Args:
@@ -80,13 +159,56 @@ class DebugRelay(object):
                 This port will be connected to or exposed by Azure Relay Bridge. Defaults to ["5678"].
             az_relay_connection_wait_time (float, optional): Maximum time to wait for Azure Relay Bridge
                 to initialize and connect when open() is called with wait_for_connection == True. Defaults to 60.
+            engine (RelayEngine, optional): Azure Relay Bridge subprocess or in-process Python forwarder.
+                Defaults to RelayEngine.AzureRelayBridge.
+            bridge_source (str, optional): Azure Relay Bridge bundle directory, archive file, or HTTP(S) mirror
+                to install Azure Relay Bridge from. Defaults to AZDEBUGRELAY_BRIDGE_SOURCE environment variable,
+                then to downloading from GitHub.
+            bridge_cache (str, optional): Directory (e.g. on a shared filesystem) to cache Azure Relay Bridge archives in.
+                Defaults to AZDEBUGRELAY_BRIDGE_CACHE environment variable.
+            output_policy (OutputPolicy, optional): How Azure Relay Bridge output is buffered and logged.
+                Defaults to OutputPolicy() (classified events at INFO, everything else at DEBUG, rate-limited).
+            restart_policy (RestartPolicy, optional): Supervise the relay once opened: restart it with backoff
+                whenever Azure Relay Bridge fails or exits, until close() is called.
+                Defaults to None (a failed relay stays closed).
+            shared (bool, optional): Reuse a running Azure Relay Bridge with the same configuration
+                launched by another process of the current user (or by an earlier run), and leave the bridge
+                this object launches for others to reuse. The bridge is stopped once its last user closes it,
+                and writes its output to a log file instead of this process. Defaults to False.
 
         Raises:
-            ValueError: hybrid_connection_url is None while access_key_or_connection_string is not a connection string.
+            ValueError: hybrid_connection_url is None while access_key_or_connection_string is not a connection string,
+                or engine is RelayEngine.Python while access_key_or_connection_string is not a connection string,
+                or shared is True with RelayEngine.Python or a restart_policy.
         """
         self.logger = logger
 
         self.relay_subprocess = None
+        self._output_reader = None
+        self._relay_process_async = None
+        self._async_output_task = None
+        # task reaping the bridge launched by open_async(), see _watch_exit()
+        self._exit_waiter = None
+        self._forwarder = None
+        self._forwarder_thread = None
+        # configuration file of the bridge being launched, removed once the bridge has read it
+        self._bridge_config_file = None
+        self._prewarm_future = None
+        self._open_cancelled = threading.Event()
+        # supervisor of the relay (see RestartPolicy), and the last stopped one for stats()
+        self._supervisor = None
+        self._last_supervisor = None
+        # shared bridge in use (relay_registry.RelayRecord), and its process if launched by this object
+        self._shared_record = None
+        self._shared_process = None
+        # see on_exit() and exit_future()
+        self._exit_callbacks = []
+        self._exit_future = None
+        # number of successful opens, when the relay last connected (monotonic)
+        # and how long phases of the last open took
+        self.open_count = 0
+        self._connected_at = None
+        self.open_durations = {}
         if access_key_or_connection_string.startswith("Endpoint="):
             have_connection_string = True
         else:
@@ -96,25 +218,49 @@ class DebugRelay(object):
                 raise ValueError(
                     "hybrid_connection_url must be specified when "\
                     "access_key_or_connection_string is not a connection string.")
+        if engine == RelayEngine.Python and not have_connection_string:
+            raise ValueError(
+                "access_key_or_connection_string must be a connection string with RelayEngine.Python.")
+        if shared and (engine == RelayEngine.Python or restart_policy is not None):
+            raise ValueError("Shared relays require RelayEngine.AzureRelayBridge and cannot be supervised.")
 
         if isinstance(ports, typing.List):
-            converted_ports = ports
+            converted_ports = [str(port) for port in ports]
         elif isinstance(ports, str):
             converted_ports = ports.strip().replace(",", " ").split()
         else:
             converted_ports = [str(ports)]
 
+        # credentials go to a configuration file (see _write_bridge_config()), not to the command line
         if have_connection_string:
-            self.auth_option = f"-x \"{access_key_or_connection_string}\"" 
+            self._auth_settings = {"AzureRelayConnectionString": access_key_or_connection_string}
         else:
-            self.auth_option = f"-E \"{hybrid_connection_url}\" -k \"{access_key_or_connection_string}\""
+            self._auth_settings = {
+                "AzureRelayEndpoint": hybrid_connection_url,
+                "AzureRelaySharedAccessKey": access_key_or_connection_string}
 
         if debug_mode == DebugMode.WaitForConnection:
-            self.connection_option = f"-R \"{relay_connection_name}:{host}:{';'.join(converted_ports)}\""
+            self._forward_args = ["-R", f"{relay_connection_name}:{host}:{';'.join(converted_ports)}"]
         else:
-            self.connection_option = f"-L \"{host}:{';'.join(converted_ports)}:{relay_connection_name}\""
+            self._forward_args = ["-L", f"{host}:{';'.join(converted_ports)}:{relay_connection_name}"]
 
         self.az_relay_connection_wait_time = az_relay_connection_wait_time
+        self.engine = engine
+        self.debug_mode = debug_mode
+        self.relay_connection_name = relay_connection_name
+        self.host = host
+        self.ports = converted_ports
+        self.hybrid_connection_url = hybrid_connection_url
+        self._access_key_or_connection_string = access_key_or_connection_string
+        self.bridge_source = bridge_source
+        self.bridge_cache = bridge_cache
+        self.output_policy = output_policy
+        self.restart_policy = restart_policy
+        self.shared = shared
+        # kept across restarts for post-mortems and running counters
+        self.event_stream = EventStream()
+        self.output = BridgeOutputLog(output_policy, logger, self.event_stream)
+        DebugRelay._instances.add(self)
 
 
     def __del__(self):
@@ -142,124 +288,576 @@ class DebugRelay(object):
             wait_for_connection (bool, optional): Wait for Azure Relay Bridge to initialize and connect. Defaults to True.
 
         Raises:
-            TimeoutError: Raised when it takes longer than az_relay_connection_wait_time secods
+            DebugRelayTimeoutError: Raised when it takes longer than az_relay_connection_wait_time secods
                         for Azure Relay Bridge to initialize and connect.
         """
+        prewarm = self._take_prewarm()
+        if prewarm is not None:
+            prewarm.exception()
+            if self._prewarmed(prewarm):
+                return
         # close existing Azure Relay Bridge process (if running)
         self.close()
-        # install Azure Relay Bridge (if not yet)
-        DebugRelay._install_azure_relay_bridge()
+        self._open(wait_for_connection)
 
-        command = f"{DebugRelay.relay_app_name} {self.connection_option} {self.auth_option}"
-        if DebugRelay._relay_config_file is not None:
-            command += f" -f \"{DebugRelay._relay_config_file}\""
-        # start Azure Relay Bridge
-        if not DebugRelay.is_windows:
-            self.relay_subprocess = subprocess.Popen(
-                command,
-                preexec_fn=os.setpgrp,
-                stdin=None, stderr=subprocess.STDOUT, stdout=subprocess.PIPE,
-                shell=True, universal_newlines=True, close_fds=True)
-        else:
-            self.relay_subprocess = subprocess.Popen(
-                command, 
-                creationflags = subprocess.CREATE_NEW_PROCESS_GROUP,
-                stdin=None, stderr=subprocess.STDOUT, stdout=subprocess.PIPE,
-                shell=True, universal_newlines=True, close_fds=True)
 
-        start = time.perf_counter()
+    def prewarm(self) -> "concurrent.futures.Future":
+        """Starts opening the relay in a background thread (installing Azure Relay Bridge if needed),
+        so the tunnel is already connected by the time it is needed.
+        A later open() or open_async() waits for this attempt instead of starting over,
+        and returns at once if the relay is connected.
+
+        Returns:
+            concurrent.futures.Future: readiness future. Resolves to None when the relay is connected,
+                or to the exception open() would have raised.
+        """
+        if self._prewarm_future is not None and not self._prewarm_future.done():
+            return self._prewarm_future
+        import concurrent.futures
 
-        remote_forward_ready = False
-        local_forward_ready = False
+        self.close()
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()
+
+        def prewarm_relay():
+            try:
+                self._open(True)
+            except BaseException as ex:
+                future.set_exception(ex)
+            else:
+                future.set_result(None)
+
+        self._prewarm_future = future
+        threading.Thread(target=prewarm_relay, daemon=True).start()
+        return future
+
+
+    @property
+    def prewarm_future(self) -> typing.Optional["concurrent.futures.Future"]:
+        """Readiness future of the prewarm() attempt that open() has not taken over yet, or None.
+        """
+        return self._prewarm_future
+
+
+    def _take_prewarm(self) -> typing.Optional["concurrent.futures.Future"]:
+        future = self._prewarm_future
+        self._prewarm_future = None
+        return future
+
+
+    def _prewarmed(self, future: "concurrent.futures.Future") -> bool:
+        """Returns True if a completed prewarm() left a connected relay behind.
+        """
+        error = future.exception()
+        if error is not None:
+            self.logger.warning(f"Prewarming Debugging Relay failed ({error}). Opening it again...")
+            return False
+        return self.is_running()
+
+
+    def _open(self, wait_for_connection: bool):
+        start = time.monotonic()
+        if self.engine == RelayEngine.Python:
+            self._forwarder_thread = _hybrid_connection().ForwarderThread(self._create_forwarder())
+            try:
+                self._forwarder_thread.start(self.az_relay_connection_wait_time)
+            except TimeoutError:
+                self._forwarder_thread = None
+                msg = f"Hybrid Connection forwarder took too long to connect (stalled at {self._forwarder_phase()})."
+                self.logger.critical(msg)
+                raise DebugRelayTimeoutError(msg, self._forwarder_phase())
+            except BaseException:
+                self._forwarder_thread = None
+                raise
+            self._opened({self._forwarder_phase(): time.monotonic() - start})
+            return
+        if self.shared:
+            self._open_shared(wait_for_connection, start)
+            return
+        # install Azure Relay Bridge (if not yet)
+        DebugRelay._install_azure_relay_bridge(self.bridge_source, self.bridge_cache)
+        install_duration = time.monotonic() - start
+
+        # start Azure Relay Bridge
+        self.relay_subprocess = subprocess.Popen(
+            self._build_command(),
+            stdin=None, stderr=subprocess.STDOUT, stdout=subprocess.PIPE,
+            close_fds=True, **DebugRelay._spawn_options())
+        self._register_bridge(self.relay_subprocess.pid)
+        self._output_reader = BridgeOutputReader(
+            self.relay_subprocess.stdout, use_selector=not DebugRelay.is_windows)
+
+        # monotonic deadline for the bridge to initialize and connect
+        deadline = time.monotonic() + self.az_relay_connection_wait_time
+
+        readiness = ReadinessTracker()
         over_timeout = False
-        connected = False
 
         if self.relay_subprocess.poll() is not None:
+            self._remove_bridge_config()
             msg = "Azure Relay Bridge stopped too soon!"
             self.logger.critical(msg)
             raise RuntimeError(msg)
 
         # If recognizing Azure Relay Bridge connection status, parse its output.
         if wait_for_connection:
-            # Iterate over Azure Relay Bridge output lines, 
+            # Read Azure Relay Bridge output lines until the deadline,
             # looking for lines with "LocalForwardHostStart," and "RemoteForwardHostStart," to appear.
-            for line in iter(self.relay_subprocess.stdout.readline, ''):
-                self.logger.info(line)
-                print(line)
-                if self.relay_subprocess.poll() is not None:
+            while not readiness.ready:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    over_timeout = True
+                    break
+                if self._open_cancelled.is_set():
+                    break
+                # wake up regularly, so close() can cancel prewarming
+                line = self._output_reader.readline(min(remaining, 0.5))
+                if line is None:
+                    continue
+                if line == "":
                     self.logger.critical("Azure Relay Bridge stopped.")
                     break
-                if wait_for_connection and not connected:
-                    if line.find("LocalForwardHostStart,") != -1:
-                        local_forward_ready = True
-                    elif line.find("RemoteForwardHostStart,") != -1:
-                        remote_forward_ready = True
-                    if remote_forward_ready and local_forward_ready:
-                        connected = True
-                        msg = "Azure Relay Bridge is connected!"
-                        self.logger.info(msg)
-                        break
-
-                    time_delta = time.perf_counter() - start
-                    # did take too long to initialize and connect?
-                    if time_delta > self.az_relay_connection_wait_time:
-                        over_timeout = True
-                        break
+                self.output.handle(line)
+                if readiness.feed(line):
+                    msg = "Azure Relay Bridge is connected!"
+                    self.logger.info(msg)
         else:
             msg = "Azure Relay Bridge is running!"
             self.logger.info(msg)
+        if readiness.output_started:
+            # the bridge has read its configuration
+            self._remove_bridge_config()
 
         # Handle over-timeout status
         if over_timeout:
-            msg = f"Azure Relay Bridge took too long to connect."
+            msg = f"Azure Relay Bridge took too long to connect (stalled at {readiness.phase})."
             self.logger.critical(msg)
-            self.close()
-            raise TimeoutError(msg)
+            self._close()
+            raise DebugRelayTimeoutError(msg, readiness.phase)
+        elif self._open_cancelled.is_set():
+            self._close()
+            raise RuntimeError("Opening Azure Relay Bridge was cancelled.")
         elif self.relay_subprocess.poll() is None:
-            threading.Thread(target=self._handle_output, daemon=True).start()
+            self._opened(dict(install=install_duration, **readiness.durations))
+            threading.Thread(target=self._handle_output, args=(self.open_count,), daemon=True).start()
         else:
-            msg = "Azure Relay Bridge stopped too soon!"
+            msg = f"Azure Relay Bridge stopped too soon (at {readiness.phase})!"
             self.logger.critical(msg)
+            self.relay_subprocess = None
+            self._remove_bridge_config()
             raise RuntimeError(msg)
-        
+
+
+    def _open_shared(self, wait_for_connection: bool, start: float):
+        """Adopts a running shared bridge with the same configuration, or launches one.
+        Opening the same configuration in many processes at once launches one bridge: the others wait and adopt it.
+        """
+        registry = default_registry()
+        config = self._shared_config()
+        with registry.shared_lock(config):
+            for record in registry.shared(config):
+                if self._is_healthy_shared(record):
+                    registry.acquire(record, self._shared_token())
+                    self._shared_record = record
+                    self.logger.info(f"Reusing Azure Relay Bridge process {record.pid}.")
+                    self._opened({"reuse": time.monotonic() - start})
+                    return
+                self.logger.warning(f"Stopping failed shared Azure Relay Bridge process {record.pid}.")
+                registry.terminate([record])
+
+            DebugRelay._install_azure_relay_bridge(self.bridge_source, self.bridge_cache)
+            install_duration = time.monotonic() - start
+            log_file = registry.shared_log_file(config)
+            # the bridge outlives this process, so its output cannot go to a pipe
+            log_fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                process = subprocess.Popen(
+                    self._build_command(),
+                    stdin=subprocess.DEVNULL, stderr=subprocess.STDOUT, stdout=log_fd,
+                    close_fds=True, **DebugRelay._spawn_options())
+            finally:
+                os.close(log_fd)
+            try:
+                record = registry.register(process.pid, self.relay_connection_name, self.ports, config, log_file,
+                                           self._shared_token())
+            except OSError:
+                process.kill()
+                raise
+            readiness = self._wait_for_shared_bridge(process, log_file, wait_for_connection)
+            if readiness.output_started or process.poll() is not None:
+                self._remove_bridge_config()
+            if readiness.ready or not wait_for_connection:
+                self._shared_record = record
+                self._shared_process = process
+                self.logger.info("Azure Relay Bridge is connected!" if wait_for_connection
+                                 else "Azure Relay Bridge is running!")
+                self._opened(dict(install=install_duration, **readiness.durations))
+                return
+            exited = process.poll() is not None
+            registry.terminate([record])
+            self._remove_bridge_config()
+        if self._open_cancelled.is_set():
+            raise RuntimeError("Opening Azure Relay Bridge was cancelled.")
+        if exited:
+            msg = f"Azure Relay Bridge stopped too soon (at {readiness.phase})!"
+            self.logger.critical(msg)
+            raise RuntimeError(msg)
+        msg = f"Azure Relay Bridge took too long to connect (stalled at {readiness.phase})."
+        self.logger.critical(msg)
+        raise DebugRelayTimeoutError(msg, readiness.phase)
+
+
+    def _wait_for_shared_bridge(self, process: subprocess.Popen, log_file: str,
+                                wait_for_connection: bool) -> ReadinessTracker:
+        """Follows the log file of a shared bridge just launched until it is connected, exits,
+        opening is cancelled or az_relay_connection_wait_time passes.
+        """
+        deadline = time.monotonic() + self.az_relay_connection_wait_time
+        readiness = ReadinessTracker()
+        pending = b""
+        with open(log_file, "rb") as log:
+            while wait_for_connection and not readiness.ready:
+                chunk = log.read()
+                if chunk:
+                    lines = (pending + chunk).split(b"\n")
+                    pending = lines.pop()
+                    for line in lines:
+                        line = line.decode(errors="replace") + "\n"
+                        self.output.handle(line)
+                        if readiness.feed(line):
+                            break
+                    continue
+                if process.poll() is not None or self._open_cancelled.is_set() or time.monotonic() >= deadline:
+                    break
+                time.sleep(_SHARED_LOG_POLL_INTERVAL)
+        return readiness
+
+
+    def _is_healthy_shared(self, record) -> bool:
+        """Returns True if a running shared bridge has connected and has not reported failures since.
+        """
+        readiness = ReadinessTracker()
+        try:
+            with open(record.log_file, "rb") as log:
+                head = log.read(_SHARED_LOG_CHECK_SIZE)
+                log.seek(max(0, os.fstat(log.fileno()).st_size - _SHARED_LOG_CHECK_SIZE))
+                tail = log.read()
+        except (OSError, TypeError):
+            return False
+        for line in head.decode(errors="replace").splitlines():
+            if readiness.feed(line):
+                break
+        return readiness.ready and tail.decode(errors="replace").find(_BRIDGE_FAILURE_MARKER) == -1
+
+
+    def _shared_config(self) -> str:
+        """Returns fingerprint of the bridge configuration (mode, host, ports, connection and credentials).
+        """
+        import hashlib
+
+        key = "\n".join([DebugRelay.relay_version_name] + self._forward_args
+                        + [f"{name}={value}" for name, value in sorted(self._auth_settings.items())])
+        return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+    def _shared_token(self) -> str:
+        """Tells shared bridge users of this process apart.
+        """
+        return str(id(self))
+
+
+    def _release_shared(self, stop: bool):
+        """Stops using the shared bridge. Stops the bridge too if stop is True and no other process uses it.
+        """
+        record = self._shared_record
+        self._shared_record = None
+        self._shared_process = None
+        if record is None:
+            return
+        registry = default_registry()
+        with registry.shared_lock(record.config):
+            holders = registry.release(record, self._shared_token())
+            if not stop:
+                self.logger.info(f"Leaving shared Azure Relay Bridge process {record.pid} running.")
+            elif holders > 0:
+                self.logger.info(f"Shared Azure Relay Bridge process {record.pid} is still used "
+                                 f"by {holders} other relay(s).")
+            elif registry.is_running(record):
+                self.logger.info("Closing Debugging Relay...")
+                registry.terminate([record])
+
+
+    def detach(self):
+        """Stops using a shared relay (see `shared`) without stopping its bridge, even if no other process uses it,
+        so another process or a later run can adopt it. Does nothing if the relay is not open.
+
+        Raises:
+            RuntimeError: the relay is not shared.
+        """
+        if not self.shared:
+            raise RuntimeError("Only shared relays can be detached.")
+        self._cancel_opening()
+        self._release_shared(stop=False)
+
+
+    async def open_async(self, wait_for_connection: bool = True):
+        """Coroutine version of open().
+        Launches Azure Relay Bridge as an asyncio subprocess,
+        so the event loop is never blocked while the bridge connects.
+        Many relays can be opened concurrently on the same loop (e.g. with asyncio.gather).
+
+        Args:
+            wait_for_connection (bool, optional): Wait for Azure Relay Bridge to initialize and connect. Defaults to True.
+
+        Raises:
+            DebugRelayTimeoutError: Raised when it takes longer than az_relay_connection_wait_time secods
+                        for Azure Relay Bridge to initialize and connect.
+        """
+        import asyncio
+
+        prewarm = self._take_prewarm()
+        if prewarm is not None:
+            await asyncio.wait([asyncio.wrap_future(prewarm)])
+            if self._prewarmed(prewarm):
+                return
+        # close existing Azure Relay Bridge process (if running)
+        await self.close_async()
+        start = time.monotonic()
+        if self.engine == RelayEngine.Python:
+            forwarder = self._create_forwarder()
+            try:
+                await asyncio.wait_for(forwarder.start(), self.az_relay_connection_wait_time)
+            except asyncio.TimeoutError:
+                msg = f"Hybrid Connection forwarder took too long to connect (stalled at {self._forwarder_phase()})."
+                self.logger.critical(msg)
+                raise DebugRelayTimeoutError(msg, self._forwarder_phase())
+            self._forwarder = forwarder
+            self._opened({self._forwarder_phase(): time.monotonic() - start})
+            return
+        if self.shared:
+            # adopting or launching a shared bridge waits on a lock file and reads a log file
+            await asyncio.get_event_loop().run_in_executor(None, self._open, wait_for_connection)
+            return
+        # install Azure Relay Bridge (if not yet) without blocking the loop
+        if not DebugRelay._installed_az_relay:
+            await asyncio.get_event_loop().run_in_executor(
+                None, DebugRelay._install_azure_relay_bridge, self.bridge_source, self.bridge_cache)
+        install_duration = time.monotonic() - start
+
+        # start Azure Relay Bridge
+        process = await asyncio.create_subprocess_exec(
+            *self._build_command(),
+            stdin=None, stderr=subprocess.STDOUT, stdout=subprocess.PIPE,
+            close_fds=True, **DebugRelay._spawn_options())
+        self._relay_process_async = process
+        self._register_bridge(process.pid)
+
+        # monotonic deadline for the bridge to initialize and connect
+        deadline = time.monotonic() + self.az_relay_connection_wait_time
+
+        readiness = ReadinessTracker()
+        over_timeout = False
+
+        if wait_for_connection:
+            while not readiness.ready:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    over_timeout = True
+                    break
+                try:
+                    line = await asyncio.wait_for(process.stdout.readline(), remaining)
+                except asyncio.TimeoutError:
+                    over_timeout = True
+                    break
+                if not line:
+                    self.logger.critical("Azure Relay Bridge stopped.")
+                    # returncode is only set once the bridge is reaped
+                    await process.wait()
+                    break
+                line = line.decode(errors="replace")
+                self.output.handle(line)
+                if readiness.feed(line):
+                    self.logger.info("Azure Relay Bridge is connected!")
+        else:
+            self.logger.info("Azure Relay Bridge is running!")
+        if readiness.output_started:
+            # the bridge has read its configuration
+            self._remove_bridge_config()
+
+        if over_timeout:
+            msg = f"Azure Relay Bridge took too long to connect (stalled at {readiness.phase})."
+            self.logger.critical(msg)
+            await self.close_async()
+            raise DebugRelayTimeoutError(msg, readiness.phase)
+        elif process.returncode is None:
+            self._opened(dict(install=install_duration, **readiness.durations))
+            self._async_output_task = asyncio.ensure_future(self._handle_output_async(self.open_count))
+        else:
+            msg = f"Azure Relay Bridge stopped too soon (at {readiness.phase})!"
+            self.logger.critical(msg)
+            self._relay_process_async = None
+            self._remove_bridge_config()
+            raise RuntimeError(msg)
+
 
     def close(self):
-        """Stops Azure Relay Bridge process launched by this object
+        """Stops Azure Relay Bridge process launched by this object.
+        Cancels prewarming (see prewarm()) if it is still in progress,
+        and stops supervising the relay (see RestartPolicy).
         """
-        if self.relay_subprocess is not None:
-            if self.is_running():
+        self._cancel_opening()
+        self._close()
+
+
+    @staticmethod
+    def close_all(deadline: float = 3):
+        """Closes all relays created by this process together:
+        signals all Azure Relay Bridge processes at once and waits for all of them until a single deadline,
+        killing those still running then. Bridges launched with open_async() are signalled, but not awaited.
+
+        Args:
+            deadline (float, optional): How long to wait for all bridges to exit, in seconds. Defaults to 3.
+        """
+        end = time.monotonic() + deadline
+        relays = list(DebugRelay._instances)
+        # cancel prewarming and restarts of all relays at once, rather than one after another
+        cancelled = [relay for relay in relays if not relay._open_cancelled.is_set()]
+        for relay in cancelled:
+            relay._open_cancelled.set()
+        try:
+            for relay in relays:
+                relay._cancel_opening()
+            processes = []
+            for relay in relays:
+                process = relay.relay_subprocess
+                if process is not None and process.poll() is None:
+                    relay.logger.info("Closing Debugging Relay...")
+                    try:
+                        DebugRelay._terminate_process_group(process.pid)
+                    except OSError:
+                        # has just exited
+                        continue
+                    processes.append(process)
+            for process in processes:
+                try:
+                    process.wait(timeout=max(0, end - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            for relay in relays:
+                relay._close()
+        finally:
+            for relay in cancelled:
+                relay._open_cancelled.clear()
+
+
+    def _cancel_opening(self):
+        """Stops supervising the relay and cancels prewarming, before its bridge is closed.
+        """
+        cancelled = self._open_cancelled.is_set()
+        self._open_cancelled.set()
+        try:
+            self._stop_supervisor()
+            prewarm = self._take_prewarm()
+            if prewarm is not None and not prewarm.done():
+                prewarm.exception()
+        finally:
+            if not cancelled:
+                self._open_cancelled.clear()
+
+
+    def _close(self):
+        if self._shared_record is not None:
+            self._release_shared(stop=True)
+        process = self.relay_subprocess
+        if process is not None:
+            if process.poll() is None:
                 self.logger.info("Closing Debugging Relay...")
-                if not DebugRelay.is_windows:
-                    os.killpg(os.getpgid(self.relay_subprocess.pid), signal.SIGTERM)
-                else:
-                    os.kill(self.relay_subprocess.pid, signal.CTRL_C_EVENT)
+                DebugRelay._terminate_process_group(process.pid)
                 try:
-                    self.relay_subprocess.wait(timeout=3)
+                    process.wait(timeout=3)
                 except subprocess.TimeoutExpired:
-                    self.relay_subprocess.kill()
+                    process.kill()
+            self._unregister_bridge(process.pid)
             self.relay_subprocess = None
+        if self._forwarder_thread is not None:
+            self._forwarder_thread.stop()
+            self._forwarder_thread = None
+        # A process started with open_async() cannot be awaited here,
+        # so only make sure it doesn't outlive this object.
+        if self._relay_process_async is not None:
+            if self._relay_process_async.returncode is None:
+                DebugRelay._terminate_process_group(self._relay_process_async.pid)
+            self._unregister_bridge(self._relay_process_async.pid)
+            self._relay_process_async = None
+        self._remove_bridge_config()
+
+
+    async def close_async(self):
+        """Coroutine version of close().
+        Stops Azure Relay Bridge process launched by open_async() without blocking the event loop.
+        """
+        import asyncio
+
+        if self._supervisor is not None:
+            await asyncio.get_event_loop().run_in_executor(None, self._stop_supervisor)
+        if (self._prewarm_future is not None or self.relay_subprocess is not None
+                or self._forwarder_thread is not None or self._shared_record is not None):
+            # launched by prewarm() or open(), or shared
+            await asyncio.get_event_loop().run_in_executor(None, self.close)
+        if self._forwarder is not None:
+            forwarder = self._forwarder
+            self._forwarder = None
+            self.logger.info("Closing Debugging Relay...")
+            await forwarder.stop()
+        process = self._relay_process_async
+        self._relay_process_async = None
+        if process is not None and process.returncode is None:
+            self.logger.info("Closing Debugging Relay...")
+            DebugRelay._terminate_process_group(process.pid)
+            try:
+                await asyncio.wait_for(process.wait(), 3)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        if process is not None:
+            self._unregister_bridge(process.pid)
+        waiter = self._exit_waiter
+        self._exit_waiter = None
+        if waiter is not None and not waiter.done():
+            # exit callbacks run before close_async() returns
+            await asyncio.wait([waiter])
+        self._remove_bridge_config()
+        output_task = self._async_output_task
+        self._async_output_task = None
+        if output_task is not None and not output_task.done():
+            output_task.cancel()
 
 
     def background_launch(self) -> subprocess.Popen:
         """Launches Azure Relay Bridge process in detached mode
         Doesn't assign self.relay_subprocess, az_relay_bridge_subprocess() will return None.
+        Not supported with RelayEngine.Python, which always runs in-process.
         """
+        if self.engine == RelayEngine.Python:
+            raise RuntimeError("RelayEngine.Python cannot be launched in detached mode. Use open().")
+        if self.shared:
+            raise RuntimeError("Shared relays are detached already. Use open().")
         # close existing Azure Relay Bridge process (if running)
         self.close()
         # install Azure Relay Bridge (if not yet)
-        DebugRelay._install_azure_relay_bridge()
-
-        command = f"{DebugRelay.relay_app_name} {self.connection_option} {self.auth_option}"
-        if DebugRelay._relay_config_file is not None:
-            command += f" -f \"{DebugRelay._relay_config_file}\""
+        DebugRelay._install_azure_relay_bridge(self.bridge_source, self.bridge_cache)
 
         # start Azure Relay Bridge
         detached_relay_subprocess = subprocess.Popen(
-            command,
+            self._build_command(),
             stdin=None, stderr=None, stdout=None,
-            shell=True, close_fds=True)
+            close_fds=True, **DebugRelay._spawn_options())
+        # detached bridges are only unregistered once found gone (see kill_relays())
+        self._register_bridge(detached_relay_subprocess.pid)
         # wait a second
         time.sleep(1)
+        # by now the bridge has read its configuration
+        self._remove_bridge_config()
         if detached_relay_subprocess.poll() is not None:
             msg = f"Azure Relay Bridge failed to launch."
             self.logger.critical(msg)
@@ -272,135 +870,521 @@ class DebugRelay(object):
 
 
     def wait(self):
+        record = self._shared_record
+        if record is not None:
+            if self._shared_process is not None:
+                self._shared_process.wait()
+            else:
+                # a process of another launcher cannot be waited for as a child
+                wait_for_process(record, _SHARED_WAIT_INTERVAL)
+            self._release_shared(stop=False)
         if self.relay_subprocess is not None:
             self.relay_subprocess.wait()
             self.relay_subprocess = None
+        if self._forwarder_thread is not None:
+            self._forwarder_thread.wait()
+            self._forwarder_thread = None
+
+
+    async def wait_async(self):
+        """Coroutine version of wait().
+        Waits for Azure Relay Bridge process to exit without blocking the event loop.
+        """
+        import asyncio
+
+        if self._relay_process_async is not None:
+            await self._relay_process_async.wait()
+            self._relay_process_async = None
+        if self._forwarder is not None:
+            await self._forwarder.wait()
+            self._forwarder = None
+        if self.relay_subprocess is not None or self._forwarder_thread is not None:
+            # launched by prewarm() or open(): wait for the exit notification, not in a blocked thread
+            future = self._exit_future
+            if future is not None and not future.done():
+                await asyncio.wrap_future(future)
+            await asyncio.get_event_loop().run_in_executor(None, self.wait)
 
 
     def is_running(self) -> bool:
+        """Whether the relay opened by open(), open_async() or prewarm() (or the adopted shared bridge) is running.
+        Safe to call from any thread.
+        """
+        if self._shared_record is not None:
+            return default_registry().is_running(self._shared_record)
         if self.relay_subprocess is not None:
             if self.relay_subprocess.poll() is None:
                 return True
             else:
                 self.relay_subprocess = None
+        if self._forwarder_thread is not None:
+            if self._forwarder_thread.is_running():
+                return True
+            else:
+                self._forwarder_thread = None
+        # opened by open_async(): the event loop reaps the bridge and clears these (see is_running_async())
+        process = self._relay_process_async
+        if process is not None and process.returncode is None:
+            return True
+        forwarder = self._forwarder
+        if forwarder is not None and forwarder.is_running:
+            return True
         return False
 
 
-    def _handle_output(self):
-        for line in iter(self.relay_subprocess.stdout.readline, ''):
-            if line.find("Microsoft.Azure.Relay.Bridge.EventTraceActivity, exception = ") != -1:
+    async def is_running_async(self) -> bool:
+        """Coroutine version of is_running().
+        """
+        if self._relay_process_async is not None and self._relay_process_async.returncode is not None:
+            self._relay_process_async = None
+        if self._forwarder is not None and not self._forwarder.is_running:
+            self._forwarder = None
+        return self.is_running()
+
+
+    def recent_output(self, lines: int = None) -> typing.List[str]:
+        """Returns recent Azure Relay Bridge output lines (oldest first), e.g. for post-mortems.
+        The number of lines kept is set by OutputPolicy.buffer_lines.
+
+        Args:
+            lines (int, optional): Maximum number of lines to return. Defaults to all buffered lines.
+        """
+        return self.output.recent(lines)
+
+
+    def events(self, timeout: float = None) -> typing.Iterator[RelayEvent]:
+        """Returns an iterator over relay events (see relay_events.RelayEvent) from now on:
+        forwards starting and stopping, connections accepted and closed, bytes transferred and errors.
+
+        Args:
+            timeout (float, optional): Stop iterating after this many seconds without events.
+                Defaults to None (iterate until the iterator is closed).
+        """
+        return self.event_stream.iterate(timeout)
+
+
+    def events_async(self, timeout: float = None) -> typing.AsyncIterator[RelayEvent]:
+        """Async version of events(), bound to the current event loop.
+        """
+        return self.event_stream.iterate_async(timeout)
+
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """Returns running relay counters (see relay_events.EventStream.stats()).
+        Supervised relays (see RestartPolicy) also report restarts, failed_restarts,
+        downtime_seconds and down (see relay_supervisor.RelaySupervisor.stats()).
+        """
+        stats = self.event_stream.stats()
+        supervisor = self._supervisor or self._last_supervisor
+        if supervisor is not None:
+            stats.update(supervisor.stats())
+        return stats
+
+
+    def uptime(self) -> typing.Optional[float]:
+        """Returns how long the relay has been connected, in seconds (None if it is not running).
+        """
+        if self._connected_at is None or not self.is_running():
+            return None
+        return time.monotonic() - self._connected_at
+
+
+    def bridge_pid(self) -> typing.Optional[int]:
+        """Returns process ID of Azure Relay Bridge launched by open() or open_async() (or adopted), or None.
+        """
+        if self._shared_record is not None:
+            return self._shared_record.pid
+        if self.relay_subprocess is not None:
+            return self.relay_subprocess.pid
+        if self._relay_process_async is not None:
+            return self._relay_process_async.pid
+        return None
+
+
+    def on_exit(self, callback: typing.Callable[[typing.Any, typing.Optional[int]], None]):
+        """Registers callback(debug_relay, returncode), called whenever a relay opened by this object stops:
+        Azure Relay Bridge exits (with its return code) or the Python forwarder stops (returncode is None),
+        whether it has failed or has been closed.
+        Exits are noticed at once, without polling. Callbacks run on a watcher thread
+        (or on the event loop with open_async()) and should return quickly.
+
+        Returns:
+            the callback, so on_exit can be used as a decorator
+        """
+        self._exit_callbacks.append(callback)
+        return callback
+
+
+    def exit_future(self) -> typing.Optional["concurrent.futures.Future"]:
+        """Returns a future resolved with the return code (None with RelayEngine.Python)
+        once the relay opened last stops, or None if it has never been opened
+        or uses a shared bridge launched by another process.
+        In coroutines, await `asyncio.wrap_future(debug_relay.exit_future())`.
+        """
+        return self._exit_future
+
+
+    def _opened(self, durations: typing.Dict[str, float]):
+        self.open_count += 1
+        self._connected_at = time.monotonic()
+        self.open_durations = durations
+        metrics = relay_metrics.registry
+        if metrics is not None:
+            metrics.relay_opened(self, durations)
+        if self.restart_policy is not None and self._supervisor is None:
+            self._last_supervisor = None
+            self._supervisor = RelaySupervisor(self, self.restart_policy, self.logger).start()
+        self._watch_exit()
+
+
+    def _watch_exit(self):
+        """Resolves the exit future, calls on_exit() callbacks and notifies the supervisor
+        once the relay just opened stops, without polling.
+        """
+        import concurrent.futures
+
+        if self._shared_record is not None and self._shared_process is None:
+            # adopted from another process, which is notified when it exits
+            self._exit_future = None
+            return
+        generation = self.open_count
+        future = self._exit_future = concurrent.futures.Future()
+
+        pid = self.bridge_pid()
+
+        def exited(returncode: int = None):
+            if pid is not None:
+                self._unregister_bridge(pid)
+            self._exited(returncode, generation, future)
+
+        if self.relay_subprocess is not None:
+            watch_exit(self.relay_subprocess, exited)
+        elif self._shared_process is not None:
+            watch_exit(self._shared_process, exited)
+        elif self._forwarder_thread is not None:
+            self._forwarder_thread.on_stop(exited)
+        elif self._relay_process_async is not None:
+            import asyncio
+
+            # the event loop's child watcher reaps the process
+            waiter = self._exit_waiter = asyncio.ensure_future(self._relay_process_async.wait())
+            waiter.add_done_callback(
+                lambda task: exited(task.result()) if not task.cancelled() and task.exception() is None else None)
+        elif self._forwarder is not None:
+            self._forwarder.on_stop(exited)
+
+
+    def _exited(self, returncode: typing.Optional[int], generation: int, future: "concurrent.futures.Future"):
+        if not future.done():
+            future.set_result(returncode)
+        for callback in list(self._exit_callbacks):
+            try:
+                callback(self, returncode)
+            except Exception:
+                self.logger.exception("Debugging Relay exit callback failed.")
+        if returncode is None:
+            self._relay_down("Hybrid Connection forwarder stopped", generation)
+        else:
+            self._relay_down(f"Azure Relay Bridge exited with code {returncode}", generation)
+
+
+    def _stop_supervisor(self):
+        supervisor = self._supervisor
+        if supervisor is None:
+            return
+        # cancel a restart in progress; until the supervisor has stopped,
+        # a restart that completes meanwhile must not start another one
+        cancelled = self._open_cancelled.is_set()
+        self._open_cancelled.set()
+        try:
+            supervisor.stop()
+        finally:
+            if not cancelled:
+                self._open_cancelled.clear()
+        self._supervisor = None
+        self._last_supervisor = supervisor
+
+
+    def _restart(self):
+        """Reopens the relay in place, with the same ports. Called by RelaySupervisor.
+        """
+        self._close()
+        # a stopped forwarder of open_async() has nothing left to stop
+        self._forwarder = None
+        self._open(wait_for_connection=True)
+
+
+    def _with_ports(self, ports: typing.List[str]) -> any:
+        """Returns a new DebugRelay object with the same configuration but different ports
+        """
+        return DebugRelay(
+            self._access_key_or_connection_string, self.relay_connection_name, self.debug_mode,
+            self.hybrid_connection_url, self.host, [str(port) for port in ports],
+            self.az_relay_connection_wait_time, self.logger, self.engine,
+            self.bridge_source, self.bridge_cache, self.output_policy, self.restart_policy, self.shared)
+
+
+    def _create_forwarder(self) -> "hybrid_connection.HybridConnectionForwarder":
+        return _hybrid_connection().HybridConnectionForwarder(
+            self._access_key_or_connection_string,
+            self.relay_connection_name,
+            remote_forward=self.debug_mode == DebugMode.WaitForConnection,
+            host=self.host,
+            ports=self.ports,
+            logger=self.logger,
+            on_event=self.event_stream.publish)
+
+
+    def _forwarder_phase(self) -> str:
+        if self.debug_mode == DebugMode.WaitForConnection:
+            return ReadinessTracker.PHASE_REMOTE_FORWARD
+        return ReadinessTracker.PHASE_LOCAL_FORWARD
+
+
+    def _build_command(self) -> typing.List[str]:
+        """Returns Azure Relay Bridge command line (argv) for a new launch.
+        Credentials go to a configuration file only the current user can read (see _write_bridge_config()),
+        rather than to the command line anyone can see in the process list.
+        """
+        import shutil
+
+        executable = shutil.which(DebugRelay.relay_app_name)
+        if executable is None:
+            raise RuntimeError(f"Cannot find {DebugRelay.relay_app_name} executable.")
+        return [executable] + self._forward_args + ["-f", self._write_bridge_config()]
+
+
+    def _write_bridge_config(self) -> str:
+        """Writes Azure Relay Bridge configuration file with credentials for one launch, and returns its path.
+        Settings of the installed configuration file (see _install_azure_relay_bridge()) are included.
+        """
+        import tempfile
+
+        self._remove_bridge_config()
+        settings = ""
+        base_config = DebugRelay._relay_config_file
+        if base_config is not None and os.path.exists(base_config):
+            with open(base_config) as base_file:
+                settings = base_file.read().rstrip("\n") + "\n"
+        if "ExitOnForwardFailure" not in settings:
+            settings = "ExitOnForwardFailure: true\n" + settings
+        for name, value in self._auth_settings.items():
+            # YAML double-quoted string
+            value = value.replace("\\", "\\\\").replace("\"", "\\\"")
+            settings += f"{name}: \"{value}\"\n"
+        # mkstemp creates the file readable and writable by the current user only
+        config_fd, config_file = tempfile.mkstemp(prefix=f"{DebugRelay.relay_app_name}-", suffix=".yml")
+        with os.fdopen(config_fd, "w") as config:
+            config.write(settings)
+        self._bridge_config_file = config_file
+        return config_file
+
+
+    def _remove_bridge_config(self):
+        config_file = self._bridge_config_file
+        self._bridge_config_file = None
+        if config_file is not None:
+            try:
+                os.remove(config_file)
+            except OSError:
+                pass
+
+
+    @staticmethod
+    def _spawn_options() -> typing.Dict[str, typing.Any]:
+        """Returns subprocess options launching Azure Relay Bridge in its own process group,
+        so it can be stopped together with its children and doesn't get Ctrl+C of this process.
+        """
+        if DebugRelay.is_windows:
+            return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        # unlike preexec_fn=os.setpgrp, keeps subprocess on its fast (vfork/posix_spawn) path
+        return {"start_new_session": True}
+
+
+    def _register_bridge(self, pid: int):
+        """Adds a bridge just launched to the registry of the current user (see kill_relays()).
+        """
+        try:
+            default_registry().register(pid, self.relay_connection_name, self.ports)
+        except OSError as ex:
+            self.logger.warning(f"Cannot register Azure Relay Bridge process {pid}: {ex}")
+
+
+    def _unregister_bridge(self, pid: int):
+        default_registry().unregister(pid)
+
+
+    @staticmethod
+    def _terminate_process_group(pid: int):
+        if not DebugRelay.is_windows:
+            os.killpg(os.getpgid(pid), signal.SIGTERM)
+        else:
+            os.kill(pid, signal.CTRL_C_EVENT)
+
+
+    def _handle_output(self, generation: int):
+        for line in iter(self._output_reader.readline, ''):
+            if line.find(_BRIDGE_FAILURE_MARKER) != -1:
+                self.output.handle(line, log=False)
                 msg = f"[Azure Relay Bridge FAILURE]: {line}"
                 self.logger.critical(msg)
-                self.close()
+                if self._supervisor is None:
+                    self.close()
+                else:
+                    # the bridge may keep running
+                    self._relay_down(msg.strip(), generation)
                 break
             else:
-                self.logger.info(line)
+                self.output.handle(line)
+
+
+    async def _handle_output_async(self, generation: int):
+        process = self._relay_process_async
+        if process is None:
+            # closed before this task started
+            return
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            line = line.decode(errors="replace")
+            if line.find(_BRIDGE_FAILURE_MARKER) != -1:
+                self.output.handle(line, log=False)
+                msg = f"[Azure Relay Bridge FAILURE]: {line}"
+                self.logger.critical(msg)
+                if self._supervisor is None:
+                    # don't let close_async() cancel this very task
+                    self._async_output_task = None
+                    await self.close_async()
+                else:
+                    # the bridge may keep running
+                    self._relay_down(msg.strip(), generation)
+                break
+            else:
+                self.output.handle(line)
+
+
+    def _relay_down(self, reason: str, generation: int):
+        supervisor = self._supervisor
+        if supervisor is not None:
+            supervisor.relay_down(reason, generation)
 
 
     @staticmethod
     def from_config(config_file: str, 
                     debug_mode: DebugMode = DebugMode.WaitForConnection,
                     host: str = "127.0.0.1",
-                    ports: typing.Union[str, int, typing.List[str], typing.List[int]] = "5678") -> any:
-        if os.path.exists(config_file):
-            with open(config_file) as cfg_file:
-                config = json.load(cfg_file)
-                relay_connection_name = config["AZRELAY_CONNECTION_NAME"]
-                conn_str = config["AZRELAY_CONNECTION_STRING"]
-                return DebugRelay(
-                    access_key_or_connection_string=conn_str,
-                    relay_connection_name=relay_connection_name,
-                    debug_mode=debug_mode,
-                    host=host,
-                    ports=ports)
-        else:
+                    ports: typing.Union[str, int, typing.List[str], typing.List[int]] = "5678",
+                    engine: RelayEngine = RelayEngine.AzureRelayBridge,
+                    restart_policy: RestartPolicy = None,
+                    shared: bool = False,
+                    resolver: ConfigResolver = None) -> any:
+        """Creates DebugRelay with AZRELAY_CONNECTION_STRING and AZRELAY_CONNECTION_NAME of a JSON configuration file.
+        Settings missing in the file are looked up with secret providers of resolver.
+        Returns None if the file doesn't exist or settings are missing.
+
+        Args:
+            resolver (ConfigResolver, optional): Defaults to None (relay_config.default_resolver()).
+        """
+        if not os.path.exists(config_file):
             return None
+        config = (resolver or default_resolver()).resolve(config_file=config_file, use_environment=False)
+        if not config.complete:
+            return None
+        return DebugRelay(
+            access_key_or_connection_string=config.connection_string,
+            relay_connection_name=config.connection_name,
+            debug_mode=debug_mode,
+            host=host,
+            ports=ports,
+            engine=engine,
+            restart_policy=restart_policy,
+            shared=shared)
     
 
     @staticmethod
     def from_environment(debug_mode: DebugMode = DebugMode.WaitForConnection,
                          host: str = "127.0.0.1",
-                         ports: typing.Union[str, int, typing.List[str], typing.List[int]] = "5678") -> any:
-        relay_connection_name = os.environ.get("AZRELAY_CONNECTION_NAME")
-        conn_str = os.environ.get("AZRELAY_CONNECTION_STRING")
-        if not relay_connection_name or not conn_str:
+                         ports: typing.Union[str, int, typing.List[str], typing.List[int]] = "5678",
+                         engine: RelayEngine = RelayEngine.AzureRelayBridge,
+                         restart_policy: RestartPolicy = None,
+                         shared: bool = False,
+                         resolver: ConfigResolver = None) -> any:
+        """Creates DebugRelay with AZRELAY_CONNECTION_STRING and AZRELAY_CONNECTION_NAME environment variables.
+        Settings missing in the environment are looked up with secret providers of resolver.
+        Returns None if settings are missing.
+
+        Args:
+            resolver (ConfigResolver, optional): Defaults to None (relay_config.default_resolver()).
+        """
+        config = (resolver or default_resolver()).resolve(config_file=None)
+        if not config.complete:
             print("AZRELAY_CONNECTION_STRING and AZRELAY_CONNECTION_NAME variables must be assigned.")
             return None
         else:
             return DebugRelay(
-                access_key_or_connection_string=conn_str,
-                relay_connection_name=relay_connection_name,
+                access_key_or_connection_string=config.connection_string,
+                relay_connection_name=config.connection_name,
                 debug_mode=debug_mode,
                 host=host,
-                ports=ports)
+                ports=ports,
+                engine=engine,
+                restart_policy=restart_policy,
+                shared=shared)
 
 
     @staticmethod
-    def kill_relays():
-        """Kills all Azure Relay Bridge processes (azrelay) - no matter who and how launched them
+    def kill_relays(relay_connection_name: str = None,
+                    ports: typing.Union[str, int, typing.List[str], typing.List[int]] = None,
+                    deadline: float = 3) -> int:
+        """Stops Azure Relay Bridge processes launched by azdebugrelay for the current user on this machine
+        (e.g. left behind by crashed jobs), optionally only those of relay_connection_name and/or using any of ports.
+        Bridges are signalled all at once, and those still running after deadline seconds are killed.
+        Bridges of other users, and ones not launched by azdebugrelay, are left alone
+        (see relay_registry.RelayRegistry).
+
+        Returns:
+            int: number of bridges stopped
         """
-        if DebugRelay.is_windows:
-            subprocess.run(
-                f"taskkill /IM \"{DebugRelay.relay_app_name}.exe\" /F", shell=True)
-        else:
-            subprocess.run(f"pkill -9 {DebugRelay.relay_app_name}", shell=True)
+        if isinstance(ports, (str, int)):
+            ports = str(ports).strip().replace(",", " ").split()
+        registry = default_registry()
+        return registry.terminate(registry.records(relay_connection_name, ports), deadline)
 
 
     @staticmethod
-    def _install_azure_relay_bridge():
+    def _install_azure_relay_bridge(bridge_source: str = None, bridge_cache: str = None):
         """Installs or updates Azure Relay Bridge
+
+        Args:
+            bridge_source (str, optional): Bundle directory, archive file, or HTTP(S) mirror to install from.
+                Defaults to AZDEBUGRELAY_BRIDGE_SOURCE environment variable, then to the default download URLs.
+            bridge_cache (str, optional): Directory to cache downloaded archives in.
+                Defaults to AZDEBUGRELAY_BRIDGE_CACHE environment variable.
         """
         if DebugRelay._installed_az_relay:
             return
-        DebugRelay._installed_az_relay = True
+        with DebugRelay._install_lock:
+            if not DebugRelay._installed_az_relay:
+                installer = _bridge_installer()
+                DebugRelay._install_azure_relay_bridge_locked(
+                    bridge_source or os.environ.get(installer.BRIDGE_SOURCE_ENV),
+                    bridge_cache or os.environ.get(installer.BRIDGE_CACHE_ENV))
+                DebugRelay._installed_az_relay = True
+
 
+    @staticmethod
+    def _install_azure_relay_bridge_locked(bridge_source: str, bridge_cache: str):
         azrelay_folder = os.path.join(
-            Path.home(), DebugRelay.relay_dir_name, DebugRelay.relay_version_name)
-        relay_file = os.path.join(
-            azrelay_folder, DebugRelay.relay_app_name)
+            os.path.expanduser("~"), DebugRelay.relay_dir_name, DebugRelay.relay_version_name)
         DebugRelay._relay_config_file = os.path.join(
             azrelay_folder, DebugRelay.relay_app_name) + ".yml"
 
-        if DebugRelay.is_windows:
-            relay_file += ".exe"
-
-        exists = os.path.exists(azrelay_folder)
-        if not exists:
-            if DebugRelay.is_windows:
-                download = DebugRelay.DEFAULT_AZ_RELAY_BRIDGE_WINDOWS_DOWLOAD
-            else:
-                plat = platform.platform().lower()
-                if plat.startswith("macos"):
-                    download = DebugRelay.DEFAULT_AZ_RELAY_BRIDGE_MACOS_DOWLOAD
-                elif "-ubuntu" in plat or plat.startswith("ubuntu"):
-                    download = DebugRelay.DEFAULT_AZ_RELAY_BRIDGE_UBUNTU_DOWLOAD
-                else: # assume Debian
-                    download = DebugRelay.DEFAULT_AZ_RELAY_BRIDGE_DEBIAN_DOWLOAD
-                    if "debian" not in plat:
-                        logging.warning(f"You are running an unsupported OS: {plat}. "\
-                            "Using Debian build of Azure Relay Bridge.")
-            
-            ctx = ssl.create_default_context()
-            ctx.check_hostname = False
-            ctx.verify_mode = ssl.CERT_NONE
-            
-            if download.lower().endswith(".zip"):
-                zip_file, _ = urllib.request.urlretrieve(download)
-                with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                    zip_ref.extractall(azrelay_folder)
-                os.remove(zip_file)
-            else:
-                filestream = urllib.request.urlopen(download, context=ctx)
-                with tarfile.open(fileobj=filestream, mode="r|gz") as thetarfile:
-                    thetarfile.extractall(azrelay_folder)
-
-            if not DebugRelay.is_windows:
-                st = os.stat(relay_file)
-                os.chmod(relay_file, st.st_mode | stat.S_IEXEC)
-
-        if not os.path.exists(DebugRelay._relay_config_file):
-            with open(DebugRelay._relay_config_file, "a") as yml:
-                yml.write("ExitOnForwardFailure: true")
+        # Ranks of a distributed job may get here simultaneously:
+        # one of them downloads, others wait for it and reuse the installation.
+        _bridge_installer().install_atomically(
+            azrelay_folder, DebugRelay.relay_version_name,
+            lambda folder: DebugRelay._populate_azure_relay_bridge(folder, bridge_source, bridge_cache))
 
         existing_path_var = os.environ["PATH"]
         paths = existing_path_var.split(os.pathsep)
@@ -408,7 +1392,83 @@ class DebugRelay(object):
             os.environ["PATH"] = azrelay_folder + os.pathsep + os.environ["PATH"]
 
 
-def _main(connect: bool, host: str, ports: typing.List[str] = ["5678"], connection_string: str = None, relay_connection_name: str = None, config_file: str = None):
+    @staticmethod
+    def _bridge_downloads() -> typing.Dict[str, str]:
+        """Default Azure Relay Bridge download URLs by platform name
+        """
+        return {
+            "ubuntu": DebugRelay.DEFAULT_AZ_RELAY_BRIDGE_UBUNTU_DOWLOAD,
+            "debian": DebugRelay.DEFAULT_AZ_RELAY_BRIDGE_DEBIAN_DOWLOAD,
+            "macos": DebugRelay.DEFAULT_AZ_RELAY_BRIDGE_MACOS_DOWLOAD,
+            "windows": DebugRelay.DEFAULT_AZ_RELAY_BRIDGE_WINDOWS_DOWLOAD
+        }
+
+
+    @staticmethod
+    def _bridge_checksums() -> typing.Dict[str, typing.Optional[str]]:
+        """Pinned SHA-256 of the default Azure Relay Bridge downloads by platform name
+        """
+        return {
+            "ubuntu": DebugRelay.DEFAULT_AZ_RELAY_BRIDGE_UBUNTU_SHA256,
+            "debian": DebugRelay.DEFAULT_AZ_RELAY_BRIDGE_DEBIAN_SHA256,
+            "macos": DebugRelay.DEFAULT_AZ_RELAY_BRIDGE_MACOS_SHA256,
+            "windows": DebugRelay.DEFAULT_AZ_RELAY_BRIDGE_WINDOWS_SHA256
+        }
+
+
+    @staticmethod
+    def _bridge_platform() -> str:
+        """Azure Relay Bridge platform name of this machine
+        """
+        if DebugRelay.is_windows:
+            return "windows"
+        import platform
+
+        plat = platform.platform().lower()
+        if plat.startswith("macos"):
+            return "macos"
+        elif "-ubuntu" in plat or plat.startswith("ubuntu"):
+            return "ubuntu"
+        else: # assume Debian
+            if "debian" not in plat:
+                logging.warning(f"You are running an unsupported OS: {plat}. "\
+                    "Using Debian build of Azure Relay Bridge.")
+            return "debian"
+
+
+    @staticmethod
+    def _populate_azure_relay_bridge(azrelay_folder: str, bridge_source: str = None, bridge_cache: str = None):
+        """Downloads (or takes from a bundle or cache) and extracts Azure Relay Bridge into azrelay_folder
+        """
+        relay_file = os.path.join(
+            azrelay_folder, DebugRelay.relay_app_name)
+        if DebugRelay.is_windows:
+            relay_file += ".exe"
+
+        bridge_platform = DebugRelay._bridge_platform()
+        installer = _bridge_installer()
+        archive = installer.resolve_archive(
+            bridge_source, bridge_platform, DebugRelay.relay_version_name,
+            DebugRelay._bridge_downloads()[bridge_platform],
+            DebugRelay._bridge_checksums()[bridge_platform])
+        # partial downloads are kept next to installations, so an interrupted download can be resumed
+        downloads_folder = os.path.join(os.path.dirname(azrelay_folder), "downloads")
+        archive_path = installer.fetch_archive(archive, downloads_folder, bridge_cache, extract_to=azrelay_folder)
+        if os.path.dirname(archive_path) == downloads_folder:
+            os.remove(archive_path)
+
+        if not DebugRelay.is_windows:
+            st = os.stat(relay_file)
+            os.chmod(relay_file, st.st_mode | stat.S_IEXEC)
+
+        with open(os.path.join(azrelay_folder, DebugRelay.relay_app_name) + ".yml", "w") as yml:
+            yml.write("ExitOnForwardFailure: true")
+
+
+def _main(connect: bool, host: str, ports: typing.List[str] = ["5678"], connection_string: str = None, relay_connection_name: str = None, config_file: str = None,
+          engine: RelayEngine = RelayEngine.AzureRelayBridge, daemon_options: typing.Dict[str, typing.Any] = None,
+          restart_policy: RestartPolicy = None, kill_existing: bool = False, shared: bool = False,
+          hybrid_connection_url: str = None):
     """CLI main function
 
     Args:
@@ -417,7 +1477,17 @@ def _main(connect: bool, host: str, ports: typing.List[str] = ["5678"], connecti
         port (int): Azure Relay Bridge port
         connection_string (str): Optional connection string of an Azure Relay Hybrid Connection
         relay_connection_name (str): Optional hybrid connection name
-        config_file (str): Optional configuration file path. Only used if connection_string is None.
+        config_file (str): Optional configuration file path, for settings given neither as arguments
+            nor in environment variables (see relay_config.ConfigResolver).
+        engine (RelayEngine): Azure Relay Bridge subprocess or in-process Python forwarder
+        daemon_options (dict): Optional RelayDaemon arguments (max_ports, socket_path, idle_timeout).
+            If provided, runs a node-level relay daemon handing out ports starting with the first port.
+        restart_policy (RestartPolicy): Optional. If provided, the relay runs attached
+            and is restarted whenever Azure Relay Bridge fails or exits.
+        kill_existing (bool): Stop bridges launched earlier by azdebugrelay with the same connection name or ports.
+        shared (bool): Reuse a running bridge with the same configuration, or leave the one launched for others to reuse.
+        hybrid_connection_url (str): Optional Hybrid Connection URL, required if the connection string is an access key.
+            Defaults to AZRELAY_HYBRID_CONNECTION_URL (e.g. set for daemons by relay_daemon.connect_or_spawn_daemon).
 
     Raises:
         ValueError: Invalid arguments
@@ -427,33 +1497,64 @@ def _main(connect: bool, host: str, ports: typing.List[str] = ["5678"], connecti
 
     mode = DebugMode.Connect if connect else DebugMode.WaitForConnection
 
-    if connection_string is not None:
-        if relay_connection_name is None:
-            msg = "Both connection string and connection name must be provided."
-            print(msg)
-            raise ValueError(msg)
-        debug_relay = DebugRelay(
-            connection_string, relay_connection_name, mode, None, host, ports=ports)
-    elif config_file is not None:
-        if os.path.exists(config_file):
-            debug_relay = DebugRelay.from_config(config_file, debug_mode=mode, host=host, ports=ports)
-        else:
-            config_file = os.path.normpath(config_file)
-            logging.warning(f"Cannot load configuration file {config_file}. Trying with environment variables.")
-            debug_relay = None
-    else:
-        debug_relay = None
-    
-    if debug_relay is None:
-        debug_relay = DebugRelay.from_environment(
-                debug_mode=mode, host=host, ports=ports)
-    
-    if debug_relay is None:
+    if connection_string is not None and relay_connection_name is None:
+        msg = "Both connection string and connection name must be provided."
+        print(msg)
+        raise ValueError(msg)
+    if config_file is not None and not os.path.exists(config_file):
+        config_file = os.path.normpath(config_file)
+        logging.warning(f"Cannot load configuration file {config_file}. Trying with environment variables.")
+        config_file = None
+
+    # explicit arguments, then environment variables, the configuration file and secret providers
+    config = default_resolver().resolve(connection_string, relay_connection_name, config_file=config_file)
+    if not config.complete:
         raise Exception("Cannot create a Debugging Relay object. Configuration may be missing.")
+    logging.info("Debugging Relay configuration: " +
+                 ", ".join(f"{setting} from {source}" for setting, source in config.sources.items()))
+    if hybrid_connection_url is None:
+        hybrid_connection_url, _ = default_resolver().resolve_setting(HYBRID_CONNECTION_URL, config_file=config_file)
+    debug_relay = DebugRelay(
+        config.connection_string, config.connection_name, mode, hybrid_connection_url, host, ports=ports,
+        engine=engine, restart_policy=restart_policy, shared=shared)
+
+    if kill_existing:
+        print("Closing existing Azure Debugging Relay processes.")
+        DebugRelay.kill_relays(debug_relay.relay_connection_name)
+        DebugRelay.kill_relays(ports=debug_relay.ports)
+
+    if daemon_options is not None:
+        if __package__:
+            from .relay_daemon import RelayDaemon
+        else:
+            from relay_daemon import RelayDaemon
+        print(f"Starting Debugging Relay daemon...")
+        RelayDaemon(debug_relay, base_port=int(ports[0]), **daemon_options).run()
+        return
 
     print(f"Starting Debugging Relay...")
-    relay = debug_relay.background_launch()
-    relay.wait()
+    if restart_policy is not None:
+        # supervised relays replace their bridge, so keep running until interrupted
+        debug_relay.open()
+        try:
+            while True:
+                time.sleep(3600)
+        finally:
+            debug_relay.close()
+    elif shared:
+        # holds the shared bridge until it exits or this process is interrupted
+        debug_relay.open()
+        try:
+            debug_relay.wait()
+        finally:
+            debug_relay.close()
+    # relays are only measured while opened by this process
+    elif debug_relay.engine == RelayEngine.Python or relay_metrics.registry is not None:
+        debug_relay.open()
+        debug_relay.wait()
+    else:
+        relay = debug_relay.background_launch()
+        relay.wait()
 
 
 def _cli_main(argv):
@@ -463,8 +1564,9 @@ def _cli_main(argv):
         argv: Command Line arguments
 
         --no-kill - optional,
-            If presented, prevents existing Azure Relay Bridge processes from being nuked.
-            If omitted, all existing Azure Azure Relay Bridge processes will be killed.
+            If presented, prevents existing Azure Relay Bridge processes from being stopped.
+            If omitted, Azure Relay Bridge processes launched earlier by azdebugrelay for the current user
+            with the same connection name or ports will be stopped (all of them with --mode none).
         --mode - required,
             Debugging mode: listen, connect or none (default).
         --host - optional, defaults to 127.0.0.1, 
@@ -476,8 +1578,45 @@ def _cli_main(argv):
         --connection-name - optional, defaults to None
             Hybrid connection name. Required if --connection-string is specified.
         --config_file - optional, defaults to None
-            Configuration file path. Only used if connection_string is not specified.
+            Configuration file path. Used for settings given neither as arguments nor in environment variables.
+        --engine - optional, defaults to azbridge
+            Tunneling engine: azbridge (Azure Relay Bridge) or python (in-process forwarder).
+        --make-bundle - optional, defaults to None
+            If presented, builds a versioned Azure Relay Bridge bundle in this directory and exits.
+            Use the bundle directory (or its HTTP mirror) as AZDEBUGRELAY_BRIDGE_SOURCE.
+        --bundle-platforms - optional, defaults to all platforms
+            Comma-separated platforms to include in the bundle: ubuntu, debian, macos, windows.
+            Platforms that cannot be fetched are reported and left out; the exit code is then 1.
+        --daemon - optional,
+            If presented, runs a node-level relay daemon that local processes lease ports from
+            (see RelayDaemonClient). --ports gives the first port to hand out. Implies --no-kill.
+        --max-ports - optional, defaults to 64
+            Maximum number of ports the daemon hands out.
+        --socket-path - optional, defaults to ~/.azdebugrelay/relayd.<hostname>.<config>.sock
+            Unix domain socket the daemon listens on.
+        --idle-timeout - optional, defaults to None
+            Seconds the daemon keeps running without leased ports.
+        --metrics-port - optional, defaults to None
+            If presented, serves OpenMetrics/Prometheus metrics on http://127.0.0.1:<port>/metrics.
+            Azure Relay Bridge then runs attached to this process instead of detached.
+        --metrics-textfile - optional, defaults to None
+            If presented, periodically writes metrics to this file (e.g. for node_exporter textfile collector).
+        --restart - optional,
+            If presented, restarts Azure Relay Bridge with exponential backoff whenever it fails or exits
+            (see RestartPolicy). Azure Relay Bridge then runs attached to this process instead of detached.
+        --share - optional,
+            If presented, reuses a running Azure Relay Bridge with the same configuration launched by azdebugrelay,
+            or launches one that others can reuse, and keeps it until interrupted. Implies --no-kill.
+        --manifest - optional, defaults to None
+            If presented, starts all relays of this JSON (or YAML) manifest concurrently instead of one relay,
+            reports their readiness and keeps them running until interrupted (see relay_manifest.load_manifest()).
+            --mode, --host, --ports, --connection-*, --engine, --restart and --share are then ignored;
+            --config-file is the default configuration file of relays.
+        --report - optional, defaults to table
+            Manifest startup report format: table or json.
     """
+    import argparse
+
     parser = argparse.ArgumentParser()
     parser.add_argument('--no-kill', action='store_true',
                         default=False, required=False, help="Don't terminate existing azrelay processes.")
@@ -494,10 +1633,77 @@ def _cli_main(argv):
                         default=None, required=False, help="Azure Relay Hybrid Connection name")
     parser.add_argument('--config-file', action='store',
                         default=None, required=False, help="Path to the configuration file. Defaults to None.")
+    parser.add_argument('--engine', action='store',
+                        default="azbridge", choices=['azbridge', 'python'], required=False,
+                        help="Tunneling engine: azbridge (Azure Relay Bridge) or python (in-process forwarder)")
+    parser.add_argument('--make-bundle', action='store',
+                        default=None, required=False,
+                        help="Build an Azure Relay Bridge bundle in this directory and exit.")
+    parser.add_argument('--bundle-platforms', action='store',
+                        default=None, required=False,
+                        help="Comma-separated bundle platforms: ubuntu, debian, macos, windows. Defaults to all.")
+    parser.add_argument('--daemon', action='store_true',
+                        default=False, required=False, help="Run a node-level relay daemon.")
+    parser.add_argument('--max-ports', type=int,
+                        default=64, required=False, help="Maximum number of ports the daemon hands out.")
+    parser.add_argument('--socket-path', action='store',
+                        default=None, required=False, help="Unix domain socket the daemon listens on.")
+    parser.add_argument('--idle-timeout', type=float,
+                        default=None, required=False, help="Seconds the daemon keeps running without leased ports.")
+    parser.add_argument('--metrics-port', type=int,
+                        default=None, required=False, help="Serve metrics over HTTP on this port.")
+    parser.add_argument('--metrics-textfile', action='store',
+                        default=None, required=False, help="Write metrics to this file periodically.")
+    parser.add_argument('--restart', action='store_true',
+                        default=False, required=False,
+                        help="Restart Azure Relay Bridge with backoff whenever it fails or exits.")
+    parser.add_argument('--share', action='store_true',
+                        default=False, required=False,
+                        help="Reuse a running Azure Relay Bridge with the same configuration.")
+    parser.add_argument('--manifest', action='store',
+                        default=None, required=False, help="Start all relays of this JSON or YAML manifest.")
+    parser.add_argument('--report', action='store',
+                        default="table", choices=['table', 'json'], required=False,
+                        help="Manifest startup report format: table or json")
     options = parser.parse_args(args=argv)
 
     logging.root.setLevel(logging.INFO)
-    if not options.no_kill:
+    if options.make_bundle is not None:
+        platforms = options.bundle_platforms.split(",") if options.bundle_platforms else None
+        bundle_dir = os.path.join(
+            options.make_bundle, f"{DebugRelay.relay_app_name}-bundle-{DebugRelay.relay_version_name}")
+        try:
+            index_path = _bridge_installer().make_bundle(
+                bundle_dir, DebugRelay.relay_version_name, DebugRelay._bridge_downloads(), platforms)
+        except RuntimeError as ex:
+            logging.error(str(ex))
+            sys.exit(1)
+        import json
+        with open(index_path) as index_file:
+            bundled = json.load(index_file)["archives"]
+        print(f"Azure Relay Bridge bundle is ready: {os.path.dirname(index_path)} ({', '.join(bundled)})")
+        if platforms and len(bundled) < len(platforms):
+            sys.exit(1)
+        return
+
+    if options.metrics_port is not None or options.metrics_textfile is not None:
+        relay_metrics.enable_metrics(http_port=options.metrics_port, textfile=options.metrics_textfile)
+
+    if options.manifest is not None:
+        if __package__:
+            from .relay_manifest import RelayManifest, load_manifest
+        else:
+            from relay_manifest import RelayManifest, load_manifest
+        specs = load_manifest(options.manifest)
+        for spec in specs:
+            spec.config_file = spec.config_file or options.config_file
+        manifest = RelayManifest(specs)
+        manifest.create_relays(kill_existing=not options.no_kill)
+        if not manifest.run(options.report):
+            sys.exit(1)
+        return
+
+    if options.mode == "none" and not options.no_kill and not options.share:
         print("Closing existing Azure Debugging Relay processes.")
         DebugRelay.kill_relays()
 
@@ -506,8 +1712,18 @@ def _cli_main(argv):
         ports = options.ports.strip()
         ports = ports.replace(", ", ",").replace(" ,", "").replace(" ", ",")
         ports_list = ports.split(",")
+        engine = RelayEngine.Python if options.engine == "python" else RelayEngine.AzureRelayBridge
+        daemon_options = None
+        if options.daemon:
+            daemon_options = {
+                "max_ports": options.max_ports,
+                "socket_path": options.socket_path,
+                "idle_timeout": options.idle_timeout}
+        restart_policy = RestartPolicy() if options.restart else None
         _main(connect, options.host, ports_list, options.connection_string,
-              options.connection_name, options.config_file)
+              options.connection_name, options.config_file, engine, daemon_options, restart_policy,
+              kill_existing=not options.no_kill and not options.daemon and not options.share,
+              shared=options.share)
 
 
 # DebugRelays can work as a CLI tool.
@@ -0,0 +1,250 @@
+import logging
+import os
+import signal
+import threading
+import typing
+from .debug_relay import DebugRelay, DebugMode, RelayEngine
+from .debugpyex import DebugPyEx, _stop_tracing
+from .debug_breakpoints import arm_breakpoints, disarm_breakpoints
+
+# Signal that toggles debugging by default (None on Windows, which has no SIGUSR1)
+DEFAULT_SIGNAL = getattr(signal, "SIGUSR1", None)
+# How often the control file is checked, in seconds
+DEFAULT_POLL_INTERVAL = 1.0
+# How often a listening debugger is checked for a connected client, in seconds
+_CLIENT_POLL_INTERVAL = 0.25
+
+
+class DebugTrigger(object):
+    """Attaches a running process to the debugger on demand, without restarting it.
+
+    install() registers a signal handler (SIGUSR1 by default) and/or starts watching a control file.
+    The first trigger creates DebugRelay from the config file or the environment, opens it and attaches debugpy
+    in a background thread. The next trigger closes the relay and detaches, and so on:
+
+        trigger = DebugTrigger(DebugMode.Connect, control_file="/tmp/debug-my-service").install()
+        ...
+        $ kill -USR1 <pid>        # or: touch /tmp/debug-my-service
+
+    Until the first trigger, the only cost is the signal handler and one idle thread
+    (plus a stat() every poll_interval seconds with a control file).
+    Triggers received while attaching cancel waiting for the debugger and detach once the relay is open.
+
+    debugpy.listen() can only be called once per process, so with DebugMode.WaitForConnection
+    the local debugpy listener stays up when detached, and only the relay is closed.
+    With DebugMode.Connect, detaching also stops tracing, so the process runs at full speed again.
+    """
+    def __init__(self,
+                 debug_mode: DebugMode = DebugMode.Connect,
+                 config_file: str = "./.azrelay.json",
+                 host: str = "127.0.0.1",
+                 port: int = 5678,
+                 engine: RelayEngine = RelayEngine.AzureRelayBridge,
+                 connect_timeout: float = 15,
+                 signal_number: typing.Optional[int] = DEFAULT_SIGNAL,
+                 control_file: str = None,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 relay_factory: typing.Callable[[], DebugRelay] = None,
+                 logger: logging.Logger = logging.root):
+        """Initializes DebugTrigger object.
+
+        Args:
+            debug_mode (DebugMode, optional): Connect to a remote debugger, or listen for it to connect.
+                Defaults to DebugMode.Connect.
+            config_file (str, optional): Relay configuration file; AZRELAY_CONNECTION_STRING and
+                AZRELAY_CONNECTION_NAME environment variables are used if it doesn't exist. Defaults to "./.azrelay.json".
+            host (str, optional): Local hostname/address the debugging starts on. Defaults to "127.0.0.1".
+            port (int, optional): Debugging port. Defaults to 5678.
+            engine (RelayEngine, optional): Relay engine. Defaults to RelayEngine.AzureRelayBridge.
+            connect_timeout (float, optional): How long to wait for the debugger, in seconds
+                (DebugMode.Connect only). Defaults to 15.
+            signal_number (int, optional): Signal that toggles debugging, None to use only the control file.
+                Defaults to SIGUSR1.
+            control_file (str, optional): File that toggles debugging when created or touched. Defaults to None.
+            poll_interval (float, optional): How often the control file is checked, in seconds. Defaults to 1.
+            relay_factory (typing.Callable[[], DebugRelay], optional): Creates DebugRelay on the first trigger,
+                instead of reading config_file or the environment. Defaults to None.
+        """
+        self.debug_mode = debug_mode
+        self.config_file = config_file
+        self.host = host
+        self.port = int(port)
+        self.engine = engine
+        self.connect_timeout = connect_timeout
+        self.signal_number = signal_number
+        self.control_file = control_file
+        self.poll_interval = poll_interval
+        self.relay_factory = relay_factory
+        self.logger = logger
+        # open relay while debugging is on
+        self.relay = None
+        self.active = False
+        # number of triggers handled
+        self.trigger_count = 0
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._previous_handler = None
+        self._control_mtime = None
+        self._listening = False
+
+
+    def install(self) -> "DebugTrigger":
+        """Registers the signal handler and starts waiting for triggers.
+        The signal handler can only be registered from the main thread;
+        elsewhere only the control file (if any) is watched.
+
+        Returns:
+            DebugTrigger: self
+        """
+        if self._thread is not None:
+            return self
+        if self.signal_number is not None:
+            try:
+                self._previous_handler = signal.signal(self.signal_number, self._handle_signal)
+            except ValueError as ex:
+                self.logger.warning(f"Cannot handle signal {self.signal_number}: {ex}")
+                self.signal_number = None
+        if self.signal_number is None and self.control_file is None:
+            raise ValueError("DebugTrigger requires a signal or a control file.")
+        # a control file left from an earlier run is not a trigger
+        self._control_mtime = self._control_file_mtime()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name="azdebugrelay trigger")
+        self._thread.start()
+        self.logger.info(f"Debugging can be turned on and off "
+                         f"{self._describe_triggers()} (process {os.getpid()}).")
+        return self
+
+
+    def uninstall(self):
+        """Restores the previous signal handler, stops watching the control file and detaches.
+        """
+        if self._thread is None:
+            return
+        if self.signal_number is not None and self._previous_handler is not None:
+            try:
+                signal.signal(self.signal_number, self._previous_handler)
+            except ValueError:
+                pass
+            self._previous_handler = None
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self._wakeup.clear()
+        if self.active:
+            self._deactivate()
+
+
+    def trigger(self):
+        """Turns debugging on or off, as if the signal was received.
+        """
+        self._wakeup.set()
+
+
+    def _handle_signal(self, signal_received, frame):
+        self._wakeup.set()
+
+
+    def _run(self):
+        timeout = self.poll_interval if self.control_file is not None else None
+        while True:
+            self._wakeup.wait(timeout)
+            triggered = self._wakeup.is_set()
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            if self._control_file_touched():
+                triggered = True
+            if not triggered:
+                continue
+            self.trigger_count += 1
+            try:
+                if self.active:
+                    self._deactivate()
+                else:
+                    self._activate()
+            except Exception:
+                self.logger.exception("Cannot turn debugging on or off.")
+
+
+    def _activate(self):
+        relay = self._create_relay()
+        if relay is None:
+            self.logger.error("Cannot create Debugging Relay due to missing configuration.")
+            return
+        self.logger.info("Debugging triggered: opening Debugging Relay...")
+        self.relay = relay
+        self.active = True
+        try:
+            relay.open()
+        except Exception:
+            self._deactivate()
+            raise
+        if self.debug_mode == DebugMode.Connect:
+            # a trigger received meanwhile cancels waiting
+            if DebugPyEx.connect(self.host, self.port, float(self.connect_timeout), self._wakeup):
+                self.logger.info("Debugger attached.")
+            else:
+                self.logger.warning("Debugger did not connect in time. Trigger again to close Debugging Relay.")
+        else:
+            import debugpy
+
+            if not self._listening:
+                debugpy.listen((self.host, self.port))
+                self._listening = True
+            self.logger.info(f"Waiting for the debugger to connect on {self.host}:{self.port}.")
+            while not debugpy.is_client_connected():
+                if self._wakeup.wait(_CLIENT_POLL_INTERVAL) or self._stopping:
+                    return
+            arm_breakpoints()
+            self.logger.info("Debugger attached.")
+
+
+    def _deactivate(self):
+        self.logger.info("Debugging triggered: closing Debugging Relay...")
+        disarm_breakpoints()
+        if self.debug_mode == DebugMode.Connect:
+            _stop_tracing()
+        relay = self.relay
+        self.relay = None
+        self.active = False
+        if relay is not None:
+            relay.close()
+        self.logger.info("Debugging is off.")
+
+
+    def _create_relay(self) -> typing.Optional[DebugRelay]:
+        if self.relay_factory is not None:
+            return self.relay_factory()
+        if self.config_file and os.path.exists(self.config_file):
+            return DebugRelay.from_config(self.config_file, debug_mode=self.debug_mode,
+                                          host=self.host, ports=[self.port], engine=self.engine)
+        return DebugRelay.from_environment(debug_mode=self.debug_mode,
+                                           host=self.host, ports=[self.port], engine=self.engine)
+
+
+    def _control_file_mtime(self) -> typing.Optional[float]:
+        if self.control_file is None:
+            return None
+        try:
+            return os.stat(self.control_file).st_mtime
+        except OSError:
+            return None
+
+
+    def _control_file_touched(self) -> bool:
+        mtime = self._control_file_mtime()
+        touched = mtime is not None and mtime != self._control_mtime
+        self._control_mtime = mtime
+        return touched
+
+
+    def _describe_triggers(self) -> str:
+        triggers = []
+        if self.signal_number is not None:
+            triggers.append(f"with signal {signal.Signals(self.signal_number).name}")
+        if self.control_file is not None:
+            triggers.append(f"by touching {self.control_file}")
+        return " or ".join(triggers)
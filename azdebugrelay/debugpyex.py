@@ -1,40 +1,244 @@
-import debugpy
+import errno
 import logging
+import sys
 import threading
-from .threads import StoppableThread
+import time
+from . import relay_metrics
+from .debug_breakpoints import arm_breakpoints
+
+# Backoff between port probes, in seconds
+PROBE_INITIAL_DELAY = 0.05
+PROBE_MAX_DELAY = 2.0
+# How long an accepted probe connection must stay open to count.
+# Azure Relay Bridge accepts local connections right away, and drops them
+# if the remote end of the relay is not listening.
+PROBE_SETTLE_TIME = 0.25
+
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, getattr(errno, "WSAEWOULDBLOCK", -1))
 
 
 class DebugPyEx():
     """Use this class instead of debugpy.
     It provides an additional manageability layer on top of debugpy calls.
     """
-    _debugpy_connected = False
-    _connect_lock = threading.Lock()
 
-    def _thread_connect_proc(host, port):
-        try:
-            debugpy.connect((str(host), int(port)))
-            DebugPyEx._debugpy_connected = True
-        except SystemExit:
-            # SystemExit is a "legal" way to terminate this thread.
-            logging.warn("Debugpy thread has been terminated.")
+    @staticmethod
+    def connect(host, port, connect_timeout_seconds, cancel_event: threading.Event = None) -> bool:
+        metrics = relay_metrics.registry
+        start = time.monotonic()
+        connected = DebugPyEx._connect(host, port, connect_timeout_seconds, cancel_event)
+        if metrics is not None:
+            metrics.debugpy_connected(host, port, time.monotonic() - start, connected)
+        if connected:
+            # azdebugrelay.breakpoint() and friends stop being no-ops
+            arm_breakpoints()
+        return connected
 
 
     @staticmethod
-    def connect(host, port, connect_timeout_seconds) -> bool:
-        with DebugPyEx._connect_lock:
-            DebugPyEx._debugpy_connected = False
-            thread = StoppableThread(target=DebugPyEx._thread_connect_proc, args=(
-                host, port,), daemon=True)
-            thread.start()
-            thread.join(connect_timeout_seconds)
-            if(thread.is_alive()):
-                # kill the thread "gracefully"!
-                thread.stop()
+    def _connect(host, port, connect_timeout_seconds, cancel_event: threading.Event = None) -> bool:
+        # debugpy is only imported once a connection is requested
+        import debugpy
+
+        if debugpy.is_client_connected():
+            return True
+        deadline = time.monotonic() + connect_timeout_seconds
+        delay = PROBE_INITIAL_DELAY
+        while True:
+            handoff = _pending_handoff()
+            if handoff is None and wait_for_port(host, port, deadline - time.monotonic(), cancel_event):
+                handoff = _start_handoff(host, port)
+            if handoff is not None:
+                # the port accepts connections: wait for debugpy to finish its handshake
+                if not handoff.wait(deadline, cancel_event):
+                    # a later call picks it up, otherwise it is disconnected once it completes
+                    if cancel_event is None or not cancel_event.is_set():
+                        logging.warning(f"Debugpy handshake with {host}:{port} did not complete "
+                                        f"in {connect_timeout_seconds} s.")
+                    return False
+                if handoff.connected:
+                    debugpy.debug_this_thread()
+                    return True
+                logging.warning(f"Debugpy cannot connect to {host}:{port}: {handoff.error}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or _cancelled(cancel_event, min(delay, remaining)):
                 return False
-            elif DebugPyEx._debugpy_connected:
-                debugpy.debug_this_thread()
-                return True
-            else:
+            delay = min(delay * 2, PROBE_MAX_DELAY)
+
+
+class _Handoff(threading.Thread):
+    """Calls debugpy.connect once the debugger port accepts connections.
+    debugpy.connect returns after the debugger has configured the session (or fails) and cannot be interrupted,
+    so callers wait for it until their own deadlines only (see wait()). A handshake that completes
+    after all of them have timed out is disconnected, instead of attaching a debugger nobody waits for.
+    """
+    def __init__(self, host, port):
+        super().__init__(daemon=True, name="debugpy connect")
+        self.address = (str(host), int(port))
+        self.connected = False
+        self.error = None
+        self._finished = False
+        # callers waiting for the handshake
+        self._waiters = 0
+        self._lock = threading.Lock()
+
+
+    def run(self):
+        import debugpy
+
+        try:
+            debugpy.connect(self.address)
+            connected = True
+        except Exception as ex:
+            connected = debugpy.is_client_connected()
+            self.error = ex
+        with self._lock:
+            self.connected = connected
+            self._finished = True
+            abandoned = self._waiters == 0
+        if connected and abandoned:
+            logging.warning(f"Debugpy connected to {self.address[0]}:{self.address[1]} after timing out. "
+                            "Disconnecting.")
+            _stop_tracing()
+            self.connected = False
+
+
+    def attach(self) -> bool:
+        """Registers a caller that waits for the handshake. Returns False if it has finished already.
+        """
+        with self._lock:
+            if self._finished:
                 return False
+            self._waiters += 1
+            return True
+
+
+    def wait(self, deadline: float, cancel_event: threading.Event) -> bool:
+        """Waits for the handshake as an attached caller, until deadline or cancel_event is set.
+        Returns True if it has finished.
+        """
+        _join(self, deadline, cancel_event)
+        with self._lock:
+            self._waiters -= 1
+            return self._finished
+
+
+_handoff = None
+_handoff_lock = threading.Lock()
+
+
+def _pending_handoff() -> _Handoff:
+    """Returns the handshake in progress (attached to the caller), or None.
+    """
+    with _handoff_lock:
+        handoff = _handoff
+        return handoff if handoff is not None and handoff.attach() else None
 
+
+def _start_handoff(host, port) -> _Handoff:
+    """Starts a handshake unless one is in progress. Returns it attached to the caller.
+    """
+    global _handoff
+    with _handoff_lock:
+        if _handoff is None or not _handoff.attach():
+            _handoff = _Handoff(host, port)
+            _handoff.attach()
+            _handoff.start()
+        return _handoff
+
+
+def _stop_tracing():
+    """Disconnects debugpy from the debugger and stops tracing, so debugpy.connect can be called again.
+    """
+    pydevd = sys.modules.get("pydevd")
+    if pydevd is not None:
+        pydevd.stoptrace()
+
+
+def _join(thread: threading.Thread, deadline: float, cancel_event: threading.Event):
+    while thread.is_alive():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or (cancel_event is not None and cancel_event.is_set()):
+            return
+        thread.join(min(remaining, 0.1))
+
+
+def wait_for_port(host, port, timeout: float, cancel_event: threading.Event = None,
+                  initial_delay: float = PROBE_INITIAL_DELAY,
+                  max_delay: float = PROBE_MAX_DELAY,
+                  settle_time: float = PROBE_SETTLE_TIME) -> bool:
+    """Probes a TCP port with non-blocking connects and exponential backoff until it accepts connections.
+
+    Args:
+        host: host name or ip address
+        port: port number
+        timeout (float): how long to wait, in seconds
+        cancel_event (threading.Event, optional): stops waiting once set. Defaults to None.
+        initial_delay (float, optional): delay after the first failed probe, doubled after every next one.
+        max_delay (float, optional): maximum delay between probes.
+        settle_time (float, optional): how long an accepted connection must stay open to count.
+
+    Returns:
+        bool: True if the port accepts connections, False on timeout or cancellation
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        if _probe(str(host), int(port), deadline, settle_time, cancel_event):
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or _cancelled(cancel_event, min(delay, remaining)):
+            return False
+        delay = min(delay * 2, max_delay)
+
+
+def _cancelled(cancel_event: threading.Event, delay: float) -> bool:
+    """Sleeps for delay seconds, returns True if cancel_event has been set meanwhile.
+    """
+    if cancel_event is None:
+        time.sleep(delay)
+        return False
+    return cancel_event.wait(delay)
+
+
+def _probe(host: str, port: int, deadline: float, settle_time: float, cancel_event: threading.Event) -> bool:
+    import select
+    import socket
+
+    try:
+        address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+    except OSError:
+        return False
+    probe = socket.socket(address[0], socket.SOCK_STREAM)
+    try:
+        probe.setblocking(False)
+        result = probe.connect_ex(address[4])
+        if result != 0:
+            if result not in _IN_PROGRESS:
+                return False
+            # short select slices keep cancellation responsive
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (cancel_event is not None and cancel_event.is_set()):
+                    return False
+                _, writable, failed = select.select([], [probe], [probe], min(remaining, 0.1))
+                if writable or failed:
+                    break
+            if probe.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+                return False
+        if settle_time > 0:
+            readable, _, failed = select.select([probe], [], [probe], settle_time)
+            if failed:
+                return False
+            if readable:
+                try:
+                    # closed by the peer (e.g. the remote end of the relay is not listening)?
+                    if not probe.recv(1, socket.MSG_PEEK):
+                        return False
+                except OSError:
+                    return False
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
@@ -0,0 +1,89 @@
+import errno
+import logging
+import os
+import subprocess
+import threading
+import typing
+
+
+class ExitWatcher(object):
+    """Calls back when child processes exit, without polling.
+
+    On Linux 5.3+ with Python 3.9+, one daemon thread waits on pidfds of all watched processes with a selector,
+    so any number of processes costs one idle thread and exits are noticed at once.
+    Elsewhere, every watched process gets a daemon thread blocked in Popen.wait().
+    """
+    def __init__(self, logger: logging.Logger = logging.root):
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._selector = None
+        self._thread = None
+        self._pidfd_supported = hasattr(os, "pidfd_open")
+
+
+    def watch(self, process: subprocess.Popen, callback: typing.Callable[[int], None]):
+        """Calls callback(returncode) from a watcher thread once process exits.
+        The process has been reaped (process.returncode is set) when the callback runs.
+        """
+        pidfd = self._pidfd_open(process)
+        if pidfd is None:
+            threading.Thread(target=self._wait, args=(process, callback),
+                             daemon=True, name="azdebugrelay exit waiter").start()
+            return
+        import selectors
+
+        with self._lock:
+            if self._selector is None:
+                self._selector = selectors.DefaultSelector()
+                self._thread = threading.Thread(target=self._run, daemon=True, name="azdebugrelay exit watcher")
+                self._thread.start()
+            # epoll picks up fds registered while another thread is waiting
+            self._selector.register(pidfd, selectors.EVENT_READ, (process, callback))
+
+
+    def _pidfd_open(self, process: subprocess.Popen) -> typing.Optional[int]:
+        if not self._pidfd_supported or process.returncode is not None:
+            return None
+        try:
+            return os.pidfd_open(process.pid)
+        except OSError as ex:
+            if ex.errno != errno.ESRCH:
+                # e.g. ENOSYS on kernels older than 5.3
+                self._pidfd_supported = False
+            return None
+
+
+    def _run(self):
+        while True:
+            for key, _ in self._selector.select():
+                with self._lock:
+                    self._selector.unregister(key.fd)
+                os.close(key.fd)
+                process, callback = key.data
+                self._notify(process, callback)
+
+
+    def _wait(self, process: subprocess.Popen, callback: typing.Callable[[int], None]):
+        process.wait()
+        self._notify(process, callback)
+
+
+    def _notify(self, process: subprocess.Popen, callback: typing.Callable[[int], None]):
+        try:
+            callback(process.wait())
+        except Exception:
+            self.logger.exception("Process exit callback failed.")
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def watch_exit(process: subprocess.Popen, callback: typing.Callable[[int], None]):
+    """Calls callback(returncode) once process exits, with the shared ExitWatcher.
+    """
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = ExitWatcher()
+    _watcher.watch(process, callback)
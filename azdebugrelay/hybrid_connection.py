@@ -0,0 +1,430 @@
+import asyncio
+import base64
+import concurrent.futures
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+import typing
+import urllib.parse
+
+if __package__:
+    from . import relay_websocket
+    from . import relay_events
+else:
+    # launched as a script (e.g. by the VS Code extension)
+    import relay_websocket
+    import relay_events
+
+
+# Header the local forwarder uses to tell the remote forwarder which port a connection is for
+PORT_HEADER = "X-Azdebugrelay-Port"
+
+_BUFFER_SIZE = 65536
+
+
+def parse_connection_string(connection_string: str) -> typing.Dict[str, str]:
+    """Parses an Azure Relay connection string into a dictionary
+    (Endpoint, SharedAccessKeyName, SharedAccessKey, EntityPath).
+    """
+    values = {}
+    for part in connection_string.strip().split(";"):
+        if "=" in part:
+            name, value = part.split("=", 1)
+            values[name.strip()] = value.strip()
+    return values
+
+
+def create_sas_token(resource_uri: str, key_name: str, key: str, ttl_seconds: float = 3600) -> str:
+    """Creates a Shared Access Signature token for an Azure Relay resource.
+    """
+    expiry = str(int(time.time() + ttl_seconds))
+    encoded_uri = urllib.parse.quote(resource_uri, safe="")
+    signature = base64.b64encode(
+        hmac.new(key.encode(), f"{encoded_uri}\n{expiry}".encode(), hashlib.sha256).digest())
+    return (f"SharedAccessSignature sr={encoded_uri}"
+            f"&sig={urllib.parse.quote(signature, safe='')}&se={expiry}&skn={key_name}")
+
+
+class HybridConnectionForwarder(object):
+    """In-process replacement of Azure Relay Bridge for debugging tunnels.
+
+    Speaks Azure Relay Hybrid Connection websocket rendezvous protocol directly:
+    * remote forward (`-R`, DebugMode.WaitForConnection) keeps a listener control channel open
+      and, for every accepted rendezvous, connects to host:port locally;
+    * local forward (`-L`, DebugMode.Connect) listens on host:port for every port
+      and opens a sender connection to the Hybrid Connection for every client.
+
+    Streams carry raw forwarded bytes, without the per-stream preamble of Azure Relay Bridge,
+    and the target port is sent in `X-Azdebugrelay-Port` header. So this forwarder only talks to itself:
+    both ends of a tunnel must run it (RelayEngine.Python), even for a single port.
+
+    The listener renews its SAS token on the control channel (renewToken) before it expires.
+    """
+    # Backoff limits for reconnecting the listener control channel, in seconds
+    min_reconnect_delay = 0.5
+    max_reconnect_delay = 30
+    # Lifetime of SAS tokens, and how long before expiry the listener's token is renewed, in seconds
+    token_ttl = 3600
+    token_renew_margin = 300
+
+    def __init__(self,
+                 connection_string: str,
+                 relay_connection_name: str,
+                 remote_forward: bool,
+                 host: str,
+                 ports: typing.List[str],
+                 logger: logging.Logger = logging.root,
+                 on_event: typing.Callable[..., None] = None):
+        """Initializes HybridConnectionForwarder object.
+
+        Args:
+            connection_string (str): Azure Relay connection string with SharedAccessKeyName and SharedAccessKey
+            relay_connection_name (str): name of Azure Relay Hybrid Connection
+            remote_forward (bool): Forward incoming Hybrid Connection connections to host:ports (True)
+                or local host:ports connections to the Hybrid Connection (False).
+            host (str): Local hostname/address
+            ports (typing.List[str]): Local ports
+            on_event (callable, optional): Called with relay event kind (relay_events.EVENT_*)
+                and `port`/`bytes` keyword arguments (e.g. EventStream.publish). Defaults to None.
+
+        Raises:
+            ValueError: connection string misses endpoint or shared access key.
+        """
+        settings = parse_connection_string(connection_string)
+        endpoint = settings.get("Endpoint")
+        self._key_name = settings.get("SharedAccessKeyName")
+        self._key = settings.get("SharedAccessKey")
+        if not endpoint or not self._key_name or not self._key:
+            raise ValueError(
+                "Connection string must have Endpoint, SharedAccessKeyName and SharedAccessKey.")
+        parsed = urllib.parse.urlsplit(endpoint)
+        # sb:// endpoints are Azure Relay namespaces, ws:// is used for local stand-in relays
+        scheme = "ws" if parsed.scheme == "ws" else "wss"
+        path = urllib.parse.quote(relay_connection_name)
+        self._url = f"{scheme}://{parsed.netloc}/$hc/{path}"
+        self._resource_uri = f"http://{parsed.hostname}/{relay_connection_name}"
+
+        self.remote_forward = remote_forward
+        self.host = host
+        self.ports = [str(port) for port in ports]
+        self.logger = logger
+        self.on_event = on_event
+
+        self._servers = []
+        self._tasks = set()
+        self._control_task = None
+        self._control_socket = None
+        self._ready = None
+        self._stopped = None
+        self._stopping = False
+        self.active_connections = 0
+
+
+    @property
+    def is_running(self) -> bool:
+        return self._stopped is not None and not self._stopped.done()
+
+
+    async def start(self):
+        """Starts forwarding. Returns when the forwarder is ready to accept connections.
+        """
+        loop = asyncio.get_event_loop()
+        self._stopped = loop.create_future()
+        self._stopping = False
+        if self.remote_forward:
+            self._ready = loop.create_future()
+            self._control_task = asyncio.ensure_future(self._control_loop())
+            try:
+                await self._ready
+            except BaseException:
+                await self.stop()
+                raise
+            self.logger.info(f"RemoteForwardHostStart, {self._url}")
+            self._event(relay_events.EVENT_FORWARD_START)
+        else:
+            try:
+                for port in self.ports:
+                    server = await asyncio.start_server(
+                        lambda reader, writer, port=port: self._track(self._local_connection(reader, writer, port)),
+                        self.host, int(port))
+                    self._servers.append(server)
+            except BaseException:
+                await self.stop()
+                raise
+            self.logger.info(f"LocalForwardHostStart, {self.host}:{';'.join(self.ports)}")
+            for port in self.ports:
+                self._event(relay_events.EVENT_FORWARD_START, port=port)
+
+
+    async def stop(self):
+        """Stops forwarding and drops all forwarded connections.
+        """
+        self._stopping = True
+        for server in self._servers:
+            server.close()
+        self._servers = []
+        if self._control_socket is not None:
+            await self._control_socket.close()
+        tasks = list(self._tasks)
+        if self._control_task is not None:
+            tasks.append(self._control_task)
+            self._control_task = None
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if self._stopped is not None and not self._stopped.done():
+            self._stopped.set_result(None)
+            self._event(relay_events.EVENT_FORWARD_STOP)
+
+
+    async def wait(self):
+        """Waits until the forwarder stops.
+        """
+        if self._stopped is not None:
+            await asyncio.shield(self._stopped)
+
+
+    def on_stop(self, callback: typing.Callable[[], None]):
+        """Calls callback on the forwarder's event loop once the started forwarder stops.
+        Must be called on that loop.
+        """
+        self._stopped.add_done_callback(lambda future: callback())
+
+
+    def _event(self, kind: str, **details):
+        if self.on_event is not None:
+            self.on_event(kind, **details)
+
+
+    def _token(self) -> str:
+        return create_sas_token(self._resource_uri, self._key_name, self._key, self.token_ttl)
+
+
+    def _track(self, coroutine) -> asyncio.Future:
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+
+    async def _control_loop(self):
+        delay = HybridConnectionForwarder.min_reconnect_delay
+        while True:
+            try:
+                self._control_socket = await relay_websocket.connect(
+                    f"{self._url}?sb-hc-action=listen",
+                    headers={"ServiceBusAuthorization": self._token()})
+            except (OSError, relay_websocket.WebSocketError) as ex:
+                # fail fast on authorization and configuration errors
+                if not self._ready.done() and getattr(ex, "status", None) in (401, 403, 404):
+                    self._ready.set_exception(ex)
+                    return
+                self.logger.warning(f"Cannot connect to Azure Relay listener channel: {ex}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, HybridConnectionForwarder.max_reconnect_delay)
+                continue
+            delay = HybridConnectionForwarder.min_reconnect_delay
+            if not self._ready.done():
+                self._ready.set_result(None)
+            renewal = asyncio.ensure_future(self._renew_token(self._control_socket))
+            try:
+                while True:
+                    message = await self._control_socket.recv()
+                    if message is None:
+                        break
+                    try:
+                        command = json.loads(message)
+                    except ValueError:
+                        continue
+                    if "accept" in command:
+                        self._track(self._remote_connection(command["accept"]))
+            finally:
+                renewal.cancel()
+            if self._stopping:
+                return
+            self.logger.warning("Azure Relay listener channel closed. Reconnecting...")
+
+
+    async def _renew_token(self, control_socket: relay_websocket.WebSocket):
+        """Sends the listener a new SAS token before the current one expires, so Azure Relay keeps the channel open.
+        """
+        while True:
+            await asyncio.sleep(max(1, self.token_ttl - self.token_renew_margin))
+            try:
+                await control_socket.send(json.dumps({"renewToken": {"token": self._token()}}))
+            except (OSError, relay_websocket.WebSocketError) as ex:
+                # the channel is closing, and reconnects with a new token
+                self.logger.warning(f"Cannot renew Azure Relay listener token: {ex}")
+                return
+
+
+    async def _remote_connection(self, accept: typing.Dict[str, typing.Any]):
+        address = accept["address"]
+        port = self.ports[0]
+        headers = {name.lower(): value for name, value in (accept.get("connectHeaders") or {}).items()}
+        requested_port = headers.get(PORT_HEADER.lower())
+        if requested_port in self.ports:
+            port = requested_port
+        try:
+            reader, writer = await asyncio.open_connection(self.host, int(port))
+        except OSError as ex:
+            self.logger.warning(f"Cannot connect to {self.host}:{port}: {ex}")
+            self._event(relay_events.EVENT_ERROR, port=port, line=str(ex))
+            reason = urllib.parse.quote(str(ex))
+            try:
+                socket = await relay_websocket.connect(
+                    f"{address}&sb-hc-statusCode=502&sb-hc-statusDescription={reason}")
+                await socket.close()
+            except (OSError, relay_websocket.WebSocketError):
+                pass
+            return
+        try:
+            socket = await relay_websocket.connect(address)
+        except (OSError, relay_websocket.WebSocketError) as ex:
+            self.logger.warning(f"Cannot accept Azure Relay connection: {ex}")
+            self._event(relay_events.EVENT_ERROR, port=port, line=str(ex))
+            writer.close()
+            return
+        await self._forward(reader, writer, socket, port)
+
+
+    async def _local_connection(self,
+                                reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter,
+                                port: str):
+        try:
+            socket = await relay_websocket.connect(
+                f"{self._url}?sb-hc-action=connect",
+                headers={"ServiceBusAuthorization": self._token(), PORT_HEADER: port})
+        except (OSError, relay_websocket.WebSocketError) as ex:
+            self.logger.warning(f"Cannot connect to Azure Relay: {ex}")
+            self._event(relay_events.EVENT_ERROR, port=port, line=str(ex))
+            writer.close()
+            return
+        await self._forward(reader, writer, socket, port)
+
+
+    async def _forward(self,
+                       reader: asyncio.StreamReader,
+                       writer: asyncio.StreamWriter,
+                       socket: relay_websocket.WebSocket,
+                       port: str):
+        self.active_connections += 1
+        self._event(relay_events.EVENT_CONNECTION_ACCEPTED, port=port)
+        # bytes transferred in both directions
+        transferred = [0]
+        try:
+            await asyncio.gather(
+                _pump_to_socket(reader, socket, transferred),
+                _pump_from_socket(socket, writer, transferred),
+                return_exceptions=True)
+        finally:
+            self.active_connections -= 1
+            writer.close()
+            await socket.close()
+            self._event(relay_events.EVENT_CONNECTION_CLOSED, port=port, bytes=transferred[0])
+
+
+async def _pump_to_socket(reader: asyncio.StreamReader,
+                          socket: relay_websocket.WebSocket,
+                          transferred: typing.List[int]):
+    try:
+        while True:
+            data = await reader.read(_BUFFER_SIZE)
+            if not data:
+                break
+            transferred[0] += len(data)
+            await socket.send(data)
+    finally:
+        await socket.close()
+
+
+async def _pump_from_socket(socket: relay_websocket.WebSocket,
+                            writer: asyncio.StreamWriter,
+                            transferred: typing.List[int]):
+    try:
+        while True:
+            data = await socket.recv()
+            if data is None:
+                break
+            data = data.encode() if isinstance(data, str) else data
+            transferred[0] += len(data)
+            writer.write(data)
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+class ForwarderThread(object):
+    """Runs HybridConnectionForwarder on a private event loop in a daemon thread,
+    for synchronous callers.
+    """
+    def __init__(self, forwarder: HybridConnectionForwarder):
+        self.forwarder = forwarder
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+
+    def start(self, timeout: float):
+        """Starts the forwarder and waits for it to become ready.
+
+        Raises:
+            TimeoutError: The forwarder did not become ready within timeout seconds.
+        """
+        self._thread.start()
+        future = asyncio.run_coroutine_threadsafe(self.forwarder.start(), self._loop)
+        try:
+            future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self.stop()
+            raise TimeoutError("Hybrid Connection forwarder took too long to start.")
+        except BaseException:
+            self.stop()
+            raise
+
+
+    def stop(self):
+        if self._thread.is_alive():
+            try:
+                future = asyncio.run_coroutine_threadsafe(self.forwarder.stop(), self._loop)
+                try:
+                    future.result(3)
+                except concurrent.futures.TimeoutError:
+                    pass
+                self._loop.call_soon_threadsafe(self._loop.stop)
+            except RuntimeError:
+                # the loop has been closed by a concurrent stop()
+                pass
+            self._thread.join(3)
+
+
+    def wait(self):
+        if self._thread.is_alive():
+            asyncio.run_coroutine_threadsafe(self.forwarder.wait(), self._loop).result()
+
+
+    def is_running(self) -> bool:
+        return self._thread.is_alive() and self.forwarder.is_running
+
+
+    def on_stop(self, callback: typing.Callable[[], None]):
+        """Calls callback from the forwarder thread once the started forwarder stops.
+        """
+        try:
+            self._loop.call_soon_threadsafe(self.forwarder.on_stop, callback)
+        except RuntimeError:
+            # the loop is closed: stopped already
+            callback()
+
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
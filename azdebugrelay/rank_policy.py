@@ -0,0 +1,311 @@
+import errno
+import logging
+import os
+import random
+import typing
+from enum import Enum
+from .debug_relay import DebugRelay
+from .debugpyex import DebugPyEx
+
+# Environment variables, in order of preference:
+# OpenMPI, MPICH/Intel MPI (PMI), Horovod, PyTorch distributed and Azure ML
+RANK_VARIABLES = ("OMPI_COMM_WORLD_RANK", "PMI_RANK", "HOROVOD_RANK", "RANK",
+                  "AZUREML_PROCESS_RANK", "AZ_BATCHAI_TASK_INDEX")
+LOCAL_RANK_VARIABLES = ("OMPI_COMM_WORLD_LOCAL_RANK", "MPI_LOCALRANKID", "HOROVOD_LOCAL_RANK",
+                        "LOCAL_RANK", "AZUREML_PROCESS_LOCAL_RANK")
+WORLD_SIZE_VARIABLES = ("OMPI_COMM_WORLD_SIZE", "PMI_SIZE", "HOROVOD_SIZE", "WORLD_SIZE")
+LOCAL_SIZE_VARIABLES = ("OMPI_COMM_WORLD_LOCAL_SIZE", "MPI_LOCALNRANKS", "HOROVOD_LOCAL_SIZE",
+                        "LOCAL_WORLD_SIZE")
+# Identify one launch of the job (the same on all of its ranks), AZDEBUGRELAY_JOB_ID overrides the others
+JOB_ID_VARIABLES = ("AZDEBUGRELAY_JOB_ID", "AZUREML_RUN_ID", "OMPI_MCA_ess_base_jobid", "PMI_JOBID", "SLURM_JOB_ID")
+
+# Which ranks to debug, e.g. `all`, `0,3`, `sample:4`, `first-error`
+POLICY_VARIABLE = "AZDEBUGRELAY_RANKS"
+
+
+class RankInfo(typing.NamedTuple):
+    """Rank of this process in a distributed job.
+    """
+    rank: int = 0
+    local_rank: int = 0
+    world_size: int = 1
+    local_size: int = 1
+    # identifies the launch of the job, for first-error claims (None if unknown)
+    job_id: typing.Optional[str] = None
+
+    @staticmethod
+    def from_environment() -> "RankInfo":
+        """Reads rank, local rank and sizes set by MPI, Horovod, PyTorch distributed or Azure ML.
+        Missing values default to a single-process job.
+        """
+        rank = _first_int(RANK_VARIABLES, 0)
+        world_size = _first_int(WORLD_SIZE_VARIABLES, max(1, rank + 1))
+        local_rank = _first_int(LOCAL_RANK_VARIABLES, 0)
+        local_size = _first_int(LOCAL_SIZE_VARIABLES, max(1, local_rank + 1))
+        job_id = next((os.environ[name] for name in JOB_ID_VARIABLES if os.environ.get(name)), None)
+        return RankInfo(rank, local_rank, world_size, local_size, job_id)
+
+
+class RankSelection(Enum):
+    """Which ranks of a distributed job attach to the debugger
+    """
+    # every rank
+    All = 1
+    # ranks listed explicitly
+    List = 2
+    # a random subset of ranks, the same on every rank (seeded)
+    Sampled = 3
+    # only the first rank that raises an exception
+    FirstError = 4
+
+
+class RankPolicy(object):
+    """Picks which ranks of a distributed job attach to the debugger, and gives each one a distinct port.
+
+    Ports are assigned from `base_port` in order of selected ranks (rank 0 of ranks [0, 3] gets base_port,
+    rank 3 gets base_port + 1), so the debugger listens on as many ports as there are selected ranks.
+    With RankSelection.All, every rank gets base_port + rank. The first failing rank gets base_port.
+
+    Selected ranks of a node share one relay (see relay_daemon.connect_or_spawn_daemon),
+    so attaching more ranks costs no extra bridge startup.
+    """
+    def __init__(self,
+                 selection: RankSelection = RankSelection.All,
+                 ranks: typing.Iterable[int] = None,
+                 sample_size: int = 1,
+                 seed: int = 0,
+                 base_port: int = 5678,
+                 rank_info: RankInfo = None,
+                 claim_dir: str = None,
+                 logger: logging.Logger = logging.root):
+        """Initializes RankPolicy object.
+
+        Args:
+            selection (RankSelection, optional): Which ranks attach. Defaults to RankSelection.All.
+            ranks (typing.Iterable[int], optional): Ranks to attach with RankSelection.List.
+            sample_size (int, optional): Number of ranks to attach with RankSelection.Sampled. Defaults to 1.
+            seed (int, optional): Sampling seed; every rank must use the same one. Defaults to 0.
+            base_port (int, optional): First debugging port. Defaults to 5678.
+            rank_info (RankInfo, optional): Rank of this process. Defaults to RankInfo.from_environment().
+            claim_dir (str, optional): Where ranks claim the first error. Must be shared storage to pick
+                one rank across nodes, otherwise one rank per node attaches. Defaults to `~/.azdebugrelay`.
+
+        Raises:
+            ValueError: RankSelection.List without ranks, or RankSelection.FirstError in a job of many ranks
+                without a job ID (set AZDEBUGRELAY_JOB_ID to a value unique to the launch).
+        """
+        self.selection = selection
+        self.ranks = sorted(set(int(rank) for rank in ranks or []))
+        self.sample_size = sample_size
+        self.seed = seed
+        self.base_port = int(base_port)
+        self.rank_info = rank_info or RankInfo.from_environment()
+        self.claim_dir = claim_dir or os.path.join(os.path.expanduser("~"), DebugRelay.relay_dir_name)
+        self.logger = logger
+        # relay daemon client holding the port lease, or the rank's own relay without the daemon
+        self.daemon_client = None
+        self.relay = None
+        self._claimed = False
+        if selection == RankSelection.List and not self.ranks:
+            raise ValueError("RankSelection.List requires ranks.")
+        if selection == RankSelection.FirstError and self.rank_info.job_id is None:
+            if self.rank_info.world_size > 1:
+                raise ValueError("RankSelection.FirstError requires a job ID: "
+                                 "set AZDEBUGRELAY_JOB_ID to the same value on all ranks, unique to the launch.")
+            # a single process claims for itself
+            self.rank_info = self.rank_info._replace(job_id=f"pid-{os.getpid()}")
+
+
+    @staticmethod
+    def from_environment(default: str = "all", **kwargs) -> "RankPolicy":
+        """Creates RankPolicy from AZDEBUGRELAY_RANKS environment variable:
+        `all`, comma-separated ranks (`0,3`), `sample:<count>[:<seed>]` or `first-error`.
+
+        Args:
+            default (str, optional): Policy if AZDEBUGRELAY_RANKS is not set. Defaults to "all".
+            kwargs: other RankPolicy arguments
+        """
+        return RankPolicy.parse(os.environ.get(POLICY_VARIABLE) or default, **kwargs)
+
+
+    @staticmethod
+    def parse(value: str, **kwargs) -> "RankPolicy":
+        """Creates RankPolicy from its string form (see from_environment).
+        """
+        value = value.strip().lower()
+        if value == "all":
+            return RankPolicy(RankSelection.All, **kwargs)
+        if value in ("first-error", "first_error"):
+            return RankPolicy(RankSelection.FirstError, **kwargs)
+        if value.startswith("sample:"):
+            parts = value.split(":")
+            if len(parts) > 2:
+                kwargs["seed"] = int(parts[2])
+            return RankPolicy(RankSelection.Sampled, sample_size=int(parts[1]), **kwargs)
+        try:
+            ranks = [int(rank) for rank in value.split(",") if rank.strip()]
+        except ValueError:
+            raise ValueError(f"Invalid rank policy: {value}")
+        return RankPolicy(RankSelection.List, ranks=ranks, **kwargs)
+
+
+    def selected_ranks(self) -> typing.Optional[typing.List[int]]:
+        """Ranks that attach up front, or None with RankSelection.FirstError.
+        """
+        world_size = self.rank_info.world_size
+        if self.selection == RankSelection.All:
+            return list(range(world_size))
+        if self.selection == RankSelection.List:
+            return [rank for rank in self.ranks if rank < world_size]
+        if self.selection == RankSelection.Sampled:
+            return sorted(random.Random(self.seed).sample(range(world_size), min(self.sample_size, world_size)))
+        return None
+
+
+    def should_attach(self) -> bool:
+        """Whether this rank attaches up front
+        (with RankSelection.FirstError, only after it has claimed the first error).
+        """
+        if self.selection == RankSelection.FirstError:
+            return self._claimed
+        if self.selection == RankSelection.All:
+            return True
+        return self.rank_info.rank in self.selected_ranks()
+
+
+    @property
+    def port(self) -> typing.Optional[int]:
+        """Debugging port of this rank, or None if it doesn't attach.
+        """
+        if not self.should_attach():
+            return None
+        if self.selection == RankSelection.FirstError:
+            return self.base_port
+        if self.selection == RankSelection.All:
+            return self.base_port + self.rank_info.rank
+        return self.base_port + self.selected_ranks().index(self.rank_info.rank)
+
+
+    def ports(self) -> typing.List[int]:
+        """Ports the debugger has to listen on, for all selected ranks.
+        """
+        if self.selection == RankSelection.FirstError:
+            return [self.base_port]
+        return [self.base_port + index for index in range(len(self.selected_ranks()))]
+
+
+    def claim_first_error(self) -> bool:
+        """Claims the first error of this launch of the job for this rank, until close().
+
+        Returns:
+            bool: True if no other rank has claimed it before
+        """
+        if self._claimed:
+            return True
+        os.makedirs(self.claim_dir, exist_ok=True)
+        try:
+            os.close(os.open(self._claim_marker(), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+            return False
+        self._claimed = True
+        return True
+
+
+    def attach(self,
+               debug_relay: DebugRelay,
+               connect_timeout: float = 15,
+               use_daemon: bool = True) -> bool:
+        """Attaches this rank to the debugger if the policy selects it.
+
+        The port is leased from the node's relay daemon (launched on first use), so selected
+        ranks of a node share one relay. Without the daemon (use_daemon is False, or on Windows),
+        the rank opens its own relay on its port.
+
+        Args:
+            debug_relay (DebugRelay): Relay configuration (its ports are ignored)
+            connect_timeout (float, optional): debugpy connect timeout, in seconds. Defaults to 15.
+            use_daemon (bool, optional): Share one relay per node. Defaults to True.
+
+        Returns:
+            bool: True if this rank is attached to the debugger
+        """
+        port = self.port
+        if port is None:
+            return False
+        if use_daemon and not DebugRelay.is_windows:
+            from .relay_daemon import connect_or_spawn_daemon
+
+            if self.daemon_client is None:
+                self.daemon_client = connect_or_spawn_daemon(
+                    debug_relay, self.base_port, max(len(self.ports()), self.rank_info.local_size))
+            self.daemon_client.acquire(port)
+        else:
+            self.relay = debug_relay._with_ports([str(port)])
+            self.relay.open()
+        self.logger.info(f"Rank {self.rank_info.rank} attaches to the debugger on port {port}.")
+        return DebugPyEx.connect(debug_relay.host, port, float(connect_timeout))
+
+
+    def attach_on_error(self, debug_relay: DebugRelay, connect_timeout: float = 15) -> "_FirstErrorGuard":
+        """Context manager for RankSelection.FirstError: the first rank that raises an exception
+        inside it attaches to the debugger and breaks before the exception propagates
+        (inspect it as `exc_value` in the debugger).
+        """
+        return _FirstErrorGuard(self, debug_relay, connect_timeout)
+
+
+    def close(self):
+        """Releases the port of this rank (or closes its own relay) and withdraws its first-error claim.
+        """
+        if self.daemon_client is not None:
+            self.daemon_client.close()
+            self.daemon_client = None
+        if self.relay is not None:
+            self.relay.close()
+            self.relay = None
+        if self._claimed:
+            self._claimed = False
+            try:
+                os.remove(self._claim_marker())
+            except FileNotFoundError:
+                pass
+
+
+    def _claim_marker(self) -> str:
+        return os.path.join(self.claim_dir, f"first-error-{_safe_name(self.rank_info.job_id)}")
+
+
+class _FirstErrorGuard(object):
+    def __init__(self, policy: RankPolicy, debug_relay: DebugRelay, connect_timeout: float):
+        self.policy = policy
+        self.debug_relay = debug_relay
+        self.connect_timeout = connect_timeout
+
+
+    def __enter__(self):
+        return self.policy
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None or not issubclass(exc_type, Exception):
+            return False
+        if self.policy.claim_first_error():
+            self.policy.logger.error(f"Rank {self.policy.rank_info.rank} raised {exc_type.__name__}: {exc_value}")
+            if self.policy.attach(self.debug_relay, self.connect_timeout):
+                import debugpy
+                debugpy.breakpoint()
+        return False
+
+
+def _first_int(names: typing.Sequence[str], default: int) -> int:
+    for name in names:
+        value = os.environ.get(name)
+        if value is not None and value.strip().isdigit():
+            return int(value)
+    return default
+
+
+def _safe_name(value: str) -> str:
+    return "".join(char if char.isalnum() or char in "-_." else "_" for char in value)
@@ -0,0 +1,384 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import typing
+
+if __package__:
+    from .debug_relay import DebugRelay, DebugMode, RelayEngine
+    from .relay_stand_in import LocalRelayServer
+else:
+    # launched as a script
+    from debug_relay import DebugRelay, DebugMode, RelayEngine
+    from relay_stand_in import LocalRelayServer
+
+# Message sizes typical of Debug Adapter Protocol traffic:
+# small requests/events, stack traces and variables, large variable values or sources
+DAP_MESSAGE_SIZES = (256, 2048, 16384, 65536)
+
+_BUFFER_SIZE = 65536
+
+
+class EchoServer(object):
+    """TCP echo server (one thread per connection) standing in for a debugger.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        self._socket.listen(16)
+        self.host = host
+        self.port = self._socket.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+
+    def close(self):
+        self._socket.close()
+
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._echo, args=(connection,), daemon=True).start()
+
+
+    @staticmethod
+    def _echo(connection: socket.socket):
+        with connection:
+            while True:
+                try:
+                    data = connection.recv(_BUFFER_SIZE)
+                    if not data:
+                        return
+                    connection.sendall(data)
+                except OSError:
+                    return
+
+
+class WanEmulator(object):
+    """TCP proxy that adds latency, jitter and loss to a path, in a daemon thread.
+
+    Every chunk is delayed by half of `latency` (plus up to half of `jitter`) in each direction.
+    A lost chunk is delivered after an extra `retransmit_delay`, the way TCP recovers from loss,
+    and later chunks wait behind it to keep the stream in order.
+    """
+    def __init__(self,
+                 target_host: str,
+                 target_port: int,
+                 latency: float = 0,
+                 jitter: float = 0,
+                 loss: float = 0,
+                 retransmit_delay: float = 0.2,
+                 host: str = "127.0.0.1"):
+        self.target_host = target_host
+        self.target_port = target_port
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.retransmit_delay = retransmit_delay
+        self.host = host
+        self.port = None
+        self._loop = asyncio.new_event_loop()
+        self._server = None
+        self._pipes = set()
+        started = threading.Event()
+        threading.Thread(target=self._run, args=(started,), daemon=True).start()
+        started.wait()
+
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+    async def _shutdown(self):
+        self._server.close()
+        for task in self._pipes:
+            task.cancel()
+        await asyncio.gather(*self._pipes, return_exceptions=True)
+
+
+    def _run(self, started: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._connection, self.host, 0))
+        self.port = self._server.sockets[0].getsockname()[1]
+        started.set()
+        self._loop.run_forever()
+
+
+    async def _connection(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        try:
+            target_reader, target_writer = await asyncio.open_connection(self.target_host, self.target_port)
+        except OSError:
+            client_writer.close()
+            return
+        pipes = [asyncio.ensure_future(self._pipe(client_reader, target_writer)),
+                 asyncio.ensure_future(self._pipe(target_reader, client_writer))]
+        self._pipes.update(pipes)
+        await asyncio.gather(*pipes, return_exceptions=True)
+        self._pipes.difference_update(pipes)
+
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_event_loop()
+        chunks = asyncio.Queue()
+
+        async def deliver():
+            while True:
+                due, data = await chunks.get()
+                delay = due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if data is None:
+                    writer.close()
+                    return
+                writer.write(data)
+                await writer.drain()
+
+        delivery = asyncio.ensure_future(deliver())
+        last_due = 0
+        try:
+            while True:
+                data = await reader.read(_BUFFER_SIZE)
+                delay = self.latency / 2 + random.uniform(0, self.jitter / 2)
+                if data and self.loss and random.random() < self.loss:
+                    delay += self.retransmit_delay
+                # in-order delivery: nothing overtakes a delayed chunk
+                last_due = max(last_due, loop.time() + delay)
+                chunks.put_nowait((last_due, data or None))
+                if not data:
+                    break
+            await delivery
+        finally:
+            if not delivery.done():
+                delivery.cancel()
+
+
+def _recv_exactly(connection: socket.socket, size: int):
+    received = 0
+    while received < size:
+        data = connection.recv(min(_BUFFER_SIZE, size - received))
+        if not data:
+            raise ConnectionError("Connection closed by the relay.")
+        received += len(data)
+
+
+def measure_rtt(host: str, port: int, size: int, count: int, warmup: int = 3) -> typing.List[float]:
+    """Sends count messages of size bytes to an echo server, one at a time,
+    and returns round-trip times in seconds.
+    """
+    message = os.urandom(size)
+    samples = []
+    with socket.create_connection((host, port)) as connection:
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for index in range(warmup + count):
+            start = time.perf_counter()
+            connection.sendall(message)
+            _recv_exactly(connection, size)
+            if index >= warmup:
+                samples.append(time.perf_counter() - start)
+    return samples
+
+
+def measure_throughput(host: str, port: int, total_bytes: int, chunk_size: int = _BUFFER_SIZE) -> float:
+    """Streams total_bytes through an echo server while reading the echo concurrently.
+    Returns sustained throughput in bytes per second (one direction).
+    """
+    chunk = os.urandom(chunk_size)
+    with socket.create_connection((host, port)) as connection:
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def send():
+            sent = 0
+            while sent < total_bytes:
+                data = chunk[:min(chunk_size, total_bytes - sent)]
+                connection.sendall(data)
+                sent += len(data)
+
+        start = time.perf_counter()
+        sender = threading.Thread(target=send, daemon=True)
+        sender.start()
+        _recv_exactly(connection, total_bytes)
+        elapsed = time.perf_counter() - start
+        sender.join()
+    return total_bytes / elapsed
+
+
+def percentiles(samples: typing.List[float],
+                points: typing.Sequence[float] = (50, 90, 99)) -> typing.Dict[str, float]:
+    ordered = sorted(samples)
+    result = {}
+    for point in points:
+        index = min(len(ordered) - 1, max(0, int(round(point / 100 * len(ordered))) - 1))
+        result[f"p{point:g}"] = ordered[index]
+    result["max"] = ordered[-1]
+    return result
+
+
+class _Tunnel(object):
+    """Echo server behind a listening relay, and a connecting relay forwarding a local port to it.
+    """
+    def __init__(self, options: argparse.Namespace):
+        self.echo = EchoServer(options.host)
+        self.stand_in = None
+        self.relays = []
+        self.port = self.echo.port
+        if options.mode == "direct":
+            return
+        connection_string = options.connection_string
+        relay_connection_name = options.connection_name
+        engine = RelayEngine.Python if options.engine == "python" else RelayEngine.AzureRelayBridge
+        if options.mode == "loopback":
+            self._stand_in_loop = asyncio.new_event_loop()
+            threading.Thread(target=self._stand_in_loop.run_forever, daemon=True).start()
+            self.stand_in = LocalRelayServer()
+            asyncio.run_coroutine_threadsafe(self.stand_in.start(), self._stand_in_loop).result()
+            connection_string = self.stand_in.connection_string()
+            relay_connection_name = relay_connection_name or "bench"
+            # the stand-in speaks the Hybrid Connection protocol of the Python engine only
+            engine = RelayEngine.Python
+        elif not connection_string or not relay_connection_name:
+            connection_string = connection_string or os.environ.get("AZRELAY_CONNECTION_STRING")
+            relay_connection_name = relay_connection_name or os.environ.get("AZRELAY_CONNECTION_NAME")
+            if not connection_string or not relay_connection_name:
+                raise ValueError("--mode relay requires --connection-string and --connection-name "
+                                 "(or AZRELAY_CONNECTION_STRING and AZRELAY_CONNECTION_NAME).")
+        local_port = options.port or _free_port(options.host)
+        listener = DebugRelay(connection_string, relay_connection_name, DebugMode.WaitForConnection,
+                              host=options.host, ports=[self.echo.port], engine=engine)
+        sender = DebugRelay(connection_string, relay_connection_name, DebugMode.Connect,
+                            host=options.host, ports=[local_port], engine=engine)
+        listener.open()
+        self.relays.append(listener)
+        sender.open()
+        self.relays.append(sender)
+        self.port = local_port
+
+
+    def close(self):
+        for debug_relay in reversed(self.relays):
+            debug_relay.close()
+        if self.stand_in is not None:
+            asyncio.run_coroutine_threadsafe(self.stand_in.stop(), self._stand_in_loop).result()
+            self._stand_in_loop.call_soon_threadsafe(self._stand_in_loop.stop)
+        self.echo.close()
+
+
+def _free_port(host: str) -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind((host, 0))
+        return probe.getsockname()[1]
+
+
+def run_bench(options: argparse.Namespace) -> typing.Dict[str, typing.Any]:
+    """Runs the benchmark and returns its results.
+    """
+    tunnel = _Tunnel(options)
+    emulator = None
+    try:
+        host, port = options.host, tunnel.port
+        if options.latency_ms or options.jitter_ms or options.loss:
+            emulator = WanEmulator(host, port, options.latency_ms / 1000, options.jitter_ms / 1000,
+                                   options.loss, options.retransmit_ms / 1000, host)
+            port = emulator.port
+        results = {
+            "mode": options.mode,
+            "engine": "python" if options.mode == "loopback" else options.engine,
+            "latency_ms": options.latency_ms,
+            "jitter_ms": options.jitter_ms,
+            "loss": options.loss,
+            "rtt": {},
+        }
+        for size in options.sizes:
+            samples = measure_rtt(host, port, size, options.count)
+            results["rtt"][str(size)] = {name: value * 1000 for name, value in percentiles(samples).items()}
+        if options.throughput_mb > 0:
+            results["throughput_mb_s"] = measure_throughput(
+                host, port, int(options.throughput_mb * 1048576)) / 1048576
+        return results
+    finally:
+        if emulator is not None:
+            emulator.close()
+        tunnel.close()
+
+
+def _print_results(results: typing.Dict[str, typing.Any]):
+    wan = ""
+    if results["latency_ms"] or results["jitter_ms"] or results["loss"]:
+        wan = f", emulated WAN: +{results['latency_ms']:g} ms RTT, " \
+              f"{results['jitter_ms']:g} ms jitter, {results['loss'] * 100:g}% loss"
+    print(f"Tunnel: {results['mode']} ({results['engine']} engine){wan}")
+    print(f"{'message':>10} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for size, rtt in results["rtt"].items():
+        print(f"{size + ' B':>10} {rtt['p50']:9.2f} {rtt['p90']:9.2f} {rtt['p99']:9.2f} {rtt['max']:9.2f}")
+    if "throughput_mb_s" in results:
+        print(f"Sustained throughput: {results['throughput_mb_s']:.1f} MB/s")
+
+
+def _cli_main(argv):
+    """Tunnel round-trip latency and throughput probe: `python -m azdebugrelay bench`
+
+    Args:
+        argv: Command Line arguments
+
+        --mode - optional, defaults to loopback
+            loopback: Python engine relay pair through a local Azure Relay stand-in (offline);
+            relay: relay pair through a real Azure Relay Hybrid Connection;
+            direct: no relay, a baseline.
+        --engine - optional, defaults to azbridge
+            Tunneling engine for --mode relay: azbridge or python.
+        --connection-string, --connection-name - optional
+            Hybrid Connection for --mode relay. Default to AZRELAY_CONNECTION_STRING and AZRELAY_CONNECTION_NAME.
+        --sizes - optional, defaults to 256,2048,16384,65536
+            Comma-separated message sizes, in bytes.
+        --count - optional, defaults to 100
+            Round trips per message size.
+        --throughput-mb - optional, defaults to 16
+            Megabytes to stream for the throughput test (0 skips it).
+        --latency-ms, --jitter-ms, --loss, --retransmit-ms - optional
+            Emulated WAN round-trip latency, jitter, loss probability (0..1) and retransmission delay.
+        --json - optional
+            Print results as JSON.
+    """
+    parser = argparse.ArgumentParser(prog="python -m azdebugrelay bench")
+    parser.add_argument('--mode', action='store', default="loopback", choices=["loopback", "relay", "direct"])
+    parser.add_argument('--engine', action='store', default="azbridge", choices=["azbridge", "python"])
+    parser.add_argument('--connection-string', action='store', default=None)
+    parser.add_argument('--connection-name', action='store', default=None)
+    parser.add_argument('--host', action='store', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=None, help="Local forwarded port. Defaults to a free port.")
+    parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(",")],
+                        default=list(DAP_MESSAGE_SIZES))
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--throughput-mb', type=float, default=16)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--loss', type=float, default=0)
+    parser.add_argument('--retransmit-ms', type=float, default=200)
+    parser.add_argument('--json', action='store_true', default=False)
+    options = parser.parse_args(args=argv)
+
+    logging.root.setLevel(logging.WARNING)
+    try:
+        results = run_bench(options)
+    except ValueError as ex:
+        parser.error(str(ex))
+    if options.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_results(results)
+
+
+if __name__ == '__main__':
+    _cli_main(sys.argv[1:])
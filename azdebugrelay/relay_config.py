@@ -0,0 +1,436 @@
+import collections
+import logging
+import os
+import threading
+import time
+import typing
+
+# Settings of a relay, as named in .azrelay.json and environment variables
+CONNECTION_STRING = "AZRELAY_CONNECTION_STRING"
+CONNECTION_NAME = "AZRELAY_CONNECTION_NAME"
+# Hybrid Connection URL, needed when the "connection string" is an access key
+HYBRID_CONNECTION_URL = "AZRELAY_HYBRID_CONNECTION_URL"
+DEFAULT_CONFIG_FILE = "./.azrelay.json"
+# Names of settings in secret stores (Key Vault secret names cannot contain underscores)
+DEFAULT_SECRET_NAMES = {
+    CONNECTION_STRING: "azrelay-connection-string",
+    CONNECTION_NAME: "azrelay-connection-name",
+    HYBRID_CONNECTION_URL: "azrelay-hybrid-connection-url",
+}
+# Turns on the on-disk secret cache of default_resolver() in this directory
+SECRET_CACHE_DIR_ENV = "AZDEBUGRELAY_SECRET_CACHE"
+
+# sources of resolved settings other than secret providers
+SOURCE_ARGUMENT = "argument"
+SOURCE_ENVIRONMENT = "environment"
+SOURCE_CONFIG_FILE = "config file"
+
+# ConfigResolver.resolve_setting() default: the resolver's configuration file
+_DEFAULT = object()
+
+
+class SecretProvider(object):
+    """Looks up secrets for ConfigResolver, e.g. in Azure Key Vault.
+    Subclasses implement get_secret(). name identifies the secret store in SecretCache,
+    so providers of different stores must have different names.
+    """
+    name = "secret"
+
+    def get_secret(self, secret_name: str) -> typing.Optional[str]:
+        """Returns the secret, or None if there is no such secret.
+        """
+        raise NotImplementedError
+
+
+class LocalSecretProvider(SecretProvider):
+    """Serves secrets from a dict, after a simulated lookup latency, and counts lookups.
+    Stands in for a remote secret store, so resolution and caching can be tested and measured offline.
+    """
+    def __init__(self, secrets: typing.Dict[str, str] = None, latency: float = 0, name: str = "local"):
+        """Initializes LocalSecretProvider object.
+
+        Args:
+            secrets (typing.Dict[str, str], optional): Secrets by name. Defaults to None (no secrets).
+            latency (float, optional): Time every lookup takes, in seconds. Defaults to 0.
+            name (str, optional): Provider name. Defaults to "local".
+        """
+        self.secrets = dict(secrets or {})
+        self.latency = latency
+        self.name = name
+        self.lookups = 0
+
+
+    def get_secret(self, secret_name: str) -> typing.Optional[str]:
+        self.lookups += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.secrets.get(secret_name)
+
+
+class SecretCache(object):
+    """Keeps secrets found by secret providers for ttl seconds, in memory and optionally on disk.
+
+    Memory holds the max_entries most recently used secrets of this process.
+    The disk cache is shared by processes of the current user: one file per secret,
+    readable by the current user only, the oldest removed beyond max_entries.
+    Secrets not found are not cached.
+    """
+    def __init__(self,
+                 ttl: float = 3600,
+                 max_entries: int = 256,
+                 directory: str = None,
+                 logger: logging.Logger = logging.root):
+        """Initializes SecretCache object.
+
+        Args:
+            ttl (float, optional): How long secrets are kept, in seconds. Defaults to 3600.
+            max_entries (int, optional): Maximum number of secrets kept in memory, and on disk. Defaults to 256.
+            directory (str, optional): Directory of the on-disk cache. Defaults to None (memory only).
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.directory = directory
+        self.logger = logger
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # (provider name, secret name) -> (expiry time, secret), least recently used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, provider_name: str, secret_name: str) -> typing.Optional[str]:
+        """Returns a cached secret, or None if it isn't cached or has expired.
+        """
+        key = (provider_name, secret_name)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+        entry = self._read(key, now) if self.directory else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._keep(key, entry)
+        return entry[1]
+
+
+    def put(self, provider_name: str, secret_name: str, secret: str):
+        key = (provider_name, secret_name)
+        entry = (time.time() + self.ttl, secret)
+        with self._lock:
+            self._keep(key, entry)
+        if self.directory:
+            try:
+                self._write(key, entry)
+            except OSError as ex:
+                self.logger.warning(f"Cannot write secret cache: {ex}")
+
+
+    def clear(self):
+        """Forgets all secrets, including those on disk.
+        """
+        with self._lock:
+            self._entries.clear()
+        for path in self._files():
+            _remove(path)
+
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """Returns hits (in memory), disk_hits, misses, evictions (from memory), expirations,
+        entries (in memory) and hit_rate.
+        """
+        with self._lock:
+            entries = len(self._entries)
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": entries,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+    def _keep(self, key: typing.Tuple[str, str], entry: typing.Tuple[float, str]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+    def _path(self, key: typing.Tuple[str, str]) -> str:
+        import hashlib
+
+        # file names don't reveal secret names
+        return os.path.join(self.directory, hashlib.sha256("\0".join(key).encode()).hexdigest() + ".json")
+
+
+    def _files(self) -> typing.List[str]:
+        if not self.directory:
+            return []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [os.path.join(self.directory, name) for name in names if name.endswith(".json")]
+
+
+    def _read(self, key: typing.Tuple[str, str], now: float) -> typing.Optional[typing.Tuple[float, str]]:
+        import json
+
+        path = self._path(key)
+        try:
+            with open(path) as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if data.get("provider") != key[0] or data.get("name") != key[1]:
+            return None
+        if data.get("expires", 0) <= now:
+            with self._lock:
+                self.expirations += 1
+            _remove(path)
+            return None
+        return data["expires"], data["secret"]
+
+
+    def _write(self, key: typing.Tuple[str, str], entry: typing.Tuple[float, str]):
+        import json
+
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as cache_file:
+            json.dump({"provider": key[0], "name": key[1], "expires": entry[0], "secret": entry[1]}, cache_file)
+        os.replace(temp_path, path)
+        files = self._files()
+        if len(files) > self.max_entries:
+            files.sort(key=_modified_time)
+            for old_path in files[:len(files) - self.max_entries]:
+                _remove(old_path)
+
+
+class RelayConfig(object):
+    """Relay settings resolved by ConfigResolver.
+    sources tells where each setting came from: "argument", "environment", "config file",
+    or the name of a secret provider.
+    """
+    def __init__(self,
+                 connection_string: typing.Optional[str],
+                 connection_name: typing.Optional[str],
+                 sources: typing.Dict[str, str]):
+        self.connection_string = connection_string
+        self.connection_name = connection_name
+        self.sources = sources
+
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.connection_string) and bool(self.connection_name)
+
+
+class ConfigResolver(object):
+    """Resolves relay settings from, in this order: explicit arguments, environment variables,
+    a configuration file (.azrelay.json), and secret providers (SecretProvider) in the order given.
+    The first non-empty value wins.
+
+    Secrets found by providers are cached (see SecretCache), and the configuration file is parsed again
+    only once it changes, so relays opened over and over don't hit secret stores or the disk every time.
+    """
+    def __init__(self,
+                 config_file: typing.Optional[str] = DEFAULT_CONFIG_FILE,
+                 providers: typing.List[SecretProvider] = None,
+                 secret_names: typing.Dict[str, str] = None,
+                 cache: SecretCache = None,
+                 environment: typing.Mapping[str, str] = None,
+                 logger: logging.Logger = logging.root):
+        """Initializes ConfigResolver object.
+
+        Args:
+            config_file (str, optional): JSON configuration file, None for none. Defaults to "./.azrelay.json".
+            providers (typing.List[SecretProvider], optional): Secret providers. Defaults to None.
+            secret_names (typing.Dict[str, str], optional): Names providers look settings up by,
+                in addition to (or overriding) DEFAULT_SECRET_NAMES. Defaults to None.
+            cache (SecretCache, optional): Cache of secrets found by providers. Defaults to None (a new SecretCache).
+            environment (typing.Mapping[str, str], optional): Environment variables. Defaults to None (os.environ).
+        """
+        self.config_file = config_file
+        self.providers = list(providers or [])
+        self.secret_names = dict(DEFAULT_SECRET_NAMES)
+        self.secret_names.update(secret_names or {})
+        self.cache = cache if cache is not None else SecretCache(logger=logger)
+        self.environment = os.environ if environment is None else environment
+        self.logger = logger
+        # secret provider lookups (cache misses) and the time they took, in seconds
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+        # number of settings resolved from each source
+        self.sources = collections.Counter()
+        # absolute path -> (modification time and size, settings)
+        self._config_files = {}
+        self._lock = threading.Lock()
+
+
+    def add_provider(self, provider: SecretProvider):
+        """Adds a secret provider, consulted after those added before.
+        """
+        self.providers.append(provider)
+
+
+    def resolve(self,
+                connection_string: str = None,
+                connection_name: str = None,
+                config_file: typing.Optional[str] = _DEFAULT,
+                use_environment: bool = True) -> RelayConfig:
+        """Resolves connection string and Hybrid Connection name of a relay.
+
+        Args:
+            connection_string (str, optional): Explicit connection string. Defaults to None.
+            connection_name (str, optional): Explicit Hybrid Connection name. Defaults to None.
+            config_file (str, optional): Configuration file, None for none. Defaults to the resolver's one.
+            use_environment (bool, optional): Whether environment variables are used. Defaults to True.
+
+        Raises:
+            ValueError: the configuration file is not valid JSON
+        """
+        sources = {}
+        values = {}
+        for setting, value in ((CONNECTION_STRING, connection_string), (CONNECTION_NAME, connection_name)):
+            values[setting], source = self.resolve_setting(setting, value, config_file, use_environment)
+            if source is not None:
+                sources[setting] = source
+        return RelayConfig(values[CONNECTION_STRING], values[CONNECTION_NAME], sources)
+
+
+    def resolve_setting(self,
+                        setting: str,
+                        value: str = None,
+                        config_file: typing.Optional[str] = _DEFAULT,
+                        use_environment: bool = True) -> typing.Tuple[typing.Optional[str], typing.Optional[str]]:
+        """Resolves one setting (e.g. AZRELAY_CONNECTION_STRING). Returns its value and source, or (None, None).
+        """
+        if config_file is _DEFAULT:
+            config_file = self.config_file
+        if value:
+            return self._found(value, SOURCE_ARGUMENT)
+        if use_environment and self.environment.get(setting):
+            return self._found(self.environment[setting], SOURCE_ENVIRONMENT)
+        if config_file:
+            value = self.read_config_file(config_file).get(setting)
+            if value:
+                return self._found(value, SOURCE_CONFIG_FILE)
+        secret_name = self.secret_names.get(setting, setting)
+        for provider in list(self.providers):
+            value = self.cache.get(provider.name, secret_name)
+            if value is None:
+                value = self._lookup(provider, secret_name)
+            if value:
+                return self._found(value, provider.name)
+        return None, None
+
+
+    def read_config_file(self, config_file: str) -> typing.Dict[str, typing.Any]:
+        """Returns settings of a JSON configuration file, {} if it doesn't exist.
+        The file is only parsed again once it changes.
+
+        Raises:
+            ValueError: the file is not valid JSON
+        """
+        path = os.path.abspath(config_file)
+        try:
+            status = os.stat(path)
+        except OSError:
+            return {}
+        version = (status.st_mtime_ns, status.st_size)
+        with self._lock:
+            cached = self._config_files.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        import json
+
+        with open(path) as cfg_file:
+            settings = json.load(cfg_file)
+        if not isinstance(settings, dict):
+            raise ValueError(f"Configuration file {config_file} must contain a JSON object.")
+        with self._lock:
+            self._config_files[path] = (version, settings)
+        return settings
+
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """Returns secret provider lookups, their average latency (lookup_latency_seconds),
+        settings resolved from each source, and SecretCache.stats().
+        """
+        stats = self.cache.stats()
+        stats.update({
+            "lookups": self.lookups,
+            "lookup_latency_seconds": self.lookup_seconds / self.lookups if self.lookups else 0.0,
+            "sources": dict(self.sources),
+        })
+        return stats
+
+
+    def _found(self, value: str, source: str) -> typing.Tuple[str, str]:
+        with self._lock:
+            self.sources[source] += 1
+        return value, source
+
+
+    def _lookup(self, provider: SecretProvider, secret_name: str) -> typing.Optional[str]:
+        start = time.monotonic()
+        try:
+            value = provider.get_secret(secret_name)
+        except Exception as ex:
+            self.logger.warning(f"Secret provider {provider.name} cannot look up {secret_name}: {ex}")
+            value = None
+        finally:
+            with self._lock:
+                self.lookups += 1
+                self.lookup_seconds += time.monotonic() - start
+        if value:
+            self.cache.put(provider.name, secret_name, value)
+        return value
+
+
+def _modified_time(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def default_resolver() -> ConfigResolver:
+    """Returns the resolver DebugRelay.from_config() and from_environment() use by default, created on first use.
+    Add secret providers to it with add_provider(). Secrets are also cached on disk
+    if AZDEBUGRELAY_SECRET_CACHE environment variable names a directory.
+    """
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = ConfigResolver(cache=SecretCache(directory=os.environ.get(SECRET_CACHE_DIR_ENV) or None))
+    return _resolver
@@ -0,0 +1,425 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+import typing
+from pathlib import Path
+
+if __package__:
+    from .debug_relay import DebugRelay, DebugMode, RelayEngine
+    from .bridge_installer import FileLock
+    from .relay_registry import _hostname
+else:
+    # launched as a script (e.g. by the VS Code extension)
+    from debug_relay import DebugRelay, DebugMode, RelayEngine
+    from bridge_installer import FileLock
+    from relay_registry import _hostname
+
+# Unix domain socket paths longer than this don't fit sockaddr_un on all platforms
+_MAX_SOCKET_PATH = 100
+
+
+def daemon_config(debug_relay: DebugRelay, base_port: int, max_ports: int) -> str:
+    """Returns fingerprint of the relay a daemon runs: connection, credentials, mode, host and forwarded ports.
+    """
+    return _daemon_relay(debug_relay, base_port, max_ports)._shared_config()
+
+
+def default_socket_path(config: str) -> str:
+    """Relay daemon socket of a relay configuration (see daemon_config()) on this machine,
+    `~/.azdebugrelay/relayd.<hostname>.<config>.sock`. Home directories may be shared by many machines.
+    """
+    import hashlib
+
+    folder = os.path.join(Path.home(), DebugRelay.relay_dir_name)
+    hostname = _hostname()
+    path = os.path.join(folder, f"relayd.{hostname}.{config}.sock")
+    if len(path.encode()) > _MAX_SOCKET_PATH:
+        # long host names are shortened to a hash
+        path = os.path.join(folder, f"relayd.{hashlib.sha256(hostname.encode()).hexdigest()[:8]}.{config}.sock")
+    return path
+
+
+def _daemon_relay(debug_relay: DebugRelay, base_port: int, max_ports: int) -> DebugRelay:
+    return debug_relay._with_ports(list(range(base_port, base_port + max_ports)))
+
+
+def _is_listening(socket_path: str) -> bool:
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+class RelayDaemon(object):
+    """Node-level relay daemon.
+
+    Processes on the node ask the daemon for forwarded ports over a Unix domain socket
+    (see RelayDaemonClient) instead of launching their own Azure Relay Bridge.
+    The daemon runs one shared bridge forwarding all ports it hands out (base_port to base_port + max_ports - 1)
+    while any port is leased, and reclaims ports as soon as the connection of the process that leased them closes.
+    Only available on POSIX.
+    """
+    def __init__(self,
+                 debug_relay: DebugRelay,
+                 base_port: int = 5678,
+                 max_ports: int = 64,
+                 socket_path: str = None,
+                 idle_timeout: float = None,
+                 logger: logging.Logger = logging.root):
+        """Initializes RelayDaemon object.
+
+        Args:
+            debug_relay (DebugRelay): Relay configuration (credentials, connection name, mode, host, engine).
+                Its ports are ignored.
+            base_port (int, optional): First port to hand out. Defaults to 5678.
+            max_ports (int, optional): Maximum number of ports to hand out. Defaults to 64.
+            socket_path (str, optional): Unix domain socket path.
+                Defaults to `~/.azdebugrelay/relayd.<hostname>.<config>.sock` (see default_socket_path()).
+            idle_timeout (float, optional): Exit after this many seconds without leased ports.
+                Defaults to None (run until stopped).
+        """
+        self.debug_relay = debug_relay
+        self.base_port = base_port
+        self.max_ports = max_ports
+        # fingerprint of the relay configuration, checked by clients (see RelayDaemonClient)
+        self.config = daemon_config(debug_relay, base_port, max_ports)
+        self.socket_path = socket_path or default_socket_path(self.config)
+        self.idle_timeout = idle_timeout
+        self.logger = logger
+        # port -> id of the client connection that leased it
+        self.leases = {}
+        self._relay = None
+        self._active_ports = []
+        self._apply_lock = None
+        self._server = None
+        self._stopped = None
+        # tasks serving client connections, and whether the daemon is shutting down
+        self._clients = set()
+        self._closing = False
+        self._idle_since = time.monotonic()
+
+
+    def run(self):
+        """Runs the daemon until stopped (blocking).
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.serve())
+        finally:
+            loop.close()
+
+
+    async def serve(self):
+        """Serves requests until stop() is called or the idle timeout expires.
+        """
+        self._apply_lock = asyncio.Lock()
+        self._stopped = asyncio.get_event_loop().create_future()
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            if _is_listening(self.socket_path):
+                raise RuntimeError(f"Another relay daemon is listening on {self.socket_path}.")
+            # left behind by a daemon that has crashed
+            os.remove(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._accept, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self.logger.info(f"Relay daemon is listening on {self.socket_path}")
+        try:
+            while not self._stopped.done():
+                await asyncio.wait([self._stopped], timeout=1)
+                if self.idle_timeout is not None and not self.leases \
+                        and time.monotonic() - self._idle_since > self.idle_timeout:
+                    self.logger.info("Relay daemon is idle. Exiting.")
+                    break
+        finally:
+            self._closing = True
+            self._server.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            clients = list(self._clients)
+            for client in clients:
+                client.cancel()
+            if clients:
+                await asyncio.wait(clients)
+            if self._relay is not None:
+                await self._relay.close_async()
+                self._relay = None
+
+
+    def stop(self):
+        """Stops serving: the shared bridge is closed and serve() returns.
+        """
+        if self._stopped is not None and not self._stopped.done():
+            self._stopped.set_result(None)
+
+
+    def _allocate(self, requested: typing.Optional[int], client_id: int) -> int:
+        if requested is not None:
+            if not self.base_port <= requested < self.base_port + self.max_ports:
+                raise ValueError(f"Port {requested} is not forwarded by the relay daemon "
+                                 f"({self.base_port}-{self.base_port + self.max_ports - 1}).")
+            if requested in self.leases:
+                raise ValueError(f"Port {requested} is already leased.")
+            port = requested
+        else:
+            free = [port for port in range(self.base_port, self.base_port + self.max_ports)
+                    if port not in self.leases]
+            if not free:
+                raise ValueError("No free ports left.")
+            port = free[0]
+        self.leases[port] = client_id
+        return port
+
+
+    def _release(self, port: int):
+        self.leases.pop(port, None)
+        if not self.leases:
+            self._idle_since = time.monotonic()
+
+
+    async def _apply(self):
+        """Opens the shared bridge once a port is leased (or again if it has stopped), forwarding all ports
+        the daemon hands out, and closes it once no ports are leased. Leases are only bookkeeping
+        while the bridge runs: it is never restarted under attached processes, so their sessions go on.
+        """
+        async with self._apply_lock:
+            # nothing is reopened while shutting down
+            wanted = bool(self.leases) and not self._closing
+            running = self._relay is not None and await self._relay.is_running_async()
+            if running and wanted:
+                return
+            if self._relay is not None:
+                await self._relay.close_async()
+                self._relay = None
+            self._active_ports = []
+            if wanted:
+                ports = list(range(self.base_port, self.base_port + self.max_ports))
+                relay = _daemon_relay(self.debug_relay, self.base_port, self.max_ports)
+                self.logger.info(f"Forwarding ports {ports[0]}-{ports[-1]}")
+                await relay.open_async()
+                self._relay = relay
+                self._active_ports = ports
+
+
+    def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = asyncio.ensure_future(self._handle_client(reader, writer))
+        self._clients.add(client)
+        client.add_done_callback(self._clients.discard)
+
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client_id = id(writer)
+        leased = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode())
+                    op = request.get("op")
+                    if op == "acquire":
+                        port = self._allocate(request.get("port"), client_id)
+                        leased.add(port)
+                        try:
+                            await self._apply()
+                        except Exception:
+                            leased.discard(port)
+                            self._release(port)
+                            raise
+                        response = {"ok": True, "port": port}
+                    elif op == "release":
+                        port = int(request["port"])
+                        if port in leased:
+                            leased.discard(port)
+                            self._release(port)
+                            await self._apply()
+                        response = {"ok": True}
+                    elif op == "status":
+                        response = {"ok": True, "ports": self._active_ports, "leases": len(self.leases),
+                                    "config": self.config}
+                    elif op == "stop":
+                        self.stop()
+                        response = {"ok": True}
+                    else:
+                        response = {"ok": False, "error": f"Unknown operation: {op}"}
+                except Exception as ex:
+                    response = {"ok": False, "error": str(ex)}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            # the client has gone (or crashed): reclaim its ports
+            if leased:
+                for port in leased:
+                    self._release(port)
+                try:
+                    await self._apply()
+                except Exception as ex:
+                    self.logger.warning(f"Cannot update the shared relay: {ex}")
+
+
+class RelayDaemonClient(object):
+    """Client of RelayDaemon.
+    Leased ports stay forwarded until released or until this client is closed
+    (including when the process exits).
+    """
+    def __init__(self, socket_path: str, timeout: float = 60, config: str = None):
+        """Connects to a relay daemon.
+
+        Args:
+            socket_path (str): Daemon socket path (see default_socket_path())
+            timeout (float, optional): Maximum time to wait for a response, in seconds. Defaults to 60.
+            config (str, optional): Expected relay configuration of the daemon (see daemon_config()).
+                Defaults to None (don't check).
+
+        Raises:
+            OSError: The daemon is not running.
+            RuntimeError: The daemon runs another relay configuration.
+        """
+        self.socket_path = socket_path
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        try:
+            self._socket.connect(self.socket_path)
+        except OSError:
+            self._socket.close()
+            raise
+        self._reader = self._socket.makefile("rb")
+        if config is not None:
+            try:
+                actual = self.status().get("config")
+            except BaseException:
+                self.close()
+                raise
+            if actual != config:
+                self.close()
+                raise RuntimeError(f"Relay daemon on {socket_path} runs another relay configuration.")
+
+
+    def acquire(self, port: int = None) -> int:
+        """Leases a port and waits until the shared bridge forwards it.
+
+        Args:
+            port (int, optional): Specific port to lease. Defaults to None (any free port).
+
+        Raises:
+            RuntimeError: The daemon couldn't lease the port.
+
+        Returns:
+            int: forwarded port
+        """
+        return self._request({"op": "acquire", "port": port, "pid": os.getpid()})["port"]
+
+
+    def release(self, port: int):
+        self._request({"op": "release", "port": port})
+
+
+    def status(self) -> typing.Dict[str, typing.Any]:
+        return self._request({"op": "status"})
+
+
+    def stop(self):
+        """Asks the daemon to exit, closing the shared bridge under all of its clients.
+        """
+        self._request({"op": "stop"})
+
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def _request(self, request: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        self._socket.sendall((json.dumps(request) + "\n").encode())
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Relay daemon closed the connection.")
+        response = json.loads(line.decode())
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error"))
+        return response
+
+
+def connect_or_spawn_daemon(debug_relay: DebugRelay,
+                            base_port: int = 5678,
+                            max_ports: int = 64,
+                            socket_path: str = None,
+                            idle_timeout: float = 300,
+                            start_timeout: float = 30) -> RelayDaemonClient:
+    """Connects to the node's relay daemon, launching one if it's not running.
+    Safe to call from many processes at once: only one of them launches the daemon.
+
+    Args:
+        debug_relay (DebugRelay): Relay configuration for the daemon (used if it has to be launched)
+        base_port (int, optional): First port the daemon hands out. Defaults to 5678.
+        max_ports (int, optional): Maximum number of ports. Defaults to 64.
+        socket_path (str, optional): Daemon socket path.
+            Defaults to `~/.azdebugrelay/relayd.<hostname>.<config>.sock` (see default_socket_path()).
+        idle_timeout (float, optional): Seconds the launched daemon stays alive without leased ports. Defaults to 300.
+        start_timeout (float, optional): Maximum time to wait for the daemon to start. Defaults to 30.
+
+    Raises:
+        TimeoutError: The daemon did not start in time.
+        RuntimeError: A daemon with another relay configuration listens on socket_path.
+
+    Returns:
+        RelayDaemonClient: connected client
+    """
+    config = daemon_config(debug_relay, base_port, max_ports)
+    socket_path = socket_path or default_socket_path(config)
+    try:
+        return RelayDaemonClient(socket_path, config=config)
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    with FileLock(socket_path + ".lock"):
+        try:
+            return RelayDaemonClient(socket_path, config=config)
+        except OSError:
+            pass
+        mode = "listen" if debug_relay.debug_mode == DebugMode.WaitForConnection else "connect"
+        engine = "python" if debug_relay.engine == RelayEngine.Python else "azbridge"
+        # credentials go through the environment, not the command line
+        environment = dict(os.environ)
+        environment["AZRELAY_CONNECTION_STRING"] = debug_relay._access_key_or_connection_string
+        environment["AZRELAY_CONNECTION_NAME"] = debug_relay.relay_connection_name
+        if debug_relay.hybrid_connection_url:
+            # with an access key instead of a connection string
+            environment["AZRELAY_HYBRID_CONNECTION_URL"] = debug_relay.hybrid_connection_url
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "debug_relay.py")
+        with open(os.path.splitext(socket_path)[0] + ".log", "ab") as log_file:
+            subprocess.Popen(
+                [sys.executable, script, "--no-kill", "--daemon",
+                 "--mode", mode, "--host", debug_relay.host, "--engine", engine,
+                 "--ports", str(base_port), "--max-ports", str(max_ports),
+                 "--socket-path", socket_path, "--idle-timeout", str(idle_timeout)],
+                env=environment, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+                start_new_session=True, close_fds=True)
+        deadline = time.monotonic() + start_timeout
+        while time.monotonic() < deadline:
+            try:
+                return RelayDaemonClient(socket_path, config=config)
+            except OSError:
+                time.sleep(0.1)
+    raise TimeoutError("Relay daemon took too long to start.")
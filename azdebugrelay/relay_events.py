@@ -0,0 +1,176 @@
+import queue
+import threading
+import time
+import typing
+
+# Relay event kinds
+EVENT_FORWARD_START = "forward start"
+EVENT_FORWARD_STOP = "forward stop"
+EVENT_CONNECTION_ACCEPTED = "connection accepted"
+EVENT_CONNECTION_CLOSED = "connection closed"
+EVENT_BYTES_TRANSFERRED = "bytes transferred"
+EVENT_ERROR = "error"
+# supervised relay went down and came back up (see relay_supervisor.RelaySupervisor)
+EVENT_RELAY_DOWN = "relay down"
+EVENT_RELAY_UP = "relay up"
+
+
+class RelayEvent(typing.NamedTuple):
+    """Typed relay event, parsed from Azure Relay Bridge output or reported by the Python engine.
+    """
+    # one of EVENT_* values
+    kind: str
+    # time.time() of the event
+    timestamp: float
+    # forwarded port, if known
+    port: typing.Optional[str] = None
+    # bytes transferred, if known (total of a closed connection with the Python engine)
+    bytes: typing.Optional[int] = None
+    # Azure Relay Bridge output line the event was parsed from
+    line: str = ""
+
+
+class EventStream(object):
+    """Publishes relay events to any number of sync or async iterators, and keeps running counters.
+    Thread-safe. Subscribers that fall more than `max_queued` events behind lose new events
+    (counted in `events_dropped`) rather than slowing the relay down.
+    """
+    max_queued = 10000
+
+    # event kind -> counter
+    _COUNTERS = {
+        EVENT_FORWARD_START: "forwards_started",
+        EVENT_FORWARD_STOP: "forwards_stopped",
+        EVENT_CONNECTION_ACCEPTED: "connections_accepted",
+        EVENT_CONNECTION_CLOSED: "connections_closed",
+        EVENT_ERROR: "errors",
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._counters = {
+            "forwards_started": 0,
+            "forwards_stopped": 0,
+            "connections_accepted": 0,
+            "connections_closed": 0,
+            "bytes_transferred": 0,
+            "errors": 0,
+            "events_dropped": 0,
+        }
+        self._last_event_time = None
+
+
+    def publish(self, kind: str, port: str = None, bytes: int = None, line: str = ""):
+        """Publishes an event to all subscribers.
+        """
+        event = RelayEvent(kind, time.time(), port, bytes, line)
+        counter = EventStream._COUNTERS.get(kind)
+        with self._lock:
+            if counter is not None:
+                self._counters[counter] += 1
+            if bytes:
+                self._counters["bytes_transferred"] += bytes
+            self._last_event_time = event.timestamp
+            subscribers = list(self._subscribers)
+        for put in subscribers:
+            if not put(event):
+                with self._lock:
+                    self._counters["events_dropped"] += 1
+
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """Returns running counters: forwards_started, forwards_stopped, connections_accepted,
+        connections_closed, active_connections, bytes_transferred, errors, events_dropped
+        and last_event_time (time.time() of the last event, or None).
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["last_event_time"] = self._last_event_time
+        stats["active_connections"] = max(0, stats["connections_accepted"] - stats["connections_closed"])
+        return stats
+
+
+    def iterate(self, timeout: float = None) -> typing.Iterator[RelayEvent]:
+        """Returns an iterator over events published from now on.
+
+        Args:
+            timeout (float, optional): Stop iterating after this many seconds without events.
+                Defaults to None (iterate until the iterator is closed).
+        """
+        events = queue.Queue(EventStream.max_queued)
+
+        def put(event: RelayEvent) -> bool:
+            try:
+                events.put_nowait(event)
+                return True
+            except queue.Full:
+                return False
+
+        self._subscribe(put)
+
+        def iterator():
+            try:
+                while True:
+                    try:
+                        yield events.get(timeout=timeout)
+                    except queue.Empty:
+                        return
+            finally:
+                self._unsubscribe(put)
+
+        return iterator()
+
+
+    def iterate_async(self, timeout: float = None) -> typing.AsyncIterator[RelayEvent]:
+        """Returns an async iterator over events published from now on, bound to the current event loop.
+
+        Args:
+            timeout (float, optional): Stop iterating after this many seconds without events.
+                Defaults to None (iterate until the iterator is closed or cancelled).
+        """
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        events = asyncio.Queue(EventStream.max_queued)
+
+        def put_nowait(event: RelayEvent):
+            try:
+                events.put_nowait(event)
+            except asyncio.QueueFull:
+                with self._lock:
+                    self._counters["events_dropped"] += 1
+
+        def put(event: RelayEvent) -> bool:
+            try:
+                loop.call_soon_threadsafe(put_nowait, event)
+                return True
+            except RuntimeError:
+                # the loop is closed
+                self._unsubscribe(put)
+                return False
+
+        self._subscribe(put)
+
+        async def iterator():
+            try:
+                while True:
+                    try:
+                        yield await asyncio.wait_for(events.get(), timeout)
+                    except asyncio.TimeoutError:
+                        return
+            finally:
+                self._unsubscribe(put)
+
+        return iterator()
+
+
+    def _subscribe(self, put: typing.Callable[[RelayEvent], bool]):
+        with self._lock:
+            self._subscribers.append(put)
+
+
+    def _unsubscribe(self, put: typing.Callable[[RelayEvent], bool]):
+        with self._lock:
+            if put in self._subscribers:
+                self._subscribers.remove(put)
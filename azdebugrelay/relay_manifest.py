@@ -0,0 +1,397 @@
+import logging
+import os
+import time
+import typing
+
+if __package__:
+    from .debug_relay import DebugRelay, DebugMode, DebugRelayTimeoutError, RelayEngine
+    from .relay_supervisor import RestartPolicy
+    from .relay_config import ConfigResolver, default_resolver
+else:
+    # launched as a script (e.g. by the VS Code extension)
+    from debug_relay import DebugRelay, DebugMode, DebugRelayTimeoutError, RelayEngine
+    from relay_supervisor import RestartPolicy
+    from relay_config import ConfigResolver, default_resolver
+
+# readiness of a relay after RelayManifest.start_async()
+STATUS_READY = "ready"
+STATUS_TIMEOUT = "timeout"
+STATUS_FAILED = "failed"
+# a ready relay that has stopped on its own later (see RelayManifest.run_async())
+STATUS_EXITED = "exited"
+# How often run_async() checks shared bridges adopted from other processes, which don't notify their exits, in seconds
+_ADOPTED_CHECK_INTERVAL = 1.0
+
+_MODES = {"connect": DebugMode.Connect, "listen": DebugMode.WaitForConnection}
+_ENGINES = {"azbridge": RelayEngine.AzureRelayBridge, "python": RelayEngine.Python}
+
+
+class RelaySpec(object):
+    """One relay of a manifest (see load_manifest()).
+    """
+    # settings a manifest may give for every relay
+    KEYS = ("name", "connection_name", "connection_string", "config_file", "mode", "host", "ports",
+            "engine", "restart", "shared", "wait_time")
+
+    def __init__(self,
+                 name: str,
+                 connection_name: str = None,
+                 connection_string: str = None,
+                 config_file: str = None,
+                 mode: str = "connect",
+                 host: str = "127.0.0.1",
+                 ports: typing.List[str] = None,
+                 engine: str = "azbridge",
+                 restart: bool = None,
+                 shared: bool = False,
+                 wait_time: float = 60):
+        """Initializes RelaySpec object.
+
+        Args:
+            name (str): Relay name in reports. Defaults to connection_name in manifests.
+            connection_name (str, optional): Hybrid Connection name. Defaults to None (resolved as the connection string).
+            connection_string (str, optional): Connection string. Defaults to None (resolved with ConfigResolver).
+            config_file (str, optional): Configuration file to resolve missing settings from. Defaults to None.
+            mode (str, optional): connect or listen. Defaults to "connect".
+            host (str, optional): Local hostname/address. Defaults to "127.0.0.1".
+            ports (typing.List[str], optional): Ports. Defaults to ["5678"].
+            engine (str, optional): azbridge or python. Defaults to "azbridge".
+            restart (bool, optional): Restart the relay whenever it fails or exits (see RestartPolicy).
+                Defaults to None (unless shared).
+            shared (bool, optional): Reuse a running bridge with the same configuration (see DebugRelay). Defaults to False.
+            wait_time (float, optional): How long to wait for the relay to connect, in seconds. Defaults to 60.
+
+        Raises:
+            ValueError: invalid mode, engine or ports
+        """
+        if mode not in _MODES:
+            raise ValueError(f"Relay {name}: mode must be one of {', '.join(_MODES)}.")
+        if engine not in _ENGINES:
+            raise ValueError(f"Relay {name}: engine must be one of {', '.join(_ENGINES)}.")
+        if ports is None:
+            ports = ["5678"]
+        elif isinstance(ports, (str, int)):
+            ports = str(ports).replace(",", " ").split()
+        ports = [str(port) for port in ports]
+        if not ports or not all(port.isdigit() for port in ports):
+            raise ValueError(f"Relay {name}: ports must be a list of port numbers.")
+        self.name = name
+        self.connection_name = connection_name
+        self.connection_string = connection_string
+        self.config_file = config_file
+        self.mode = mode
+        self.host = host
+        self.ports = ports
+        self.engine = engine
+        self.restart = not shared if restart is None else bool(restart)
+        self.shared = bool(shared)
+        self.wait_time = float(wait_time)
+
+
+    @staticmethod
+    def from_dict(data: typing.Dict[str, typing.Any], index: int) -> "RelaySpec":
+        """Creates RelaySpec from a manifest entry (index is its position, for error messages).
+
+        Raises:
+            ValueError: unknown or invalid settings
+        """
+        if not isinstance(data, dict):
+            raise ValueError(f"Relay #{index + 1} of the manifest must be an object.")
+        unknown = sorted(set(data) - set(RelaySpec.KEYS))
+        if unknown:
+            raise ValueError(f"Relay #{index + 1} of the manifest has unknown settings: {', '.join(unknown)}.")
+        data = dict(data)
+        data["name"] = str(data.get("name") or data.get("connection_name") or f"relay{index + 1}")
+        return RelaySpec(**data)
+
+
+def load_manifest(path: str) -> typing.List[RelaySpec]:
+    """Reads a relay manifest: a JSON (or, with PyYAML installed, YAML) file with a list of relays,
+    or an object with `relays` and optional `defaults` applied to every relay, e.g.
+
+        {"defaults": {"mode": "listen", "config_file": ".azrelay.json"},
+         "relays": [{"connection_name": "worker0", "ports": [5678]},
+                    {"connection_name": "worker1", "host": "10.0.0.5", "ports": "5678,5679"}]}
+
+    Relative config_file paths are relative to the manifest.
+
+    Raises:
+        ValueError: invalid manifest
+        RuntimeError: YAML manifest without PyYAML
+    """
+    with open(path) as manifest_file:
+        text = manifest_file.read()
+    if path.lower().endswith((".yml", ".yaml")):
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError("YAML manifests need PyYAML (pip install pyyaml). Use a JSON manifest instead.")
+        data = yaml.safe_load(text)
+    else:
+        import json
+
+        data = json.loads(text)
+    if isinstance(data, list):
+        data = {"relays": data}
+    if not isinstance(data, dict) or not isinstance(data.get("relays"), list) or not data["relays"]:
+        raise ValueError(f"Manifest {path} must list relays.")
+    unknown = sorted(set(data) - {"relays", "defaults"})
+    if unknown:
+        raise ValueError(f"Manifest {path} has unknown settings: {', '.join(unknown)}.")
+    defaults = data.get("defaults") or {}
+    if not isinstance(defaults, dict):
+        raise ValueError(f"Defaults of manifest {path} must be an object.")
+
+    specs = []
+    for index, relay in enumerate(data["relays"]):
+        if isinstance(relay, dict):
+            relay = dict(defaults, **relay)
+        spec = RelaySpec.from_dict(relay, index)
+        if spec.config_file and not os.path.isabs(spec.config_file):
+            spec.config_file = os.path.join(os.path.dirname(os.path.abspath(path)), spec.config_file)
+        specs.append(spec)
+    names = [spec.name for spec in specs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Manifest {path} has relays with the same name: {', '.join(duplicates)}.")
+    return specs
+
+
+class RelayManifest(object):
+    """Runs relays of a manifest from one process.
+
+    All relays are opened concurrently on one event loop (see DebugRelay.open_async()), so bringing up
+    a fleet takes about as long as its slowest relay. Readiness and timing of every relay are reported
+    as a table or JSON, and then relays are kept running (restarted by their supervisors) until stopped.
+    Relays that fail to start are reported, the others keep running.
+    Relays that stop on their own (without a restart policy) are logged and reported as exited.
+    """
+    def __init__(self,
+                 specs: typing.List[RelaySpec],
+                 resolver: ConfigResolver = None,
+                 logger: logging.Logger = logging.root):
+        self.specs = specs
+        self.resolver = resolver or default_resolver()
+        self.logger = logger
+        # relay name -> DebugRelay
+        self.relays = {}
+        # relay name -> status (see report())
+        self.results = {}
+        # time it took to open all relays, in seconds
+        self.startup_seconds = None
+
+
+    def create_relays(self, kill_existing: bool = False):
+        """Creates DebugRelay objects of all relays. Relays that cannot be created are reported as failed.
+
+        Args:
+            kill_existing (bool, optional): Stop bridges launched earlier by azdebugrelay
+                with the same connection names or ports (except for shared relays). Defaults to False.
+        """
+        for spec in self.specs:
+            try:
+                relay = self._create_relay(spec)
+            except Exception as ex:
+                self._result(spec, STATUS_FAILED, error=str(ex))
+                continue
+            if kill_existing and not spec.shared:
+                DebugRelay.kill_relays(relay.relay_connection_name)
+                DebugRelay.kill_relays(ports=relay.ports)
+            self.relays[spec.name] = relay
+
+
+    async def start_async(self) -> int:
+        """Opens all relays concurrently. Returns the number of relays ready.
+        """
+        import asyncio
+
+        if not self.relays and not self.results:
+            self.create_relays()
+        start = time.monotonic()
+        specs = [spec for spec in self.specs if spec.name in self.relays]
+        await asyncio.gather(*(self._open(spec, self.relays[spec.name]) for spec in specs))
+        self.startup_seconds = time.monotonic() - start
+        return sum(1 for result in self.results.values() if result["status"] == STATUS_READY)
+
+
+    async def close_async(self):
+        import asyncio
+
+        await asyncio.gather(*(relay.close_async() for relay in self.relays.values()), return_exceptions=True)
+
+
+    async def run_async(self, report_format: str = "table", stream: typing.TextIO = None) -> bool:
+        """Opens all relays, prints the report, and keeps the relays running until SIGINT or SIGTERM,
+        or until none of them is running.
+        Returns False at once if no relay has started, and False once all relays have exited.
+        """
+        import asyncio
+        import signal
+        import sys
+
+        ready = await self.start_async()
+        stream = stream or sys.stdout
+        stream.write(self.report(report_format) + "\n")
+        stream.flush()
+        if not ready:
+            await self.close_async()
+            return False
+
+        loop = asyncio.get_event_loop()
+        stopped = asyncio.Event()
+        running = set(name for name, result in self.results.items() if result["status"] == STATUS_READY)
+        # exits are ignored once the relays are being closed
+        watching = [True]
+
+        def exited(name: str, returncode: typing.Optional[int]):
+            if not watching[0] or name not in running:
+                return
+            reason = "stopped" if returncode is None else f"exited with code {returncode}"
+            if self.relays[name].restart_policy is not None:
+                self.logger.warning(f"Debugging Relay {name} has {reason}. It is being restarted.")
+                return
+            running.discard(name)
+            self.results[name]["status"] = STATUS_EXITED
+            self.results[name]["error"] = reason
+            self.logger.warning(f"Debugging Relay {name} has {reason}. {len(running)} Debugging Relays are running.")
+            if not running:
+                stopped.set()
+
+        def exit_callback(name: str):
+            def callback(relay: DebugRelay, returncode: typing.Optional[int]):
+                # on a watcher thread for relays restarted by their supervisors
+                try:
+                    loop.call_soon_threadsafe(exited, name, returncode)
+                except RuntimeError:
+                    # the event loop is closed
+                    pass
+            return callback
+
+        adopted_checks = []
+        for name in list(running):
+            relay = self.relays[name]
+            relay.on_exit(exit_callback(name))
+            future = relay.exit_future()
+            if future is None:
+                adopted_checks.append(asyncio.ensure_future(self._check_adopted(name, relay, exited)))
+            elif future.done():
+                exited(name, future.result())
+
+        handled = []
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, stopped.set)
+                handled.append(signal_number)
+            except (NotImplementedError, RuntimeError):
+                # Windows, or not the main thread: KeyboardInterrupt stops run()
+                pass
+        self.logger.info(f"{ready} Debugging Relays are running. Press Ctrl+C to stop.")
+        try:
+            await stopped.wait()
+        finally:
+            watching[0] = False
+            for check in adopted_checks:
+                check.cancel()
+            for signal_number in handled:
+                loop.remove_signal_handler(signal_number)
+            self.logger.info("Closing Debugging Relays...")
+            await self.close_async()
+        return bool(running)
+
+
+    def run(self, report_format: str = "table", stream: typing.TextIO = None) -> bool:
+        """Runs run_async() on a new event loop, which also runs relays of RelayEngine.Python.
+        """
+        import asyncio
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.run_async(report_format, stream))
+        except KeyboardInterrupt:
+            loop.run_until_complete(self.close_async())
+            return True
+        finally:
+            loop.close()
+
+
+    def report(self, report_format: str = "table") -> str:
+        """Returns readiness and timing of all relays as a table, or as JSON (report_format="json")
+        with relays (name, connection_name, mode, host, ports, engine, status, seconds, phases, error)
+        and startup_seconds.
+        """
+        results = [self.results[spec.name] for spec in self.specs if spec.name in self.results]
+        if report_format == "json":
+            import json
+
+            return json.dumps({"relays": results, "startup_seconds": self.startup_seconds}, indent=2)
+
+        rows = [("NAME", "CONNECTION", "MODE", "HOST", "PORTS", "ENGINE", "STATUS", "SECONDS", "ERROR")]
+        for result in results:
+            seconds = result["seconds"]
+            rows.append((result["name"], result["connection_name"] or "", result["mode"], result["host"],
+                         ",".join(result["ports"]), result["engine"], result["status"],
+                         "" if seconds is None else f"{seconds:.2f}", result["error"] or ""))
+        widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+        lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+        ready = sum(1 for result in results if result["status"] == STATUS_READY)
+        summary = f"{ready} of {len(results)} relays ready"
+        if self.startup_seconds is not None:
+            summary += f" in {self.startup_seconds:.2f} s"
+        return "\n".join(lines + [summary])
+
+
+    def _create_relay(self, spec: RelaySpec) -> DebugRelay:
+        config = self.resolver.resolve(spec.connection_string, spec.connection_name, config_file=spec.config_file)
+        if not config.complete:
+            raise ValueError("Connection string and connection name are not configured.")
+        return DebugRelay(
+            config.connection_string, config.connection_name, _MODES[spec.mode], None, spec.host,
+            ports=spec.ports, az_relay_connection_wait_time=spec.wait_time,
+            logger=logging.getLogger(f"azdebugrelay.{spec.name}"), engine=_ENGINES[spec.engine],
+            restart_policy=RestartPolicy() if spec.restart else None, shared=spec.shared)
+
+
+    async def _open(self, spec: RelaySpec, relay: DebugRelay):
+        start = time.monotonic()
+        try:
+            await relay.open_async()
+        except DebugRelayTimeoutError as ex:
+            self._result(spec, STATUS_TIMEOUT, time.monotonic() - start, relay, str(ex))
+        except Exception as ex:
+            self._result(spec, STATUS_FAILED, time.monotonic() - start, relay, str(ex))
+        else:
+            self._result(spec, STATUS_READY, time.monotonic() - start, relay)
+            return
+        # a relay that didn't start is neither kept running nor restarted
+        await relay.close_async()
+
+
+    async def _check_adopted(self,
+                             name: str,
+                             relay: DebugRelay,
+                             exited: typing.Callable[[str, typing.Optional[int]], None]):
+        import asyncio
+
+        while relay.is_running():
+            await asyncio.sleep(_ADOPTED_CHECK_INTERVAL)
+        exited(name, None)
+
+
+    def _result(self,
+                spec: RelaySpec,
+                status: str,
+                seconds: float = None,
+                relay: DebugRelay = None,
+                error: str = None):
+        self.results[spec.name] = {
+            "name": spec.name,
+            "connection_name": relay.relay_connection_name if relay is not None else spec.connection_name,
+            "mode": spec.mode,
+            "host": spec.host,
+            "ports": spec.ports,
+            "engine": spec.engine,
+            "status": status,
+            "seconds": seconds,
+            "phases": dict(relay.open_durations) if relay is not None and status == STATUS_READY else {},
+            "error": error,
+        }
@@ -0,0 +1,323 @@
+import logging
+import os
+import threading
+import typing
+import weakref
+
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Registry of the enabled exporter. None when metrics are off:
+# instrumented code only checks this before doing any work.
+registry = None
+
+
+class _Histogram(object):
+    def __init__(self, buckets: typing.Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry(object):
+    """Relay health and latency metrics in OpenMetrics (or Prometheus text) format.
+
+    Relays are tracked once opened while metrics are enabled.
+    Gauges and counters (uptime, restarts, connections, bridge memory and CPU) are read
+    from tracked relays at render time; histograms (open() phase durations,
+    debugpy connect durations) are observed as things happen.
+    """
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._relays = weakref.WeakSet()
+        self._histograms = {}
+        self._lock = threading.Lock()
+        # MetricsHTTPServer and MetricsTextfileWriter objects started by enable_metrics()
+        self.exporters = []
+
+
+    def relay_opened(self, debug_relay, durations: typing.Dict[str, float]):
+        """Tracks a relay and observes durations of its open() phases.
+        """
+        labels = _relay_labels(debug_relay)
+        with self._lock:
+            self._relays.add(debug_relay)
+            for phase, duration in durations.items():
+                self._observe("azdebugrelay_open_phase_duration_seconds",
+                              labels + (("phase", phase),), duration)
+
+
+    def debugpy_connected(self, host: str, port: int, duration: float, connected: bool):
+        """Observes duration of DebugPyEx.connect.
+        """
+        labels = (("host", str(host)), ("port", str(port)),
+                  ("outcome", "connected" if connected else "failed"))
+        with self._lock:
+            self._observe("azdebugrelay_debugpy_connect_duration_seconds", labels, duration)
+
+
+    def render(self, openmetrics: bool = True) -> str:
+        """Renders all metrics.
+
+        Args:
+            openmetrics (bool, optional): OpenMetrics format (True)
+                or Prometheus text format, e.g. for node_exporter textfile collector (False). Defaults to True.
+        """
+        # name -> (type, help, samples)
+        families = {}
+        for debug_relay in list(self._relays):
+            labels = _relay_labels(debug_relay)
+            stats = debug_relay.stats()
+            running = debug_relay.is_running()
+            _add(families, "azdebugrelay_relay_up", "gauge",
+                 "Whether the relay is running", labels, 1 if running else 0)
+            uptime = debug_relay.uptime()
+            _add(families, "azdebugrelay_relay_uptime_seconds", "gauge",
+                 "Time since the relay has connected", labels, uptime or 0)
+            _add(families, "azdebugrelay_relay_restarts", "counter",
+                 "Number of times the relay has been reopened", labels, max(0, debug_relay.open_count - 1))
+            if "downtime_seconds" in stats:
+                # supervised relays (see RestartPolicy)
+                _add(families, "azdebugrelay_relay_downtime_seconds", "counter",
+                     "Time the supervised relay has spent down", labels, stats["downtime_seconds"])
+                _add(families, "azdebugrelay_relay_failed_restarts", "counter",
+                     "Failed restarts of the supervised relay", labels, stats["failed_restarts"])
+            _add(families, "azdebugrelay_relay_active_connections", "gauge",
+                 "Forwarded connections currently open", labels, stats["active_connections"])
+            _add(families, "azdebugrelay_relay_connections", "counter",
+                 "Forwarded connections accepted", labels, stats["connections_accepted"])
+            _add(families, "azdebugrelay_relay_transferred_bytes", "counter",
+                 "Bytes transferred through the relay, where reported", labels, stats["bytes_transferred"])
+            _add(families, "azdebugrelay_relay_errors", "counter",
+                 "Errors reported by the relay", labels, stats["errors"])
+            usage = _process_usage(debug_relay.bridge_pid()) if running else None
+            if usage is not None:
+                _add(families, "azdebugrelay_bridge_resident_memory_bytes", "gauge",
+                     "Azure Relay Bridge resident memory size", labels, usage[0])
+                _add(families, "azdebugrelay_bridge_cpu_seconds", "counter",
+                     "Azure Relay Bridge user and system CPU time", labels, usage[1])
+
+        lines = []
+        for name, (kind, help_text, samples) in families.items():
+            _family_header(lines, name, kind, help_text, openmetrics)
+            for labels, value in samples:
+                suffix = "_total" if kind == "counter" else ""
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        described = set()
+        for (name, labels), histogram in histograms:
+            if name not in described:
+                described.add(name)
+                _family_header(lines, name, "histogram", _HISTOGRAM_HELP.get(name, name), openmetrics)
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+    def _observe(self, name: str, labels: typing.Tuple[typing.Tuple[str, str], ...], value: float):
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            histogram = _Histogram(self.buckets)
+            self._histograms[(name, labels)] = histogram
+        histogram.observe(value)
+
+
+class MetricsHTTPServer(object):
+    """Serves metrics of a MetricsRegistry over HTTP (`/metrics`) from a daemon thread.
+    """
+    def __init__(self, metrics_registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9464):
+        import http.server
+        import socketserver
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                body = metrics_registry.render(openmetrics).encode()
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class MetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        self._server = MetricsServer((host, port), MetricsHandler)
+        self.host = host
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class MetricsTextfileWriter(object):
+    """Periodically writes metrics of a MetricsRegistry to a file
+    (e.g. for node_exporter textfile collector), replacing it atomically.
+    """
+    def __init__(self, metrics_registry: MetricsRegistry, path: str, interval: float = 15):
+        self.registry = metrics_registry
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    def write(self):
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as metrics_file:
+            metrics_file.write(self.registry.render(openmetrics=False))
+        os.replace(temp_path, self.path)
+
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+    def _run(self):
+        while True:
+            try:
+                self.write()
+            except OSError as ex:
+                logging.warning(f"Cannot write metrics to {self.path}: {ex}")
+            if self._stopped.wait(self.interval):
+                break
+
+
+def enable_metrics(http_port: int = None,
+                   http_host: str = "127.0.0.1",
+                   textfile: str = None,
+                   textfile_interval: float = 15,
+                   buckets: typing.Sequence[float] = DEFAULT_BUCKETS) -> MetricsRegistry:
+    """Turns metrics on, optionally with an HTTP endpoint and/or a textfile writer.
+    Relays opened from now on are tracked.
+
+    Args:
+        http_port (int, optional): Serve `/metrics` on this port (0 picks a free one). Defaults to None (no endpoint).
+        http_host (str, optional): Address to serve metrics on. Defaults to "127.0.0.1".
+        textfile (str, optional): Path of a file to write metrics to. Defaults to None.
+        textfile_interval (float, optional): How often to write the file, in seconds. Defaults to 15.
+        buckets (typing.Sequence[float], optional): Histogram buckets, in seconds.
+
+    Returns:
+        MetricsRegistry: enabled registry (its `exporters` are the endpoint and the writer)
+    """
+    global registry
+    disable_metrics()
+    metrics_registry = MetricsRegistry(buckets)
+    if http_port is not None:
+        metrics_registry.exporters.append(MetricsHTTPServer(metrics_registry, http_host, http_port))
+    if textfile is not None:
+        metrics_registry.exporters.append(MetricsTextfileWriter(metrics_registry, textfile, textfile_interval))
+    registry = metrics_registry
+    return metrics_registry
+
+
+def disable_metrics():
+    """Turns metrics off and stops exporters.
+    """
+    global registry
+    metrics_registry = registry
+    registry = None
+    if metrics_registry is not None:
+        for exporter in metrics_registry.exporters:
+            exporter.stop()
+
+
+_HISTOGRAM_HELP = {
+    "azdebugrelay_open_phase_duration_seconds": "Duration of DebugRelay.open() phases",
+    "azdebugrelay_debugpy_connect_duration_seconds": "Duration of DebugPyEx.connect",
+}
+
+
+def _add(families, name: str, kind: str, help_text: str, labels, value: float):
+    families.setdefault(name, (kind, help_text, []))[2].append((labels, value))
+
+
+def _family_header(lines: typing.List[str], name: str, kind: str, help_text: str, openmetrics: bool):
+    # Prometheus text format names counters with their _total suffix
+    family = name if openmetrics or kind != "counter" else f"{name}_total"
+    lines.append(f"# HELP {family} {help_text}")
+    lines.append(f"# TYPE {family} {kind}")
+
+
+def _relay_labels(debug_relay) -> typing.Tuple[typing.Tuple[str, str], ...]:
+    return (("relay", debug_relay.relay_connection_name),
+            ("mode", "listen" if debug_relay.debug_mode.name == "WaitForConnection" else "connect"),
+            ("ports", ";".join(debug_relay.ports)))
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _process_usage(pid: typing.Optional[int]) -> typing.Optional[typing.Tuple[int, float]]:
+    """Returns (resident memory bytes, CPU seconds) of the process group led by pid
+    (the Azure Relay Bridge process, started without a shell in a session of its own), where /proc is available.
+    """
+    if pid is None or not os.path.isdir("/proc"):
+        return None
+    try:
+        ticks = os.sysconf("SC_CLK_TCK")
+        page_size = os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+    resident_bytes, cpu_seconds, found = 0, 0.0, False
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat_file:
+                # fields after the command name, which may contain spaces
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[2]) != pid:
+            continue
+        found = True
+        cpu_seconds += (int(fields[11]) + int(fields[12])) / ticks
+        resident_bytes += int(fields[21]) * page_size
+    return (resident_bytes, cpu_seconds) if found else None
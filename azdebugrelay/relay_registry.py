@@ -0,0 +1,477 @@
+import logging
+import os
+import signal
+import threading
+import time
+import typing
+
+# Overrides the registry directory (defaults to ~/.azdebugrelay/registry)
+REGISTRY_DIR_ENV = "AZDEBUGRELAY_REGISTRY"
+# How often processes outside of this one are checked while waiting for them to exit, in seconds
+_EXIT_POLL_INTERVAL = 0.02
+
+
+def _hostname() -> str:
+    if hasattr(os, "uname"):
+        return os.uname().nodename
+    return os.environ.get("COMPUTERNAME", "")
+
+
+def _owner() -> str:
+    import getpass
+
+    try:
+        return getpass.getuser()
+    except Exception:
+        return str(os.getuid()) if hasattr(os, "getuid") else ""
+
+
+class RelayRecord(object):
+    """Azure Relay Bridge process launched by azdebugrelay, as kept in RelayRegistry.
+    """
+    def __init__(self,
+                 pid: int,
+                 pgid: typing.Optional[int],
+                 name: str,
+                 ports: typing.List[str],
+                 owner: str,
+                 hostname: str,
+                 launcher: int,
+                 started: typing.Optional[str] = None,
+                 config: str = None,
+                 log_file: str = None,
+                 holders: typing.List[typing.List[typing.Any]] = None):
+        """Initializes RelayRecord object.
+
+        Args:
+            pid (int): process ID of Azure Relay Bridge
+            pgid (int): its process group ID (None on Windows)
+            name (str): Azure Relay Hybrid Connection name
+            ports (typing.List[str]): forwarded ports
+            owner (str): user who launched it
+            hostname (str): machine it runs on (home directories may be shared by many machines)
+            launcher (int): process ID of the process that launched it
+            started (str, optional): process start time as reported by the OS, to tell a reused PID apart.
+                Defaults to None (unknown).
+            config (str, optional): fingerprint of the relay configuration of a shared bridge,
+                None if the bridge is private to its launcher. Defaults to None.
+            log_file (str, optional): file the output of a shared bridge goes to. Defaults to None.
+            holders (typing.List[typing.List[typing.Any]], optional): users of a shared bridge,
+                as [pid, process start time, token] lists. Defaults to None.
+        """
+        self.pid = pid
+        self.pgid = pgid
+        self.name = name
+        self.ports = [str(port) for port in ports]
+        self.owner = owner
+        self.hostname = hostname
+        self.launcher = launcher
+        self.started = started
+        self.config = config
+        self.log_file = log_file
+        self.holders = holders or []
+
+
+    def matches(self, name: str = None, ports: typing.List[str] = None) -> bool:
+        """Returns True if the bridge serves connection name (if given) and any of ports (if given).
+        """
+        if name is not None and self.name != name:
+            return False
+        if ports is not None and not set(self.ports) & set(str(port) for port in ports):
+            return False
+        return True
+
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        return dict(self.__dict__)
+
+
+    @staticmethod
+    def from_dict(values: typing.Dict[str, typing.Any]) -> "RelayRecord":
+        return RelayRecord(values["pid"], values.get("pgid"), values["name"], values["ports"],
+                           values["owner"], values["hostname"], values["launcher"], values.get("started"),
+                           values.get("config"), values.get("log_file"), values.get("holders"))
+
+
+class RelayRegistry(object):
+    """Per-user registry of Azure Relay Bridge processes launched by azdebugrelay.
+
+    Every bridge is a small JSON file (readable by its owner only) in `~/.azdebugrelay/registry`,
+    added when the bridge starts and removed once it stops. Entries of bridges that died with their launcher
+    are pruned when read. Before a bridge is signalled, its PID is checked to still be an Azure Relay Bridge
+    of the same user started at the same time, so recycled PIDs, other users' and other tools' bridges
+    are never touched.
+
+    Shared bridges (see DebugRelay `shared`) also keep the configuration they serve and the processes using them,
+    so other processes can adopt a running bridge instead of launching their own.
+    """
+    def __init__(self, directory: str = None, command_name: str = "azbridge", logger: logging.Logger = logging.root):
+        """Initializes RelayRegistry object.
+
+        Args:
+            directory (str, optional): Registry directory. Defaults to AZDEBUGRELAY_REGISTRY environment variable,
+                then to ~/.azdebugrelay/registry.
+            command_name (str, optional): Executable name registered processes must have in their command line.
+                Defaults to "azbridge".
+        """
+        self.directory = directory or os.environ.get(REGISTRY_DIR_ENV) or os.path.join(
+            os.path.expanduser("~"), ".azdebugrelay", "registry")
+        self.command_name = command_name
+        self.logger = logger
+        self.hostname = _hostname()
+
+
+    def register(self,
+                 pid: int,
+                 name: str,
+                 ports: typing.List[str],
+                 config: str = None,
+                 log_file: str = None,
+                 token: str = "") -> RelayRecord:
+        """Adds a bridge just launched by this process.
+        A shared bridge (with config) is held by this process, as user token, until released (see release()).
+
+        Raises:
+            OSError: cannot write the registry
+        """
+        pgid = None
+        if hasattr(os, "getpgid"):
+            try:
+                pgid = os.getpgid(pid)
+            except OSError:
+                pass
+        record = RelayRecord(pid, pgid, name, ports, _owner(), self.hostname, os.getpid(), _process_start_time(pid),
+                             config, log_file, [_holder(token)] if config is not None else None)
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self._write(record)
+        return record
+
+
+    def unregister(self, pid: int):
+        """Removes a bridge that has stopped.
+        """
+        try:
+            os.remove(self._path(pid))
+        except OSError:
+            pass
+
+
+    def records(self, name: str = None, ports: typing.List[str] = None) -> typing.List[RelayRecord]:
+        """Returns running bridges registered on this machine, optionally only those of connection name
+        or using any of ports (see RelayRecord.matches). Prunes entries of bridges that are gone.
+        """
+        try:
+            file_names = os.listdir(self.directory)
+        except OSError:
+            return []
+        prefix = f"{self.hostname}."
+        records = []
+        for file_name in file_names:
+            if not file_name.startswith(prefix) or not file_name.endswith(".json"):
+                continue
+            try:
+                record = self._read(int(file_name[len(prefix):-len(".json")]))
+            except ValueError:
+                continue
+            if record is None:
+                # being written, or damaged
+                continue
+            if not self.is_running(record):
+                self.unregister(record.pid)
+            elif record.matches(name, ports):
+                records.append(record)
+        return records
+
+
+    def shared_lock(self, config: str):
+        """Returns an inter-process lock (context manager) for finding, launching and releasing
+        shared bridges of a configuration.
+        """
+        if __package__:
+            from .bridge_installer import FileLock
+        else:
+            from bridge_installer import FileLock
+
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        return FileLock(os.path.join(self.directory, f".{self.hostname}.{config}.lock"))
+
+
+    def shared_log_file(self, config: str) -> str:
+        """Returns the file output of a shared bridge of a configuration goes to.
+        """
+        return os.path.join(self.directory, f"{self.hostname}.{config}.log")
+
+
+    def shared(self, config: str) -> typing.List[RelayRecord]:
+        """Returns running shared bridges of a configuration.
+        """
+        return [record for record in self.records() if record.config == config]
+
+
+    def acquire(self, record: RelayRecord, token: str = ""):
+        """Adds user token of this process to holders of a shared bridge. Call with shared_lock() held.
+        """
+        record.holders = self._live_holders(record) + [_holder(token)]
+        self._write(record)
+
+
+    def release(self, record: RelayRecord, token: str = "") -> int:
+        """Removes user token of this process from holders of a shared bridge. Call with shared_lock() held.
+
+        Returns:
+            int: number of other users still holding the bridge
+        """
+        current = self._read(record.pid) or record
+        holder = _holder(token)
+        current.holders = [other for other in self._live_holders(current) if other != holder]
+        if self._read(record.pid) is not None:
+            self._write(current)
+        record.holders = current.holders
+        return len(current.holders)
+
+
+    def is_running(self, record: RelayRecord) -> bool:
+        """Returns True if the registered bridge is still running as the same process.
+        """
+        if record.hostname != self.hostname:
+            return False
+        if record.started is not None and _process_start_time(record.pid) != record.started:
+            # exited, and the PID may have been reused
+            return False
+        command_line = _process_command_line(record.pid)
+        return command_line is not None and self.command_name in command_line
+
+
+    def terminate(self, records: typing.List[RelayRecord], deadline: float = 3) -> int:
+        """Stops registered bridges together: signals all of them at once, waits for all of them
+        until a single deadline, and kills those still running then.
+
+        Args:
+            records (typing.List[RelayRecord]): bridges to stop (see records())
+            deadline (float, optional): How long to wait for all bridges to exit, in seconds. Defaults to 3.
+
+        Returns:
+            int: number of bridges stopped
+        """
+        signalled = [record for record in records if self.is_running(record) and _signal(record, False)]
+        remaining = wait_for_exit(signalled, deadline)
+        for record in signalled:
+            if record in remaining:
+                self.logger.warning(f"Azure Relay Bridge process {record.pid} did not exit in time. Killing it.")
+                _signal(record, True)
+        for record in signalled:
+            self.unregister(record.pid)
+        return len(signalled)
+
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{self.hostname}.{pid}.json")
+
+
+    def _read(self, pid: int) -> typing.Optional[RelayRecord]:
+        import json
+
+        try:
+            with open(self._path(pid)) as record_file:
+                return RelayRecord.from_dict(json.load(record_file))
+        except (OSError, ValueError, KeyError, TypeError):
+            # gone, being written, or damaged
+            return None
+
+
+    def _write(self, record: RelayRecord):
+        import json
+
+        path = self._path(record.pid)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as record_file:
+            json.dump(record.to_dict(), record_file)
+        os.replace(temp_path, path)
+
+
+    @staticmethod
+    def _live_holders(record: RelayRecord) -> typing.List[typing.List[typing.Any]]:
+        return [[pid, started, token] for pid, started, token in record.holders
+                if _process_exists(pid) and (started is None or _process_start_time(pid) == started)]
+
+
+def wait_for_exit(records: typing.List[RelayRecord],
+                  timeout: float,
+                  poll_interval: float = _EXIT_POLL_INTERVAL) -> typing.List[RelayRecord]:
+    """Waits until all bridges exit with their process groups, or for timeout seconds overall,
+    checking every poll_interval seconds. Returns those still running.
+    """
+    deadline = time.monotonic() + timeout
+    remaining = list(records)
+    while remaining:
+        remaining = [record for record in remaining if _is_alive(record)]
+        if not remaining or time.monotonic() >= deadline:
+            break
+        time.sleep(min(poll_interval, max(0, deadline - time.monotonic())))
+    return remaining
+
+
+def wait_for_process(record: RelayRecord, poll_interval: float = _EXIT_POLL_INTERVAL):
+    """Waits until a bridge launched by another process exits with its process group.
+    Sleeps in the OS on a pidfd where available (Linux 5.3+, Python 3.9+),
+    otherwise checks the recorded process every poll_interval seconds.
+    """
+    pidfd = None
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(record.pid)
+        except OSError:
+            pass
+    if pidfd is not None:
+        try:
+            # a reused PID belongs to another process
+            if record.started is None or _process_start_time(record.pid) == record.started:
+                import select
+
+                select.select([pidfd], [], [])
+        finally:
+            os.close(pidfd)
+    wait_for_exit([record], float("inf"), poll_interval)
+
+
+def _signal(record: RelayRecord, kill: bool) -> bool:
+    """Stops a bridge with its process group (SIGTERM, or SIGKILL if kill). Returns False if it is gone.
+    """
+    try:
+        if os.name == "nt":
+            os.kill(record.pid, signal.SIGTERM)
+        else:
+            sig = signal.SIGKILL if kill else signal.SIGTERM
+            # a bridge launched in its own process group is its leader
+            if record.pgid == record.pid and os.getpgid(record.pid) == record.pgid:
+                os.killpg(record.pgid, sig)
+            else:
+                os.kill(record.pid, sig)
+        return True
+    except OSError:
+        return False
+
+
+def _is_alive(record: RelayRecord) -> bool:
+    """Checks the recorded process (or process group) directly, without scanning all processes
+    while the bridge is running.
+    """
+    if os.name != "nt" and record.pgid == record.pid:
+        # any process left in the group of the bridge (e.g. azbridge under a shell)
+        try:
+            os.killpg(record.pgid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        if _process_exists(record.pid):
+            return True
+        # the leader has exited, and what is left of the group may be zombies only
+        groups = _live_process_groups()
+        return groups is None or record.pgid in groups
+    return _process_exists(record.pid)
+
+
+def _live_process_groups() -> typing.Optional[typing.Set[int]]:
+    """Returns IDs of process groups with running processes (Linux only), or None.
+    Zombies don't count: orphaned ones may wait long for init to reap them.
+    """
+    try:
+        pids = [name for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return None
+    groups = set()
+    for pid in pids:
+        stat = _proc_stat(int(pid))
+        if stat and stat[0] != "Z":
+            groups.add(int(stat[2]))
+    return groups
+
+
+def _process_exists(pid: int) -> bool:
+    if os.name == "nt":
+        return _process_command_line(pid) is not None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    # a zombie has exited, though its parent hasn't reaped it yet
+    return _process_state(pid) != "Z"
+
+
+def _process_state(pid: int) -> typing.Optional[str]:
+    stat = _proc_stat(pid)
+    return stat[0] if stat else None
+
+
+def _process_start_time(pid: int) -> typing.Optional[str]:
+    """Returns process start time in clock ticks since boot (Linux only), or None.
+    """
+    stat = _proc_stat(pid)
+    return stat[19] if stat and len(stat) > 19 else None
+
+
+def _proc_stat(pid: int) -> typing.Optional[typing.List[str]]:
+    """Returns fields of /proc/<pid>/stat after the command name (state first), or None.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+    # the command name may contain spaces and parentheses
+    return stat[stat.rfind(")") + 2:].split()
+
+
+def _process_command_line(pid: int) -> typing.Optional[str]:
+    """Returns command line of a process owned by the current user, or None if there is no such process.
+    """
+    proc_folder = f"/proc/{pid}"
+    if os.path.isdir("/proc/self"):
+        try:
+            if os.stat(proc_folder).st_uid != os.getuid():
+                return None
+            with open(os.path.join(proc_folder, "cmdline"), "rb") as cmdline_file:
+                command_line = cmdline_file.read().replace(b"\0", b" ").decode(errors="replace").strip()
+        except OSError:
+            return None
+        # empty for zombies
+        return command_line or None
+    import subprocess
+
+    if os.name == "nt":
+        # tasklist only lists processes the current user can access
+        result = subprocess.run(["tasklist", "/FI", f"PID eq {pid}", "/FO", "CSV", "/NH"],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        output = result.stdout.decode(errors="replace")
+        return output.strip() if f"\"{pid}\"" in output else None
+    result = subprocess.run(["ps", "-o", "user=", "-o", "command=", "-p", str(pid)],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    output = result.stdout.decode(errors="replace").strip()
+    if result.returncode != 0 or not output:
+        return None
+    user, _, command_line = output.partition(" ")
+    if user != _owner():
+        return None
+    return command_line.strip()
+
+
+def _holder(token: str) -> typing.List[typing.Any]:
+    pid = os.getpid()
+    return [pid, _process_start_time(pid), token]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def default_registry() -> RelayRegistry:
+    """Returns the registry of the current user (see RelayRegistry), created on first use.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = RelayRegistry()
+    return _registry
@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+import typing
+import urllib.parse
+import uuid
+
+if __package__:
+    from . import relay_websocket
+else:
+    import relay_websocket
+
+
+class LocalRelayServer(object):
+    """Local stand-in for Azure Relay Hybrid Connections.
+
+    Implements the listen/connect/accept rendezvous of the Hybrid Connection websocket protocol
+    over plain ws://, verifies SAS tokens, and relays messages between senders and listeners,
+    so HybridConnectionForwarder can be tested and benchmarked offline.
+    Like Azure Relay, it closes a listener control channel once its token expires without renewal (renewToken)
+    or a renewed token is invalid.
+    Use `connection_string()` to get a connection string pointing at this server.
+    """
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 key_name: str = "RootManageSharedAccessKey",
+                 key: str = None,
+                 rendezvous_timeout: float = 30,
+                 logger: logging.Logger = logging.root):
+        self.host = host
+        self.port = port
+        self.key_name = key_name
+        self.key = key or base64.b64encode(os.urandom(32)).decode()
+        self.rendezvous_timeout = rendezvous_timeout
+        self.logger = logger
+        self._server = None
+        self._listeners = {}
+        self._round_robin = itertools.count()
+        self._pending = {}
+        self.connections_relayed = 0
+        self.listener_connections = 0
+        # listener token renewals accepted and rejected
+        self.token_renewals = 0
+        self.rejected_renewals = 0
+
+
+    @property
+    def endpoint(self) -> str:
+        return f"ws://{self.host}:{self.port}/"
+
+
+    def connection_string(self, relay_connection_name: str = None) -> str:
+        connection_string = f"Endpoint={self.endpoint};"\
+            f"SharedAccessKeyName={self.key_name};SharedAccessKey={self.key}"
+        if relay_connection_name:
+            connection_string += f";EntityPath={relay_connection_name}"
+        return connection_string
+
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.logger.info(f"Local relay stand-in is listening on {self.endpoint}")
+
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        await self.drop_listeners()
+        self._listeners = {}
+
+
+    async def drop_listeners(self):
+        """Closes all listener control channels, as Azure Relay may do at any time.
+        """
+        for sockets in list(self._listeners.values()):
+            for socket in list(sockets):
+                await socket.close()
+
+
+    def _token_expiry(self, token: str, relay_connection_name: str) -> typing.Optional[int]:
+        """Returns expiry time of a valid SAS token for the Hybrid Connection, None if the token is invalid.
+        """
+        if not token.startswith("SharedAccessSignature "):
+            return None
+        fields = dict(urllib.parse.parse_qsl(token[len("SharedAccessSignature "):]))
+        try:
+            expiry = int(fields.get("se", "0"))
+        except ValueError:
+            return None
+        resource = urllib.parse.quote(fields.get("sr", ""), safe="")
+        signature = base64.b64encode(
+            hmac.new(self.key.encode(), f"{resource}\n{expiry}".encode(), hashlib.sha256).digest()).decode()
+        if fields.get("skn") == self.key_name \
+                and hmac.compare_digest(signature, fields.get("sig", "")) \
+                and expiry > time.time() \
+                and fields.get("sr", "").rstrip("/").endswith("/" + relay_connection_name):
+            return expiry
+        return None
+
+
+    def _request_token(self, request: relay_websocket.WebSocketRequest) -> str:
+        return request.headers.get("servicebusauthorization") or request.query.get("sb-hc-token", "")
+
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        request = await relay_websocket.read_request(reader, writer)
+        if request is None:
+            return
+        if not request.path.startswith("/$hc/"):
+            await request.reject(404, "Not Found")
+            return
+        relay_connection_name = request.path[len("/$hc/"):].strip("/")
+        action = request.query.get("sb-hc-action")
+        if action == "accept":
+            await self._accept(request)
+        elif self._token_expiry(self._request_token(request), relay_connection_name) is None:
+            await request.reject(401, "Unauthorized")
+        elif action == "listen":
+            await self._listen(request, relay_connection_name)
+        elif action == "connect":
+            await self._connect(request, relay_connection_name)
+        else:
+            await request.reject(400, "Bad Request")
+
+
+    async def _listen(self, request: relay_websocket.WebSocketRequest, relay_connection_name: str):
+        # expiry of the listener's token, moved on by renewals
+        expiry = [self._token_expiry(self._request_token(request), relay_connection_name)]
+        socket = await request.accept()
+        listeners = self._listeners.setdefault(relay_connection_name, [])
+        listeners.append(socket)
+        self.listener_connections += 1
+        watchdog = asyncio.ensure_future(self._expire(socket, expiry))
+        try:
+            while True:
+                message = await socket.recv()
+                if message is None:
+                    break
+                try:
+                    renewal = json.loads(message).get("renewToken")
+                except (ValueError, AttributeError):
+                    continue
+                if renewal is None:
+                    continue
+                renewed = self._token_expiry(renewal.get("token", ""), relay_connection_name)
+                if renewed is None:
+                    self.rejected_renewals += 1
+                    self.logger.warning(f"Rejected token renewal of a listener of {relay_connection_name}")
+                    break
+                self.token_renewals += 1
+                expiry[0] = renewed
+        finally:
+            watchdog.cancel()
+            listeners.remove(socket)
+            await socket.close()
+
+
+    async def _expire(self, socket: relay_websocket.WebSocket, expiry: typing.List[int]):
+        while time.time() < expiry[0]:
+            await asyncio.sleep(expiry[0] - time.time())
+        self.logger.warning("Listener token has expired. Closing the control channel.")
+        await socket.close()
+
+
+    async def _connect(self, request: relay_websocket.WebSocketRequest, relay_connection_name: str):
+        listeners = self._listeners.get(relay_connection_name)
+        if not listeners:
+            await request.reject(404, "No listeners")
+            return
+        listener = listeners[next(self._round_robin) % len(listeners)]
+        rendezvous_id = str(uuid.uuid4())
+        rendezvous = asyncio.get_event_loop().create_future()
+        self._pending[rendezvous_id] = rendezvous
+        address = f"ws://{self.host}:{self.port}/$hc/{urllib.parse.quote(relay_connection_name)}"\
+            f"?sb-hc-action=accept&sb-hc-id={rendezvous_id}"
+        try:
+            await listener.send(json.dumps({"accept": {
+                "address": address,
+                "id": rendezvous_id,
+                "connectHeaders": request.headers}}))
+            listener_socket = await asyncio.wait_for(rendezvous, self.rendezvous_timeout)
+        except asyncio.TimeoutError:
+            await request.reject(504, "Listener did not accept the connection")
+            return
+        except ConnectionRefusedError as ex:
+            await request.reject(502, str(ex) or "Listener rejected the connection")
+            return
+        finally:
+            self._pending.pop(rendezvous_id, None)
+        sender_socket = await request.accept()
+        self.connections_relayed += 1
+        await asyncio.gather(
+            _splice(sender_socket, listener_socket),
+            _splice(listener_socket, sender_socket),
+            return_exceptions=True)
+
+
+    async def _accept(self, request: relay_websocket.WebSocketRequest):
+        rendezvous = self._pending.get(request.query.get("sb-hc-id"))
+        if rendezvous is None or rendezvous.done():
+            await request.reject(410, "Gone")
+            return
+        if "sb-hc-statusCode" in request.query:
+            rendezvous.set_exception(ConnectionRefusedError(request.query.get("sb-hc-statusDescription", "")))
+            await request.reject(410, "Gone")
+            return
+        rendezvous.set_result(await request.accept())
+
+
+async def _splice(source: relay_websocket.WebSocket, destination: relay_websocket.WebSocket):
+    try:
+        while True:
+            message = await source.recv()
+            if message is None:
+                break
+            await destination.send(message)
+    finally:
+        await destination.close()
+
+
+def _cli_main(argv):
+    """Runs a local relay stand-in until interrupted.
+    Prints the connection string to use with HybridConnectionForwarder
+    (DebugRelay with RelayEngine.Python).
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', action='store', default="127.0.0.1", required=False)
+    parser.add_argument('--port', action='store', type=int, default=0, required=False)
+    parser.add_argument('--key', action='store', default=None, required=False)
+    options = parser.parse_args(args=argv)
+
+    logging.root.setLevel(logging.INFO)
+    server = LocalRelayServer(options.host, options.port, key=options.key)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server.start())
+    print(server.connection_string())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.stop())
+
+
+if __name__ == '__main__':
+    _cli_main(sys.argv[1:])
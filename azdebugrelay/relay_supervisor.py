@@ -0,0 +1,241 @@
+import collections
+import logging
+import random
+import threading
+import time
+import typing
+
+if __package__:
+    from .relay_events import EVENT_RELAY_DOWN, EVENT_RELAY_UP
+else:
+    # launched as a script (e.g. by the VS Code extension)
+    from relay_events import EVENT_RELAY_DOWN, EVENT_RELAY_UP
+
+
+class RestartPolicy(object):
+    """How a supervised DebugRelay is restarted when Azure Relay Bridge fails or exits.
+
+    Restarts are delayed with jittered exponential backoff: the n-th consecutive attempt waits
+    `initial_delay * multiplier ** n` seconds (at most `max_delay`), minus a random part of up to `jitter` of it,
+    so relays of many jobs that lose the network together don't reconnect in lockstep.
+    The backoff starts over once a relay has stayed up for `reset_after` seconds.
+    At most `max_restarts` restarts happen within any `restart_window` seconds; further ones wait for the window.
+    """
+    def __init__(self,
+                 initial_delay: float = 1,
+                 max_delay: float = 60,
+                 multiplier: float = 2,
+                 jitter: float = 0.5,
+                 max_restarts: int = 10,
+                 restart_window: float = 600,
+                 reset_after: float = 300,
+                 on_down: typing.Callable[[typing.Any, str], None] = None,
+                 on_up: typing.Callable[[typing.Any, float], None] = None):
+        """Initializes RestartPolicy object.
+
+        Args:
+            initial_delay (float, optional): Delay before the first restart, in seconds. Defaults to 1.
+            max_delay (float, optional): Maximum delay between restarts, in seconds. Defaults to 60.
+            multiplier (float, optional): Backoff multiplier. Defaults to 2.
+            jitter (float, optional): Random part of every delay (0..1). Defaults to 0.5.
+            max_restarts (int, optional): Maximum number of restarts within restart_window. Defaults to 10.
+            restart_window (float, optional): Restart rate window, in seconds. Defaults to 600.
+            reset_after (float, optional): Uptime after which the backoff starts over, in seconds. Defaults to 300.
+            on_down (typing.Callable[[DebugRelay, str], None], optional): Called with the relay and the reason
+                when the relay goes down. Defaults to None.
+            on_up (typing.Callable[[DebugRelay, float], None], optional): Called with the relay and the downtime
+                in seconds when the relay is up again. Defaults to None.
+        """
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be between 0 and 1.")
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.reset_after = reset_after
+        self.on_down = on_down
+        self.on_up = on_up
+
+
+    def backoff(self, attempt: int) -> float:
+        """Returns the delay before a restart, in seconds.
+
+        Args:
+            attempt (int): number of consecutive restart attempts before this one
+        """
+        delay = min(self.max_delay, self.initial_delay * self.multiplier ** min(attempt, 64))
+        return delay * (1 - self.jitter * random.random())
+
+
+class RelaySupervisor(object):
+    """Restarts a DebugRelay whenever it goes down, in a daemon thread, until stopped.
+    Started by DebugRelay once opened with a RestartPolicy, and stopped by close().
+    The relay keeps its ports, so a debugger can reattach to the same address.
+    """
+    def __init__(self, debug_relay, policy: RestartPolicy, logger: logging.Logger = logging.root):
+        self.debug_relay = debug_relay
+        self.policy = policy
+        self.logger = logger
+        # successful and failed restarts
+        self.restarts = 0
+        self.failed_restarts = 0
+        # total time spent down (seconds), not counting the current outage
+        self.downtime = 0.0
+        # monotonic time the relay went down, None while it is up
+        self.down_since = None
+        self.last_down_reason = None
+        self._attempt = 0
+        self._up_since = time.monotonic()
+        self._restart_times = collections.deque()
+        self._down = threading.Event()
+        self._down_reason = None
+        self._down_generation = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+
+    def start(self) -> "RelaySupervisor":
+        self._thread = threading.Thread(target=self._run, daemon=True, name="azdebugrelay supervisor")
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        """Stops supervising. Cancels a restart in progress.
+        """
+        self._stopped.set()
+        self._down.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        with self._lock:
+            if self.down_since is not None:
+                self.downtime += time.monotonic() - self.down_since
+                self.down_since = None
+
+
+    def relay_down(self, reason: str, generation: int = None):
+        """Reports that the relay has gone down.
+
+        Args:
+            reason (str): why
+            generation (int, optional): DebugRelay.open_count of the relay instance that went down;
+                reports about instances that have already been replaced are ignored. Defaults to None (current).
+        """
+        with self._lock:
+            pending = self._down_generation
+            if pending is not None and generation is not None and generation < pending:
+                # a late report must not hide one about the current bridge
+                return
+            self._down_reason = reason
+            self._down_generation = generation
+        self._down.set()
+
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        """Returns restarts, failed_restarts, downtime_seconds (including the current outage)
+        and down (whether the relay is down now).
+        """
+        with self._lock:
+            down_since = self.down_since
+            downtime = self.downtime
+        if down_since is not None:
+            downtime += time.monotonic() - down_since
+        return {
+            "restarts": self.restarts,
+            "failed_restarts": self.failed_restarts,
+            "downtime_seconds": downtime,
+            "down": down_since is not None,
+        }
+
+
+    def _run(self):
+        while True:
+            reason = self._wait_down()
+            if reason is None:
+                return
+            self._went_down(reason)
+            while not self._restart():
+                if self._stopped.is_set():
+                    return
+
+
+    def _wait_down(self) -> typing.Optional[str]:
+        """Waits for the relay to go down (see DebugRelay.on_exit). Returns the reason, or None once stopped.
+        """
+        while True:
+            self._down.wait()
+            if self._stopped.is_set():
+                return None
+            with self._lock:
+                reason, generation = self._down_reason, self._down_generation
+                self._down_reason = self._down_generation = None
+                self._down.clear()
+            if reason is not None and generation in (None, self.debug_relay.open_count):
+                return reason
+            # otherwise, about a bridge that has already been replaced
+
+
+    def _went_down(self, reason: str):
+        with self._lock:
+            self.down_since = time.monotonic()
+            self.last_down_reason = reason
+        if self.down_since - self._up_since >= self.policy.reset_after:
+            self._attempt = 0
+        self.logger.warning(f"Debugging Relay is down ({reason}). Restarting...")
+        # a failed bridge may still be running
+        try:
+            self.debug_relay._close()
+        except Exception as ex:
+            self.logger.warning(f"Cannot close failed Debugging Relay: {ex}")
+        self.debug_relay.event_stream.publish(EVENT_RELAY_DOWN, line=reason)
+        self._callback(self.policy.on_down, reason)
+
+
+    def _restart(self) -> bool:
+        """Waits for the backoff delay and restarts the relay.
+        Returns True if it is up again, False if the restart failed or supervising has been stopped.
+        """
+        delay = self.policy.backoff(self._attempt)
+        now = time.monotonic()
+        window = self._restart_times
+        while window and now - window[0] >= self.policy.restart_window:
+            window.popleft()
+        if len(window) >= self.policy.max_restarts:
+            # restart rate cap: wait for the oldest restart to leave the window
+            delay = max(delay, window[0] + self.policy.restart_window - now)
+        self._attempt += 1
+        if self._stopped.wait(delay):
+            return False
+        self._restart_times.append(time.monotonic())
+        try:
+            self.debug_relay._restart()
+        except Exception as ex:
+            self.failed_restarts += 1
+            if not self._stopped.is_set():
+                self.logger.warning(f"Cannot restart Debugging Relay: {ex}")
+            return False
+        if self._stopped.is_set():
+            return False
+        with self._lock:
+            downtime = time.monotonic() - self.down_since
+            self.downtime += downtime
+            self.down_since = None
+            self.restarts += 1
+        self._up_since = time.monotonic()
+        self.logger.info(f"Debugging Relay is up again after {downtime:.1f} s.")
+        self.debug_relay.event_stream.publish(EVENT_RELAY_UP)
+        self._callback(self.policy.on_up, downtime)
+        return True
+
+
+    def _callback(self, callback, argument):
+        if callback is None:
+            return
+        try:
+            callback(self.debug_relay, argument)
+        except Exception:
+            self.logger.exception("Debugging Relay supervisor callback failed.")
@@ -0,0 +1,273 @@
+import asyncio
+import base64
+import hashlib
+import os
+import struct
+import typing
+import urllib.parse
+
+
+_WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+class WebSocketError(ConnectionError):
+    """WebSocket handshake or protocol failure.
+    `status` is the HTTP status code of a failed handshake (if any).
+    """
+    def __init__(self, msg: str, status: int = None):
+        super().__init__(msg)
+        self.status = status
+
+
+class WebSocket(object):
+    """Minimal RFC 6455 WebSocket on top of asyncio streams.
+    Only implements what Hybrid Connection forwarding needs:
+    text and binary messages, ping/pong and the closing handshake.
+    """
+    def __init__(self,
+                 reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter,
+                 is_client: bool):
+        self._reader = reader
+        self._writer = writer
+        self._is_client = is_client
+        self._close_sent = False
+        self.closed = False
+
+
+    async def send(self, data: typing.Union[bytes, str]):
+        """Sends a binary (bytes) or text (str) message.
+        """
+        if isinstance(data, str):
+            await self._send_frame(OPCODE_TEXT, data.encode())
+        else:
+            await self._send_frame(OPCODE_BINARY, data)
+
+
+    async def recv(self) -> typing.Union[bytes, str, None]:
+        """Receives a message: bytes for binary messages, str for text ones.
+        Returns None when the connection is closed.
+        """
+        message_opcode = None
+        fragments = []
+        while not self.closed:
+            try:
+                fin, opcode, payload = await self._read_frame()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self._abort()
+                return None
+            if opcode == OPCODE_PING:
+                await self._send_frame(OPCODE_PONG, payload)
+                continue
+            elif opcode == OPCODE_PONG:
+                continue
+            elif opcode == OPCODE_CLOSE:
+                if not self._close_sent:
+                    await self._send_frame(OPCODE_CLOSE, payload[:2])
+                self._abort()
+                return None
+            if opcode != OPCODE_CONTINUATION:
+                message_opcode = opcode
+            fragments.append(payload)
+            if fin:
+                message = b"".join(fragments)
+                return message.decode() if message_opcode == OPCODE_TEXT else message
+        return None
+
+
+    async def close(self, code: int = 1000):
+        """Starts the closing handshake and releases the connection.
+        """
+        if not self.closed:
+            try:
+                await self._send_frame(OPCODE_CLOSE, struct.pack("!H", code))
+            except ConnectionError:
+                pass
+            self._abort()
+
+
+    def _abort(self):
+        self.closed = True
+        self._writer.close()
+
+
+    async def _send_frame(self, opcode: int, payload: bytes):
+        if self._close_sent:
+            return
+        if opcode == OPCODE_CLOSE:
+            self._close_sent = True
+        length = len(payload)
+        mask_bit = 0x80 if self._is_client else 0
+        header = bytes([0x80 | opcode])
+        if length < 126:
+            header += bytes([mask_bit | length])
+        elif length < 65536:
+            header += bytes([mask_bit | 126]) + struct.pack("!H", length)
+        else:
+            header += bytes([mask_bit | 127]) + struct.pack("!Q", length)
+        if self._is_client:
+            mask = os.urandom(4)
+            header += mask
+            payload = _apply_mask(payload, mask)
+        self._writer.write(header + payload)
+        await self._writer.drain()
+
+
+    async def _read_frame(self) -> typing.Tuple[bool, int, bytes]:
+        head = await self._reader.readexactly(2)
+        fin = bool(head[0] & 0x80)
+        opcode = head[0] & 0x0F
+        masked = bool(head[1] & 0x80)
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await self._reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await self._reader.readexactly(8))[0]
+        mask = await self._reader.readexactly(4) if masked else None
+        payload = await self._reader.readexactly(length) if length else b""
+        if mask is not None:
+            payload = _apply_mask(payload, mask)
+        return fin, opcode, payload
+
+
+def _apply_mask(payload: bytes, mask: bytes) -> bytes:
+    length = len(payload)
+    if length == 0:
+        return payload
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, "little") ^ int.from_bytes(key, "little")).to_bytes(length, "little")
+
+
+def _accept_key(key: str) -> str:
+    return base64.b64encode(
+        hashlib.sha1((key + _WEBSOCKET_GUID).encode()).digest()).decode()
+
+
+async def _read_http_head(reader: asyncio.StreamReader) -> typing.Tuple[str, typing.Dict[str, str]]:
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    return lines[0], headers
+
+
+async def connect(url: str,
+                  headers: typing.Dict[str, str] = None,
+                  ssl_context=None) -> WebSocket:
+    """Opens a client WebSocket connection.
+
+    Args:
+        url (str): ws:// or wss:// URL
+        headers (typing.Dict[str, str], optional): Additional request headers. Defaults to None.
+        ssl_context (optional): SSL context for wss:// URLs. Defaults to the system default context.
+
+    Raises:
+        WebSocketError: The server refused to upgrade the connection.
+
+    Returns:
+        WebSocket: connected WebSocket
+    """
+    parsed = urllib.parse.urlsplit(url)
+    secure = parsed.scheme == "wss"
+    port = parsed.port or (443 if secure else 80)
+    if secure and ssl_context is None:
+        import ssl
+        ssl_context = ssl.create_default_context()
+    reader, writer = await asyncio.open_connection(
+        parsed.hostname, port, ssl=ssl_context if secure else None)
+    target = parsed.path or "/"
+    if parsed.query:
+        target += "?" + parsed.query
+    key = base64.b64encode(os.urandom(16)).decode()
+    request = [
+        f"GET {target} HTTP/1.1",
+        f"Host: {parsed.hostname}:{port}",
+        "Upgrade: websocket",
+        "Connection: Upgrade",
+        f"Sec-WebSocket-Key: {key}",
+        "Sec-WebSocket-Version: 13"]
+    for name, value in (headers or {}).items():
+        request.append(f"{name}: {value}")
+    writer.write(("\r\n".join(request) + "\r\n\r\n").encode("latin-1"))
+    try:
+        status_line, response_headers = await _read_http_head(reader)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError) as ex:
+        writer.close()
+        raise WebSocketError(f"WebSocket handshake with {parsed.hostname} failed.") from ex
+    status = status_line.split(" ", 2)
+    status_code = int(status[1]) if len(status) > 1 and status[1].isdigit() else None
+    if status_code != 101:
+        writer.close()
+        raise WebSocketError(f"WebSocket handshake failed: {status_line}", status_code)
+    if response_headers.get("sec-websocket-accept") != _accept_key(key):
+        writer.close()
+        raise WebSocketError("WebSocket handshake failed: invalid Sec-WebSocket-Accept.", status_code)
+    return WebSocket(reader, writer, is_client=True)
+
+
+class WebSocketRequest(object):
+    """Server side of an incoming WebSocket handshake, read by `read_request()`.
+    Call `accept()` to complete the upgrade or `reject()` to refuse it.
+    """
+    def __init__(self,
+                 reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter,
+                 target: str,
+                 headers: typing.Dict[str, str]):
+        self._reader = reader
+        self._writer = writer
+        parsed = urllib.parse.urlsplit(target)
+        self.path = urllib.parse.unquote(parsed.path)
+        self.query = dict(urllib.parse.parse_qsl(parsed.query))
+        self.headers = headers
+
+
+    async def accept(self) -> WebSocket:
+        key = self.headers.get("sec-websocket-key", "")
+        response = [
+            "HTTP/1.1 101 Switching Protocols",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            f"Sec-WebSocket-Accept: {_accept_key(key)}"]
+        self._writer.write(("\r\n".join(response) + "\r\n\r\n").encode("latin-1"))
+        await self._writer.drain()
+        return WebSocket(self._reader, self._writer, is_client=False)
+
+
+    async def reject(self, status: int, reason: str):
+        self._writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode("latin-1"))
+        try:
+            await self._writer.drain()
+        except ConnectionError:
+            pass
+        self._writer.close()
+
+
+async def read_request(reader: asyncio.StreamReader,
+                       writer: asyncio.StreamWriter) -> typing.Optional[WebSocketRequest]:
+    """Reads an incoming WebSocket upgrade request.
+    Returns None (and closes the connection) if the request is not a valid upgrade.
+    """
+    try:
+        request_line, headers = await _read_http_head(reader)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        writer.close()
+        return None
+    parts = request_line.split(" ")
+    request = WebSocketRequest(reader, writer, parts[1] if len(parts) > 1 else "/", headers)
+    if parts[0] != "GET" or headers.get("upgrade", "").lower() != "websocket" \
+            or "sec-websocket-key" not in headers:
+        await request.reject(400, "Bad Request")
+        return None
+    return request
@@ -0,0 +1,71 @@
+"""Benchmarks per-call overhead of azdebugrelay.breakpoint() family in a hot loop.
+
+Compares detached breakpoints (no debugger attached) with an empty loop and with
+the `if is_debug: debugpy.breakpoint()` pattern, and shows the cost of armed breakpoints
+whose conditions are evaluated but never met (no debugger is needed for that).
+
+    python benchmarks/bench_breakpoints.py --calls 2000000
+"""
+import argparse
+import pathlib
+import sys
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
+
+import azdebugrelay  # noqa: E402
+
+is_debug = False
+row = {"loss": 1.0}
+
+
+def _cases():
+    bp = azdebugrelay.breakpoint
+    every = azdebugrelay.breakpoint.every(10 ** 9)
+    when = azdebugrelay.breakpoint.when(lambda value: value["loss"] > 10)
+    sampled = azdebugrelay.breakpoint.sampled(0.0)
+    combined = azdebugrelay.breakpoint.after(10 ** 9).every(100).when(lambda value: value["loss"] > 10)
+    return [
+        ("empty loop", "pass", {}),
+        ("if is_debug: ... (False)", "if is_debug: bp()", {"is_debug": is_debug, "bp": bp}),
+        ("breakpoint()", "bp()", {"bp": bp}),
+        ("breakpoint.every(N)()", "bp()", {"bp": every}),
+        ("breakpoint.when(predicate)(row)", "bp(row)", {"bp": when, "row": row}),
+        ("if bp.armed: bp(row)", "if bp.armed: bp(row)", {"bp": when, "row": row}),
+        ("breakpoint.sampled(p)()", "bp()", {"bp": sampled}),
+        ("after(N).every(M).when(...)(row)", "bp(row)", {"bp": combined, "row": row}),
+    ]
+
+
+def measure(statement: str, namespace: dict, calls: int, repeat: int) -> float:
+    """Returns the best time per call, in nanoseconds.
+    """
+    timer = timeit.Timer(statement, globals=namespace)
+    return min(timer.repeat(repeat=repeat, number=calls)) / calls * 1e9
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    options = parser.parse_args(argv)
+
+    cases = _cases()
+    print("Detached (no debugger attached):")
+    baseline = None
+    for name, statement, namespace in cases:
+        cost = measure(statement, namespace, options.calls, options.repeat)
+        baseline = cost if baseline is None else baseline
+        print(f"{name:>34}: {cost:7.1f} ns/call (+{cost - baseline:6.1f} ns over an empty loop)")
+
+    # armed, but conditions are never met, so the debugger is never asked to stop
+    azdebugrelay.arm_breakpoints()
+    print("Armed, conditions not met:")
+    for name, statement, namespace in cases[3:]:
+        cost = measure(statement, namespace, options.calls, options.repeat)
+        print(f"{name:>34}: {cost:7.1f} ns/call (+{cost - baseline:6.1f} ns over an empty loop)")
+    azdebugrelay.disarm_breakpoints()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,85 @@
+"""Benchmarks relay configuration resolution (azdebugrelay.relay_config) with a local stub secret provider.
+
+LocalSecretProvider stands in for a secret store like Key Vault, with a simulated lookup latency.
+Measures resolving settings without a cache, from the in-memory cache, from the on-disk cache
+(as a new process would), and from .azrelay.json, and reports cache hit rates of repeated sessions.
+
+    python benchmarks/bench_config.py --latency 0.05 --sessions 100
+"""
+import argparse
+import json
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
+
+from azdebugrelay.relay_config import (ConfigResolver, SecretCache, LocalSecretProvider,  # noqa: E402
+                                       CONNECTION_NAME, CONNECTION_STRING, DEFAULT_SECRET_NAMES)
+
+_SECRETS = {
+    DEFAULT_SECRET_NAMES[CONNECTION_STRING]: "Endpoint=sb://bench.servicebus.windows.net/;"
+                                             "SharedAccessKeyName=bench;SharedAccessKey=YmVuY2g=",
+    DEFAULT_SECRET_NAMES[CONNECTION_NAME]: "bench",
+}
+
+
+def _timed_sessions(resolver: ConfigResolver, sessions: int) -> float:
+    """Resolves settings sessions times, returns the average latency in seconds.
+    """
+    start = time.perf_counter()
+    for _ in range(sessions):
+        if not resolver.resolve().complete:
+            raise RuntimeError("Settings are not resolved.")
+    return (time.perf_counter() - start) / sessions
+
+
+def _report(name: str, latency: float, resolver: ConfigResolver = None):
+    line = f"{name:>28}: {latency * 1000:9.3f} ms per session"
+    if resolver is not None:
+        stats = resolver.stats()
+        line += f", hit rate {stats['hit_rate']:6.1%}, {stats['lookups']} provider lookups"
+    print(line)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05, help="Secret provider lookup latency, seconds")
+    parser.add_argument("--sessions", type=int, default=100)
+    options = parser.parse_args(argv)
+
+    folder = tempfile.mkdtemp(prefix="azdebugrelay-bench-")
+    cache_dir = os.path.join(folder, "secrets")
+    try:
+        print(f"secret provider lookups take {options.latency * 1000:.0f} ms")
+        provider = LocalSecretProvider(_SECRETS, latency=options.latency)
+        # a cache that forgets at once: every session hits the provider
+        uncached = ConfigResolver(None, [provider], cache=SecretCache(ttl=0), environment={})
+        _report("no cache", _timed_sessions(uncached, max(1, options.sessions // 10)), uncached)
+
+        memory = ConfigResolver(None, [provider], environment={})
+        _report("in-memory cache", _timed_sessions(memory, options.sessions), memory)
+
+        ConfigResolver(None, [provider], cache=SecretCache(directory=cache_dir), environment={}).resolve()
+        # new processes start with an empty memory cache
+        disk_latency = 0.0
+        for _ in range(options.sessions):
+            disk = ConfigResolver(None, [provider], cache=SecretCache(directory=cache_dir), environment={})
+            disk_latency += _timed_sessions(disk, 1)
+        _report("on-disk cache, new process", disk_latency / options.sessions)
+
+        config_file = os.path.join(folder, ".azrelay.json")
+        with open(config_file, "w") as cfg_file:
+            json.dump({CONNECTION_STRING: _SECRETS[DEFAULT_SECRET_NAMES[CONNECTION_STRING]],
+                       CONNECTION_NAME: "bench"}, cfg_file)
+        from_file = ConfigResolver(config_file, environment={})
+        _report(".azrelay.json", _timed_sessions(from_file, options.sessions))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
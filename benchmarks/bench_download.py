@@ -0,0 +1,136 @@
+"""Benchmarks Azure Relay Bridge archive download and extraction against a local HTTP server.
+
+Compares the streaming pipeline (hash, save and extract in one pass) with
+downloading the whole archive first and extracting it afterwards,
+and measures how much an interrupted download saves by resuming.
+
+    python benchmarks/bench_download.py --size-mb 64
+"""
+import argparse
+import functools
+import http.server
+import io
+import logging
+import os
+import pathlib
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
+
+from azdebugrelay.bridge_installer import BridgeArchive, fetch_archive  # noqa: E402
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler with single-range `Range` support.
+    Stops sending after `drop_after` bytes of a response once, to emulate a broken connection.
+    """
+    drop_after = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            start = int(range_header[len("bytes="):].split("-")[0])
+            if start >= size:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        limit = RangeRequestHandler.drop_after
+        RangeRequestHandler.drop_after = None
+        with open(path, "rb") as source:
+            source.seek(start)
+            sent = 0
+            for chunk in iter(lambda: source.read(256 * 1024), b""):
+                if limit is not None and sent + len(chunk) > limit:
+                    self.wfile.write(chunk[:limit - sent])
+                    self.close_connection = True
+                    return
+                self.wfile.write(chunk)
+                sent += len(chunk)
+
+
+def _make_archive(folder: str, size_mb: int) -> str:
+    path = os.path.join(folder, "azbridge.bench-x64.tar.gz")
+    payload = os.urandom(size_mb * 1024 * 1024)
+    with tarfile.open(path, "w:gz", compresslevel=1) as tar_file:
+        info = tarfile.TarInfo("azbridge")
+        info.size = len(payload)
+        tar_file.addfile(info, io.BytesIO(payload))
+    return path
+
+
+def _download_then_extract(url: str, folder: str):
+    file_name, _ = urllib.request.urlretrieve(url)
+    with tarfile.open(file_name, "r:gz") as tar_file:
+        tar_file.extractall(folder)
+    os.remove(file_name)
+
+
+def _timed(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=64, help="Archive payload size")
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args(argv)
+
+    logging.root.setLevel(logging.WARNING)
+    root = tempfile.mkdtemp(prefix="azdebugrelay-bench-")
+    try:
+        serve_dir = os.path.join(root, "serve")
+        os.makedirs(serve_dir)
+        archive_path = _make_archive(serve_dir, options.size_mb)
+        archive_size = os.path.getsize(archive_path)
+        server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), functools.partial(RangeRequestHandler, directory=serve_dir))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/{os.path.basename(archive_path)}"
+        archive = BridgeArchive(url, os.path.basename(archive_path), None)
+
+        def streaming():
+            work_dir = tempfile.mkdtemp(dir=root)
+            fetch_archive(archive, work_dir, extract_to=work_dir)
+
+        def sequential():
+            _download_then_extract(url, tempfile.mkdtemp(dir=root))
+
+        print(f"archive: {archive_size / 1048576:.1f} MB, {options.repeat} runs each")
+        for name, function in (("download, then extract", sequential), ("streaming pipeline", streaming)):
+            best = min(_timed(function) for _ in range(options.repeat))
+            print(f"{name:>24}: {best:.3f} s, {archive_size / best / 1048576:.1f} MB/s")
+
+        # interrupted halfway, then resumed with a Range request
+        work_dir = tempfile.mkdtemp(dir=root)
+        RangeRequestHandler.drop_after = archive_size // 2
+        resumed = _timed(lambda: fetch_archive(archive, work_dir, extract_to=work_dir, retries=1))
+        print(f"{'interrupted + resumed':>24}: {resumed:.3f} s")
+        server.shutdown()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
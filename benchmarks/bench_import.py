@@ -0,0 +1,88 @@
+"""Benchmarks `import azdebugrelay` where debugging is disabled.
+
+Measures import time in fresh interpreters and checks
+that the import pulls in none of the modules only needed once a relay or a debugger
+connection is created (debugpy, asyncio, ssl, downloads and archives, hashing, ctypes).
+Exits with code 1 if any of them is imported.
+
+    python benchmarks/bench_import.py --repeat 20
+"""
+import argparse
+import ast
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+
+ROOT = str(pathlib.Path(__file__).absolute().parent.parent)
+
+# Modules that must not be imported until a relay or a debugger connection is created
+DEFERRED_MODULES = (
+    "debugpy",
+    "asyncio",
+    "concurrent.futures",
+    "ssl",
+    "urllib.request",
+    "http.client",
+    "tarfile",
+    "zipfile",
+    "hashlib",
+    "ctypes",
+    "socket",
+    "json",
+    "argparse",
+    "azdebugrelay.hybrid_connection",
+    "azdebugrelay.bridge_installer",
+    "azdebugrelay.relay_daemon",
+)
+
+_PROBE = """
+import sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(repr({{"seconds": elapsed, "modules": sorted(set(sys.modules) - before)}}))
+"""
+
+
+def measure(statement: str, repeat: int):
+    """Runs statement in repeat fresh interpreters.
+    Returns import times (seconds) and modules imported by the last run.
+    """
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = ROOT + os.pathsep + environment.get("PYTHONPATH", "")
+    samples, modules = [], []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _PROBE.format(statement=statement)],
+                                env=environment, stdout=subprocess.PIPE, check=True).stdout
+        result = ast.literal_eval(output.decode().strip().splitlines()[-1])
+        samples.append(result["seconds"])
+        modules = result["modules"]
+    return samples, modules
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    options = parser.parse_args(argv)
+
+    # warm up bytecode caches
+    measure("import azdebugrelay", 1)
+    samples, modules = measure("import azdebugrelay", options.repeat)
+    print(f"{'import azdebugrelay':>34}: median {statistics.median(samples) * 1000:8.1f} ms, "
+          f"min {min(samples) * 1000:8.1f} ms, {len(modules)} modules")
+    samples, _ = measure("from azdebugrelay import DebugRelay, DebugMode, debugpy_connect_with_timeout",
+                         options.repeat)
+    print(f"{'from azdebugrelay import ...':>34}: median {statistics.median(samples) * 1000:8.1f} ms")
+
+    loaded = [name for name in DEFERRED_MODULES if name in modules]
+    if loaded:
+        print(f"Imported eagerly, should be deferred: {', '.join(loaded)}")
+        sys.exit(1)
+    print(f"None of {len(DEFERRED_MODULES)} deferred modules are imported.")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
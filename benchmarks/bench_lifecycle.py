@@ -0,0 +1,390 @@
+"""Benchmarks DebugRelay lifecycle against a fake Azure Relay Bridge (see tests/fake_azbridge.py).
+
+Puts a fake `azbridge` on PATH and measures, for a growing number of concurrent relays:
+open() and close() latency (threads and open_async()), process and thread/file descriptor usage,
+plus background_launch() latency, output handling throughput, crash detection latency,
+downtime of a supervised relay restarted after its bridge is killed, latency of exit notifications (on_exit),
+closing many relays one by one vs. with close_all() and kill_relays(), starting many relays one by one
+vs. from a manifest, reopening a shared relay by adopting its running bridge, and the cost of failed debugpy connect attempts.
+No network access or Azure Relay is needed.
+
+    python benchmarks/bench_lifecycle.py --relays 1,8,32
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import logging
+import os
+import pathlib
+import shutil
+import signal
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
+
+from azdebugrelay import DebugRelay, DebugMode, RestartPolicy, debugpy_connect_with_timeout  # noqa: E402
+from azdebugrelay.relay_registry import REGISTRY_DIR_ENV  # noqa: E402
+from azdebugrelay.relay_manifest import RelayManifest, RelaySpec  # noqa: E402
+
+FAKE_CONNECTION_STRING = "Endpoint=sb://fake.servicebus.windows.net/;"\
+    "SharedAccessKeyName=fake;SharedAccessKey=ZmFrZQ=="
+FAKE_ENV_PREFIX = "FAKE_AZBRIDGE_"
+
+
+def install_fake_azbridge(folder: str) -> str:
+    """Creates `azbridge` launcher of tests/fake_azbridge.py in folder, and puts folder first on PATH.
+    """
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "fake_azbridge.py")
+    if DebugRelay.is_windows:
+        launcher = os.path.join(folder, "azbridge.cmd")
+        with open(launcher, "w") as launcher_file:
+            launcher_file.write(f"@\"{sys.executable}\" \"{script}\" %*\n")
+    else:
+        launcher = os.path.join(folder, "azbridge")
+        with open(launcher, "w") as launcher_file:
+            launcher_file.write(f"#!/bin/sh\nexec \"{sys.executable}\" \"{script}\" \"$@\"\n")
+        os.chmod(launcher, 0o755)
+    os.environ["PATH"] = folder + os.pathsep + os.environ["PATH"]
+    # the fake is already "installed"
+    DebugRelay._installed_az_relay = True
+    return launcher
+
+
+def configure_fake(**settings):
+    """Sets fake azbridge behavior for relays started after this call (see tests/fake_azbridge.py),
+    e.g. configure_fake(local_delay=0.1, flood_lines=10000).
+    """
+    for name in list(os.environ):
+        if name.startswith(FAKE_ENV_PREFIX):
+            del os.environ[name]
+    for name, value in settings.items():
+        if value is not None:
+            os.environ[FAKE_ENV_PREFIX + name.upper()] = str(value)
+
+
+def open_file_descriptors() -> int:
+    for folder in ("/proc/self/fd", "/dev/fd"):
+        if os.path.isdir(folder):
+            return len(os.listdir(folder))
+    return -1
+
+
+def _relays(count: int, base_port: int = 20000):
+    return [DebugRelay(FAKE_CONNECTION_STRING, f"bench{index}", DebugMode.Connect,
+                       ports=[str(base_port + index)], az_relay_connection_wait_time=30)
+            for index in range(count)]
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return (statistics.median(samples),
+            samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            samples[-1])
+
+
+def _timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def bench_threads(count: int):
+    """Opens and closes count relays concurrently with open()/close() in a thread pool.
+    """
+    relays = _relays(count)
+    threads_before, fds_before = threading.active_count(), open_file_descriptors()
+    with concurrent.futures.ThreadPoolExecutor(count) as pool:
+        open_latency = list(pool.map(lambda relay: _timed(relay.open), relays))
+        threads, fds = threading.active_count() - threads_before, open_file_descriptors() - fds_before
+        close_latency = list(pool.map(lambda relay: _timed(relay.close), relays))
+    return open_latency, close_latency, threads, fds
+
+
+def bench_async(count: int):
+    """Opens and closes count relays concurrently with open_async()/close_async() on one event loop.
+    """
+    relays = _relays(count)
+
+    async def timed(coroutine):
+        start = time.perf_counter()
+        await coroutine
+        return time.perf_counter() - start
+
+    async def run():
+        threads_before, fds_before = threading.active_count(), open_file_descriptors()
+        open_latency = await asyncio.gather(*(timed(relay.open_async()) for relay in relays))
+        threads, fds = threading.active_count() - threads_before, open_file_descriptors() - fds_before
+        close_latency = await asyncio.gather(*(timed(relay.close_async()) for relay in relays))
+        return open_latency, close_latency, threads, fds
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def bench_background_launch(repeat: int):
+    relay = _relays(1)[0]
+    latency = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = relay.background_launch()
+        latency.append(time.perf_counter() - start)
+        # detached bridges run in a session of their own, so stop them here
+        process.terminate()
+        process.wait()
+    return latency
+
+
+class _DoneHandler(logging.Handler):
+    def __init__(self, marker: str):
+        super().__init__(logging.DEBUG)
+        self.marker = marker
+        self.lines = 0
+        self.done = threading.Event()
+
+    def emit(self, record):
+        self.lines += 1
+        if self.marker in record.getMessage():
+            self.done.set()
+
+
+def bench_output(lines: int, line_size: int):
+    """Measures how fast output of a flooding bridge is handled after open() returns.
+    """
+    logger = logging.getLogger("azdebugrelay.bench.output")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = _DoneHandler("FAKE_AZBRIDGE_DONE")
+    logger.addHandler(handler)
+    configure_fake(flood_lines=lines, line_size=line_size)
+    relay = DebugRelay(FAKE_CONNECTION_STRING, "bench", DebugMode.Connect,
+                       ports=["20000"], logger=logger)
+    start = time.perf_counter()
+    relay.open()
+    handler.done.wait(120)
+    elapsed = time.perf_counter() - start
+    relay.close()
+    configure_fake()
+    logger.removeHandler(handler)
+    return elapsed, handler.lines
+
+
+def bench_crash(repeat: int):
+    """Measures how long open() takes to report a bridge that crashes before connecting.
+    """
+    configure_fake(local_delay=0.05, crash="before")
+    latency = []
+    relay = _relays(1)[0]
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            relay.open()
+        except RuntimeError:
+            pass
+        latency.append(time.perf_counter() - start)
+    configure_fake()
+    return latency
+
+
+def bench_supervised_restart(repeat: int):
+    """Kills the bridge of a supervised relay (no backoff delay), and measures its downtime until it is up again.
+    """
+    restarted = threading.Event()
+    policy = RestartPolicy(initial_delay=0, on_up=lambda relay, downtime: restarted.set())
+    relay = DebugRelay(FAKE_CONNECTION_STRING, "bench", DebugMode.Connect,
+                       ports=["20000"], restart_policy=policy)
+    relay.open()
+    downtime = []
+    for _ in range(repeat):
+        restarted.clear()
+        before = relay.stats()["downtime_seconds"]
+        os.kill(relay.bridge_pid(), signal.SIGKILL if hasattr(signal, "SIGKILL") else signal.SIGTERM)
+        restarted.wait(60)
+        downtime.append(relay.stats()["downtime_seconds"] - before)
+    relay.close()
+    return downtime
+
+
+def bench_exit_notification(count: int):
+    """Opens count relays, kills their bridges and measures how long on_exit callbacks take to fire.
+    Returns latencies and the number of threads watching the open relays.
+    """
+    relays = _relays(count)
+    exited = {}
+    all_exited = threading.Event()
+
+    def on_exit(relay, returncode):
+        exited[relay] = time.perf_counter()
+        if len(exited) == count:
+            all_exited.set()
+
+    for relay in relays:
+        relay.on_exit(on_exit)
+    with concurrent.futures.ThreadPoolExecutor(count) as pool:
+        list(pool.map(lambda relay: relay.open(), relays))
+    threads = sum(1 for thread in threading.enumerate() if thread.name.startswith("azdebugrelay exit"))
+    killed = {}
+    for relay in relays:
+        killed[relay] = time.perf_counter()
+        os.kill(relay.bridge_pid(), signal.SIGKILL if hasattr(signal, "SIGKILL") else signal.SIGTERM)
+    all_exited.wait(60)
+    for relay in relays:
+        relay.close()
+    return [exited[relay] - killed[relay] for relay in relays if relay in exited], threads
+
+
+def bench_close_all(count: int, exit_delay: float):
+    """Opens count relays with bridges that take exit_delay seconds to shut down,
+    and measures closing them one by one with close(), together with close_all(), and with kill_relays().
+    """
+    configure_fake(exit_delay=exit_delay)
+    relays = _relays(count)
+    try:
+        timings = []
+        for close in (lambda: [relay.close() for relay in relays], DebugRelay.close_all, DebugRelay.kill_relays):
+            with concurrent.futures.ThreadPoolExecutor(count) as pool:
+                list(pool.map(lambda relay: relay.open(), relays))
+            timings.append(_timed(close))
+        return timings
+    finally:
+        DebugRelay.close_all()
+        configure_fake()
+
+
+def bench_manifest(count: int):
+    """Measures bringing up count relays one after another (like scripted CLI launches)
+    and all at once from a manifest (see RelayManifest).
+    """
+    relays = _relays(count)
+    try:
+        serial = _timed(lambda: [relay.open() for relay in relays])
+    finally:
+        DebugRelay.close_all()
+    manifest = RelayManifest([RelaySpec(f"bench{index}", f"bench{index}", FAKE_CONNECTION_STRING,
+                                        ports=[str(20000 + index)], restart=False) for index in range(count)])
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(manifest.start_async())
+        loop.run_until_complete(manifest.close_async())
+    finally:
+        loop.close()
+    ready = sum(1 for result in manifest.results.values() if result["status"] == "ready")
+    return serial, manifest.startup_seconds, ready
+
+
+def bench_shared_reopen(repeat: int):
+    """Measures open() of a shared relay launching its bridge, then of new relays adopting the running bridge
+    (as a restarted step or script would), and closing the last user.
+    """
+    def shared_relay():
+        return DebugRelay(FAKE_CONNECTION_STRING, "bench-shared", DebugMode.Connect,
+                          ports=["20000"], az_relay_connection_wait_time=30, shared=True)
+
+    configure_fake(local_delay=0.05, remote_delay=0.05)
+    first = shared_relay()
+    cold = [_timed(first.open)]
+    first.detach()
+    adopt = []
+    for _ in range(repeat):
+        relay = shared_relay()
+        adopt.append(_timed(relay.open))
+        relay.detach()
+    last = shared_relay()
+    last.open()
+    close_last = _timed(last.close)
+    configure_fake()
+    return cold, adopt, close_last
+
+
+def bench_debugpy_connect(repeat: int):
+    """Measures failed debugpy connect attempts (nothing listens on the port),
+    and threads/file descriptors they leave behind.
+    """
+    threads_before, fds_before = threading.active_count(), open_file_descriptors()
+    latency = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        debugpy_connect_with_timeout("127.0.0.1", 9, 0.5)
+        latency.append(time.perf_counter() - start)
+    return latency, threading.active_count() - threads_before, open_file_descriptors() - fds_before
+
+
+def _report(name: str, samples):
+    median, p95, worst = _percentiles(samples)
+    print(f"{name:>34}: median {median * 1000:8.1f} ms, p95 {p95 * 1000:8.1f} ms, max {worst * 1000:8.1f} ms")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--relays", default="1,4,16", help="Comma-separated numbers of concurrent relays")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--local-delay", type=float, default=0.05,
+                        help="Fake bridge delay before LocalForwardHostStart, seconds")
+    parser.add_argument("--remote-delay", type=float, default=0.05,
+                        help="Fake bridge delay before RemoteForwardHostStart, seconds")
+    parser.add_argument("--exit-delay", type=float, default=0.2,
+                        help="Fake bridge shutdown time after SIGTERM when measuring close_all(), seconds")
+    parser.add_argument("--flood-lines", type=int, default=100000)
+    parser.add_argument("--line-size", type=int, default=120)
+    options = parser.parse_args(argv)
+
+    # keep benchmark output readable: bridge output is logged, not measured here
+    logging.root.setLevel(logging.CRITICAL + 1)
+    folder = tempfile.mkdtemp(prefix="azdebugrelay-bench-")
+    # keep benchmark bridges out of the registry of the current user
+    os.environ[REGISTRY_DIR_ENV] = os.path.join(folder, "registry")
+    try:
+        install_fake_azbridge(folder)
+        configure_fake(local_delay=options.local_delay, remote_delay=options.remote_delay)
+        print(f"fake bridge connects in {(options.local_delay + options.remote_delay) * 1000:.0f} ms")
+        for count in (int(value) for value in options.relays.split(",")):
+            for name, bench in (("threads", bench_threads), ("async", bench_async)):
+                open_latency, close_latency, threads, fds = [], [], 0, 0
+                for _ in range(options.repeat):
+                    opened, closed, threads, fds = bench(count)
+                    open_latency += opened
+                    close_latency += closed
+                print(f"{count} relays, {name}: +{threads} threads, +{fds} fds while open")
+                _report("open", open_latency)
+                _report("close", close_latency)
+
+        _report("background_launch", bench_background_launch(options.repeat))
+        _report("crash before connecting", bench_crash(options.repeat))
+        _report("supervised restart downtime", bench_supervised_restart(options.repeat))
+        cold, adopt, close_last = bench_shared_reopen(options.repeat * 10)
+        _report("shared open, launching", cold)
+        _report("shared open, adopting", adopt)
+        print(f"{'':>34}  closing the last user {close_last * 1000:.1f} ms")
+        connect_latency, threads, fds = bench_debugpy_connect(options.repeat * 10)
+        _report("failed debugpy connect (0.5 s)", connect_latency)
+        print(f"{'':>34}  +{threads} threads, +{fds} fds left behind")
+        for count in (int(value) for value in options.relays.split(",")):
+            latency, threads = bench_exit_notification(count)
+            _report(f"exit notification, {count} relays", latency)
+            print(f"{'':>34}  {threads} exit watcher threads")
+        for count in (int(value) for value in options.relays.split(",")):
+            serial, together, killed = bench_close_all(count, options.exit_delay)
+            print(f"{f'closing {count} relays':>34}: close() one by one {serial:.3f} s, "
+                  f"close_all() {together:.3f} s, kill_relays() {killed:.3f} s")
+
+        for count in (int(value) for value in options.relays.split(",")):
+            serial, together, ready = bench_manifest(count)
+            print(f"{f'starting {count} relays':>34}: one by one {serial:.3f} s, "
+                  f"from a manifest {together:.3f} s ({ready} ready)")
+
+        elapsed, handled = bench_output(options.flood_lines, options.line_size)
+        print(f"{'output handling':>34}: {options.flood_lines} lines of {options.line_size} bytes in {elapsed:.3f} s, "
+              f"{options.flood_lines / elapsed:,.0f} lines/s, {handled} log records")
+    finally:
+        configure_fake()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,96 @@
+"""Benchmarks spawning Azure Relay Bridge against a fake one (see tests/fake_azbridge.py).
+
+Compares the former way of launching the bridge, a command line string run by the shell
+with `preexec_fn=os.setpgrp`, with an argv list started in a new session (no shell, no preexec_fn),
+measuring how long Popen() takes and how long until the bridge reports it is connected.
+Then measures DebugRelay.open() spawn-to-ready latency with a bridge that connects at once.
+POSIX only: preexec_fn does not exist on Windows.
+
+    python benchmarks/bench_spawn.py --repeat 50
+"""
+import argparse
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent))
+
+from bench_lifecycle import FAKE_CONNECTION_STRING, _report, configure_fake, install_fake_azbridge  # noqa: E402
+from azdebugrelay import DebugRelay, DebugMode  # noqa: E402
+from azdebugrelay.relay_registry import REGISTRY_DIR_ENV  # noqa: E402
+
+_READY_MARKER = b"RemoteForwardHostStart,"
+
+
+def _shell_spawn():
+    return subprocess.Popen(
+        f"azbridge -R bench:127.0.0.1:20000:20000 -x \"{FAKE_CONNECTION_STRING}\"",
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True, preexec_fn=os.setpgrp)
+
+
+def _argv_spawn():
+    return subprocess.Popen(
+        [shutil.which("azbridge"), "-R", "bench:127.0.0.1:20000:20000", "-f", os.devnull],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, close_fds=True, start_new_session=True)
+
+
+def bench_spawn(spawn, repeat: int):
+    """Returns Popen() latency and spawn-to-ready latency samples.
+    """
+    spawned, ready = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = spawn()
+        spawned.append(time.perf_counter() - start)
+        for line in process.stdout:
+            if _READY_MARKER in line:
+                break
+        ready.append(time.perf_counter() - start)
+        process.terminate()
+        process.stdout.close()
+        process.wait()
+    return spawned, ready
+
+
+def bench_open(repeat: int):
+    relay = DebugRelay(FAKE_CONNECTION_STRING, "bench", DebugMode.Connect,
+                       ports=["20000"], az_relay_connection_wait_time=30)
+    latency = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        relay.open()
+        latency.append(time.perf_counter() - start)
+        relay.close()
+    return latency
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    options = parser.parse_args(argv)
+    if DebugRelay.is_windows:
+        print("bench_spawn.py runs on POSIX only.")
+        return
+
+    folder = tempfile.mkdtemp(prefix="azdebugrelay-bench-")
+    os.environ[REGISTRY_DIR_ENV] = os.path.join(folder, "registry")
+    try:
+        install_fake_azbridge(folder)
+        configure_fake()
+        for name, spawn in (("shell + preexec_fn", _shell_spawn), ("argv + new session", _argv_spawn)):
+            spawned, ready = bench_spawn(spawn, options.repeat)
+            _report(f"{name}, Popen()", spawned)
+            _report(f"{name}, ready", ready)
+        _report("DebugRelay.open()", bench_open(options.repeat))
+    finally:
+        configure_fake()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -2,19 +2,40 @@ import argparse
 from copy import Error
 import logging
 from azureml.core import Run
-from azdebugrelay import DebugRelay, DebugMode, debugpy_connect_with_timeout
+from azdebugrelay import DebugRelay, DebugMode, RankPolicy, debugpy_connect_with_timeout
+from azdebugrelay import ConfigResolver, SecretProvider, default_resolver
+from azdebugrelay.relay_config import CONNECTION_STRING
+
+
+class RunSecretProvider(SecretProvider):
+    """Looks up secrets in Key Vault of the workspace of an Azure ML run.
+    """
+    def __init__(self, run: Run):
+        self.run = run
+        try:
+            self.name = f"azureml:{run.experiment.workspace.name}"
+        except Exception:
+            # offline runs have no workspace
+            self.name = "azureml"
+
+    def get_secret(self, secret_name: str):
+        return self.run.get_secret(secret_name)
 
 
 def start_remote_debugging(
         debug_relay_connection_string_secret: str,
         debug_relay_connection_name:str,
         debug_port: int,
-        debugpy_connect_timeout: float = 15
+        debugpy_connect_timeout: float = 15,
+        rank_policy: RankPolicy = None
         ):
-    # get connection string from the workspace Key Vault
-    run = Run.get_context()
-    connection_string = run.get_secret(
-        debug_relay_connection_string_secret)
+    # get connection string from AZRELAY_CONNECTION_STRING, .azrelay.json, or the workspace Key Vault,
+    # cached (see azdebugrelay.relay_config), so repeated sessions don't look it up again
+    resolver = ConfigResolver(
+        providers=[RunSecretProvider(Run.get_context())],
+        secret_names={CONNECTION_STRING: debug_relay_connection_string_secret},
+        cache=default_resolver().cache)
+    connection_string = resolver.resolve(connection_name=debug_relay_connection_name).connection_string
     if connection_string is None or connection_string == "":
         err_msg = "Connection string for Azure Relay Hybrid Connection is missing in Key Vault."
         logging.fatal(err_msg)
@@ -30,6 +51,10 @@ def start_remote_debugging(
 
     debug_relay = DebugRelay(
         connection_string, relay_connection_name, debug_mode, hybrid_connection_url, host, port)
+    if rank_policy is not None:
+        # the policy picks the port, and ranks of this node share one relay
+        print(f"Starting debugpy session for rank {rank_policy.rank_info.rank} on port {rank_policy.port}.")
+        return rank_policy.attach(debug_relay, debugpy_connect_timeout)
     debug_relay.open()
     if debug_relay.is_running():
         print(f"Starting debugpy session on {host}:{port} with timeout {debugpy_connect_timeout} seconds.")
@@ -46,7 +71,7 @@ def start_remote_debugging(
         raise Error(err_msg)
 
 
-def start_remote_debugging_from_args(ignore_debug_flag: bool = False) -> bool:
+def start_remote_debugging_from_args(ignore_debug_flag: bool = False, rank_policy: RankPolicy = None) -> bool:
     parser = argparse.ArgumentParser()
     parser.add_argument("--is-debug", type=str, required=True)
     parser.add_argument("--debug-relay-connection-name",
@@ -70,4 +95,5 @@ def start_remote_debugging_from_args(ignore_debug_flag: bool = False) -> bool:
     return start_remote_debugging(
         options.debug_relay_connection_string_secret,
         options.debug_relay_connection_name,
-        options.debug_port)
+        options.debug_port,
+        rank_policy=rank_policy)
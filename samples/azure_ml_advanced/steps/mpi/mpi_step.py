@@ -2,6 +2,7 @@ import argparse
 import horovod.tensorflow as hvd
 import tensorflow as tf
 import debugpy
+from azdebugrelay import RankPolicy, RankInfo
 from samples.azure_ml_advanced.steps.amldebugutils import start_remote_debugging_from_args
 
 
@@ -31,9 +32,15 @@ def main():
     print("Horovod size:", hvd.size())
     print("Horovod rank:", hvd.rank())
 
-    if args.is_debug.lower() == 'true' and hvd.rank() == 0:
+    # rank 0 by default, AZDEBUGRELAY_RANKS environment variable may select others (e.g. "all" or "0,3")
+    rank_policy = RankPolicy.from_environment(
+        default="0",
+        rank_info=RankInfo(hvd.rank(), hvd.local_rank(), hvd.size(), hvd.local_size(),
+                           RankInfo.from_environment().job_id))
+
+    if args.is_debug.lower() == 'true' and rank_policy.should_attach():
         print("Let's start debugging")
-        if start_remote_debugging_from_args():
+        if start_remote_debugging_from_args(rank_policy=rank_policy):
             debugpy.breakpoint()
             # the breakpoint will hit on train() call below
 
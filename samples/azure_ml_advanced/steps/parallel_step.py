@@ -1,21 +1,16 @@
 import os
 import argparse
-import debugpy
+import azdebugrelay
 from samples.azure_ml_advanced.steps.amldebugutils import start_remote_debugging_from_args
 
 
 def init():
-    global is_debug
-
     parser = argparse.ArgumentParser(description="Parallel Step parameters")
     parser.add_argument('--is-debug', required=True, type=str)
     args, _ = parser.parse_known_args()
 
-    is_debug = False
-    
     # debug mode and on the master node
     if args.is_debug.lower() == 'true' and bool(os.environ.get('AZ_BATCH_IS_CURRENT_NODE_MASTER')):
-        is_debug = True
         print("This is a mater node. Start a debugging session.")
         start_remote_debugging_from_args()
 
@@ -24,9 +19,9 @@ def run(input_rows):
     """
     Work with files
     """
-    if is_debug:
-        print("Debugging a parallel step")
-        debugpy.breakpoint()
+    # skipped unless the debugger has been attached in init()
+    if azdebugrelay.breakpoint.armed:
+        azdebugrelay.breakpoint()
 
     lines = []
 
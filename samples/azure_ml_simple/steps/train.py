@@ -1,7 +1,7 @@
 import argparse
 import logging
-import debugpy
 from azureml.core import Run
+import azdebugrelay
 from azdebugrelay import DebugRelay, DebugMode, debugpy_connect_with_timeout
 
 
@@ -63,8 +63,9 @@ def train_job(debug: bool = False):
     Args:
         debug (bool, optional): Debugging mode. Defaults to False.
     """
-    if debug:
-        debugpy.breakpoint()
+    # stops only if the debugger is attached
+    if azdebugrelay.breakpoint.armed:
+        azdebugrelay.breakpoint()
     print(f"Doing my work. Debug mode is {debug}.")
 
 
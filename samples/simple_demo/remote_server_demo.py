@@ -3,6 +3,7 @@ import sys
 import argparse
 import platform
 import pathlib
+import time
 from signal import signal, SIGINT
 import debugpy
 
@@ -21,7 +22,7 @@ if _missing_azdebugrelay:
     sys.path.insert(0, _azdebugrelay_dir)
 ###############  
 
-from azdebugrelay import DebugRelay, DebugMode, debugpy_connect_with_timeout
+from azdebugrelay import DebugRelay, DebugMode, DebugTrigger, debugpy_connect_with_timeout
 g_debug_relay = None
 
 def do_work():
@@ -41,12 +42,21 @@ def _signal_handler(signal_received, frame):
     exit(0)
 
 
+def _parse_debug_option(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--debug', action='store',
+                        default="none", choices=['attach', 'listen', 'on-signal', 'none'], required=False)
+    options, _ = parser.parse_known_args(args=args)
+    return options
+
+
 def _check_for_debugging(args) -> DebugRelay:
     """An over-engineered debugger initialization function.
     Parses command-line arguments looking for `--debug` option.
     If found option's value defines debugging behaviour:
      * `attach` - connects to a remote debugger (your VS Code in `listen` mode)
      * `listen` - starts listening for a remote debugger to connect
+     * `on-signal` - keep working, and attach to a remote debugger on SIGUSR1 (see `_serve`)
      * `none` (default) - do not start a DebugRelay
 
     Args:
@@ -56,11 +66,8 @@ def _check_for_debugging(args) -> DebugRelay:
         DebugRelay: running DebugRelay object
     """
     debug_relay = None
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--debug', action='store',
-                        default="none", choices=['attach', 'listen', 'none'], required=False)
-    options, _ = parser.parse_known_args(args=args)
-    if options.debug != "none":
+    options = _parse_debug_option(args)
+    if options.debug not in ("none", "on-signal"):
         print(f"Starting DebugRelay in `{options.debug}` mode.")
 
         config_file = "./.azrelay.json"
@@ -78,7 +85,8 @@ def _check_for_debugging(args) -> DebugRelay:
             print("Cannot create Debugging Relay due to missing configuration.")
             return None
 
-        DebugRelay.kill_relays()
+        # stop a bridge left behind by an earlier run
+        DebugRelay.kill_relays(debug_relay.relay_connection_name)
         debug_relay.open()
 
         if debug_relay.is_running():
@@ -92,6 +100,21 @@ def _check_for_debugging(args) -> DebugRelay:
     return debug_relay
 
 
+def _serve():
+    """Long-running server mode: does the work every few seconds, without a debugger.
+    `kill -USR1 <pid>` (or `touch ./debug-now`) opens DebugRelay and attaches to a remote debugger
+    (your VS Code in `listen` mode) without restarting the process, the next one detaches.
+    """
+    trigger = DebugTrigger(DebugMode.Connect, control_file="./debug-now").install()
+    print(f"Serving as process {os.getpid()}. Send SIGUSR1 or touch ./debug-now to start or stop debugging.")
+    try:
+        while True:
+            do_work()
+            time.sleep(5)
+    finally:
+        trigger.uninstall()
+
+
 def _main(args):
     """CLI entry point
 
@@ -99,6 +122,10 @@ def _main(args):
         args: Command Line arguments
     """
     global g_debug_relay
+    if _parse_debug_option(args).debug == "on-signal":
+        signal(SIGINT, _signal_handler)
+        _serve()
+        return
     g_debug_relay = _check_for_debugging(args)
     signal(SIGINT, _signal_handler)
 
@@ -0,0 +1,72 @@
+"""Shared fixtures: a fake Azure Relay Bridge (see fake_azbridge.py), so tests need no network access.
+
+    python -m pytest tests
+"""
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
+
+from azdebugrelay import DebugRelay, DebugMode  # noqa: E402
+from azdebugrelay.bridge_installer import write_manifest  # noqa: E402
+from azdebugrelay.relay_registry import REGISTRY_DIR_ENV  # noqa: E402
+
+FAKE_CONNECTION_STRING = "Endpoint=sb://fake.servicebus.windows.net/;"\
+    "SharedAccessKeyName=fake;SharedAccessKey=ZmFrZQ=="
+FAKE_ENV_PREFIX = "FAKE_AZBRIDGE_"
+
+
+class FakeBridge(object):
+    """Fake `azbridge` installed (and first on PATH) with HOME and the relay registry in a temporary folder.
+    """
+    def __init__(self, folder: str, monkeypatch):
+        self.folder = folder
+        self._monkeypatch = monkeypatch
+        # the daemon socket, the installation and the registry go to the temporary folder
+        monkeypatch.setenv("HOME", folder)
+        monkeypatch.setenv(REGISTRY_DIR_ENV, os.path.join(folder, "registry"))
+        # a complete installation, so processes launched by tests (e.g. relay daemons) don't download one
+        installation = os.path.join(folder, DebugRelay.relay_dir_name, DebugRelay.relay_version_name)
+        os.makedirs(installation)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_azbridge.py")
+        launcher = os.path.join(installation, DebugRelay.relay_app_name)
+        with open(launcher, "w") as launcher_file:
+            launcher_file.write(f"#!/bin/sh\nexec \"{sys.executable}\" \"{script}\" \"$@\"\n")
+        os.chmod(launcher, 0o755)
+        write_manifest(installation, DebugRelay.relay_version_name)
+        monkeypatch.setenv("PATH", installation + os.pathsep + os.environ["PATH"])
+        monkeypatch.setattr(DebugRelay, "_installed_az_relay", True)
+        for name in list(os.environ):
+            if name.startswith(FAKE_ENV_PREFIX):
+                monkeypatch.delenv(name)
+
+
+    def configure(self, **settings):
+        """Sets fake azbridge behavior for relays started afterwards, e.g. configure(local_delay=0.1).
+        """
+        for name, value in settings.items():
+            if value is None:
+                self._monkeypatch.delenv(FAKE_ENV_PREFIX + name.upper(), raising=False)
+            else:
+                self._monkeypatch.setenv(FAKE_ENV_PREFIX + name.upper(), str(value))
+
+
+    def relay(self, name: str = "test", ports: list = None, **options) -> DebugRelay:
+        return DebugRelay(FAKE_CONNECTION_STRING, name, DebugMode.Connect, ports=ports or ["26000"], **options)
+
+
+@pytest.fixture
+def fake_bridge(monkeypatch):
+    if DebugRelay.is_windows:
+        pytest.skip("The fake Azure Relay Bridge launcher is a POSIX shell script.")
+    # short, unlike pytest's tmp_path: relay daemon sockets in it must fit sockaddr_un
+    folder = tempfile.mkdtemp(prefix="adr-")
+    bridge = FakeBridge(folder, monkeypatch)
+    bridge.configure(local_delay=0.05, remote_delay=0.05)
+    yield bridge
+    shutil.rmtree(folder, ignore_errors=True)
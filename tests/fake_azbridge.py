@@ -0,0 +1,83 @@
+"""Fake Azure Relay Bridge for offline tests and benchmarks.
+
+Accepts (and ignores) azbridge command line arguments and is configured with environment variables:
+
+    FAKE_AZBRIDGE_LOCAL_DELAY   seconds before printing `LocalForwardHostStart,` (default 0)
+    FAKE_AZBRIDGE_REMOTE_DELAY  seconds between `LocalForwardHostStart,` and `RemoteForwardHostStart,` (default 0)
+    FAKE_AZBRIDGE_SILENT        if set, never prints the readiness markers
+    FAKE_AZBRIDGE_FLOOD_LINES   number of lines to print once connected (default 0)
+    FAKE_AZBRIDGE_LINE_SIZE     length of flood lines (default 120)
+    FAKE_AZBRIDGE_CRASH         `before` or `after` (the flood) to exit with code 1, `exception` to report a bridge failure
+    FAKE_AZBRIDGE_DONE          line printed after the flood (default `FAKE_AZBRIDGE_DONE`)
+    FAKE_AZBRIDGE_EXIT_DELAY    seconds to shut down after SIGTERM, like a bridge closing its connections (default 0)
+
+Without FAKE_AZBRIDGE_CRASH, runs until terminated or, if its output goes to a pipe, until its parent process exits
+(so bridges launched with background_launch() don't outlive a test or benchmark,
+while shared ones logging to a file do).
+"""
+import os
+import signal
+import stat
+import sys
+import threading
+import time
+
+
+def _emit(line: str):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def _exit_with_parent():
+    parent = os.getppid()
+    while os.getppid() == parent:
+        time.sleep(0.2)
+    os._exit(0)
+
+
+def main():
+    environment = os.environ
+    exit_delay = float(environment.get("FAKE_AZBRIDGE_EXIT_DELAY", "0"))
+
+    def terminate(*args):
+        time.sleep(exit_delay)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+    if os.name != "nt" and stat.S_ISFIFO(os.fstat(sys.stdout.fileno()).st_mode):
+        threading.Thread(target=_exit_with_parent, daemon=True).start()
+    crash = environment.get("FAKE_AZBRIDGE_CRASH", "")
+    _emit("Azure Relay Bridge (fake) starting")
+    if environment.get("FAKE_AZBRIDGE_SILENT"):
+        while True:
+            time.sleep(3600)
+    time.sleep(float(environment.get("FAKE_AZBRIDGE_LOCAL_DELAY", "0")))
+    if crash == "before":
+        _emit("Unhandled exception. System.Net.WebSockets.WebSocketException")
+        sys.exit(1)
+    _emit("Microsoft.Azure.Relay.Bridge.EventTraceActivity, LocalForwardHostStart, fake")
+    time.sleep(float(environment.get("FAKE_AZBRIDGE_REMOTE_DELAY", "0")))
+    _emit("Microsoft.Azure.Relay.Bridge.EventTraceActivity, RemoteForwardHostStart, fake")
+
+    flood_lines = int(environment.get("FAKE_AZBRIDGE_FLOOD_LINES", "0"))
+    if flood_lines:
+        line = "Microsoft.Azure.Relay.Bridge.EventTraceActivity, DataTransfer, "
+        line += "x" * max(0, int(environment.get("FAKE_AZBRIDGE_LINE_SIZE", "120")) - len(line))
+        chunk = "\n".join([line] * min(flood_lines, 1000)) + "\n"
+        written = 0
+        while written < flood_lines:
+            count = min(1000, flood_lines - written)
+            sys.stdout.write(chunk if count == 1000 else "\n".join([line] * count) + "\n")
+            written += count
+        _emit(environment.get("FAKE_AZBRIDGE_DONE", "FAKE_AZBRIDGE_DONE"))
+
+    if crash == "after":
+        sys.exit(1)
+    if crash == "exception":
+        _emit("Microsoft.Azure.Relay.Bridge.EventTraceActivity, exception = System.Net.WebSockets.WebSocketException")
+    while True:
+        time.sleep(3600)
+
+
+if __name__ == "__main__":
+    main()
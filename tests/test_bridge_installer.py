@@ -0,0 +1,126 @@
+"""Checksum verification of Azure Relay Bridge downloads, against a local HTTP server.
+"""
+import functools
+import hashlib
+import http.server
+import io
+import json
+import os
+import tarfile
+import threading
+
+import pytest
+
+from azdebugrelay import DebugRelay
+from azdebugrelay.bridge_installer import BridgeArchive, fetch_archive, make_bundle
+
+
+class _RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Static files with single-range `Range` support.
+    """
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as source:
+            data = source.read()
+        start = 0
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            start = int(range_header[len("bytes="):].split("-")[0])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+
+@pytest.fixture
+def served(tmp_path):
+    """Serves a .tar.gz archive with an `azbridge` file; returns (url, archive bytes, SHA-256).
+    """
+    serve_dir = tmp_path / "serve"
+    serve_dir.mkdir()
+    payload = os.urandom(256 * 1024)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar_file:
+        info = tarfile.TarInfo(DebugRelay.relay_app_name)
+        info.size = len(payload)
+        tar_file.addfile(info, io.BytesIO(payload))
+    data = buffer.getvalue()
+    (serve_dir / "azbridge.test-x64.tar.gz").write_bytes(data)
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(_RangeHandler, directory=str(serve_dir)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/azbridge.test-x64.tar.gz", data, hashlib.sha256(data).hexdigest()
+    server.shutdown()
+    server.server_close()
+
+
+def test_tampered_archive_is_rejected(tmp_path, served):
+    url, _, _ = served
+    work_dir = str(tmp_path / "work")
+    with pytest.raises(ValueError):
+        fetch_archive(BridgeArchive(url, "azbridge.test-x64.tar.gz", "0" * 64), work_dir)
+    assert os.listdir(work_dir) == []
+
+
+def test_resumed_download_is_verified_whole(tmp_path, served):
+    url, data, sha256 = served
+    archive = BridgeArchive(url, "azbridge.test-x64.tar.gz", sha256)
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    part_path = work_dir / "azbridge.test-x64.tar.gz.part"
+
+    # a partial download that doesn't match the archive is caught, although only the rest is downloaded
+    part_path.write_bytes(bytes(255 - byte for byte in data[:1000]))
+    with pytest.raises(ValueError):
+        fetch_archive(archive, str(work_dir))
+    assert os.listdir(str(work_dir)) == []
+
+    part_path.write_bytes(data[:1000])
+    extract_to = tmp_path / "extracted"
+    path = fetch_archive(archive, str(work_dir), extract_to=str(extract_to))
+    with open(path, "rb") as archive_file:
+        assert archive_file.read() == data
+    assert os.listdir(str(extract_to)) == [DebugRelay.relay_app_name]
+
+
+def test_default_download_is_checked_against_pinned_checksum(tmp_path, served, monkeypatch):
+    url, _, sha256 = served
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("PATH", os.environ["PATH"])
+    monkeypatch.setattr(DebugRelay, "_relay_config_file", None)
+    for name in ("AZDEBUGRELAY_BRIDGE_SHA256", "AZDEBUGRELAY_BRIDGE_SOURCE", "AZDEBUGRELAY_BRIDGE_CACHE"):
+        monkeypatch.delenv(name, raising=False)
+    for platform_name in ("UBUNTU", "DEBIAN", "MACOS", "WINDOWS"):
+        monkeypatch.setattr(DebugRelay, f"DEFAULT_AZ_RELAY_BRIDGE_{platform_name}_DOWLOAD", url)
+        monkeypatch.setattr(DebugRelay, f"DEFAULT_AZ_RELAY_BRIDGE_{platform_name}_SHA256", "0" * 64)
+    installation = tmp_path / DebugRelay.relay_dir_name / DebugRelay.relay_version_name
+    with pytest.raises(ValueError):
+        DebugRelay._install_azure_relay_bridge_locked(None, None)
+    # files extracted while streaming are discarded with the staging folder
+    assert not installation.exists()
+
+    for platform_name in ("UBUNTU", "DEBIAN", "MACOS", "WINDOWS"):
+        monkeypatch.setattr(DebugRelay, f"DEFAULT_AZ_RELAY_BRIDGE_{platform_name}_SHA256", sha256)
+    DebugRelay._install_azure_relay_bridge_locked(None, None)
+    assert (installation / DebugRelay.relay_app_name).exists()
+
+
+def test_bundle_skips_platform_that_cannot_be_fetched(tmp_path, served):
+    url, _, sha256 = served
+    downloads = {"good": url, "missing": url.replace("test-x64", "missing-x64")}
+    index_path = make_bundle(str(tmp_path / "bundle"), "test", downloads, ["good", "missing", "unknown"])
+    with open(index_path) as index_file:
+        index = json.load(index_file)
+    assert index["archives"] == {"good": {"file": "azbridge.test-x64.tar.gz", "sha256": sha256}}
+
+    with pytest.raises(RuntimeError):
+        make_bundle(str(tmp_path / "empty"), "test", downloads, ["missing"])
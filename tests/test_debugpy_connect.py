@@ -0,0 +1,87 @@
+"""debugpy_connect_with_timeout() with relays opened by open_async(), against the fake Azure Relay Bridge,
+and bounded debugpy handshakes.
+"""
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from azdebugrelay import DebugPyEx, debugpy_connect_with_timeout, debugpyex, disarm_breakpoints
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def test_async_opened_relay_is_not_restarted(fake_bridge):
+    relay = fake_bridge.relay(ports=["26020"])
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(relay.open_async())
+        pid = relay.bridge_pid()
+        assert pid is not None
+
+        # no debugger listens, so connecting times out, but the relay must stay as it is
+        assert not debugpy_connect_with_timeout("127.0.0.1", _free_port(), 0.2, debug_relay=relay)
+        assert relay.bridge_pid() == pid
+        assert relay.open_count == 1
+        assert loop.run_until_complete(relay.is_running_async())
+    finally:
+        loop.run_until_complete(relay.close_async())
+        loop.close()
+
+
+class SlowHandshake(object):
+    """debugpy.connect that completes once released, like a debugger slow to configure the session.
+    """
+    def __init__(self, monkeypatch):
+        import debugpy
+
+        self.release = threading.Event()
+        self.returned = threading.Event()
+        self.disconnected = threading.Event()
+        monkeypatch.setattr(debugpy, "connect", self.connect)
+        monkeypatch.setattr(debugpy, "is_client_connected", lambda: False)
+        monkeypatch.setattr(debugpy, "debug_this_thread", lambda: None)
+        monkeypatch.setattr(debugpyex, "_stop_tracing", self.disconnected.set)
+        monkeypatch.setattr(debugpyex, "_handoff", None)
+
+
+    def connect(self, address):
+        self.release.wait(30)
+        self.returned.set()
+
+
+@pytest.fixture
+def debugger_port():
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(8)
+        yield listener.getsockname()[1]
+
+
+def test_handshake_is_bounded_by_timeout(monkeypatch, debugger_port):
+    handshake = SlowHandshake(monkeypatch)
+    started = time.monotonic()
+    assert not DebugPyEx.connect("127.0.0.1", debugger_port, 0.5)
+    assert time.monotonic() - started < 5
+
+    # nobody waits for the handshake any more, so it is disconnected once it completes
+    handshake.release.set()
+    assert handshake.disconnected.wait(10)
+
+
+def test_late_handshake_is_picked_up_by_next_call(monkeypatch, debugger_port):
+    handshake = SlowHandshake(monkeypatch)
+    assert not DebugPyEx.connect("127.0.0.1", debugger_port, 0.5)
+    threading.Timer(0.5, handshake.release.set).start()
+    try:
+        assert DebugPyEx.connect("127.0.0.1", debugger_port, 10)
+    finally:
+        disarm_breakpoints()
+    assert handshake.returned.is_set()
+    assert not handshake.disconnected.is_set()
@@ -0,0 +1,154 @@
+"""Round trips through HybridConnectionForwarder tunnels (-L and -R), against the local stand-in for Azure Relay.
+"""
+import asyncio
+import json
+import socket
+
+import pytest
+
+from azdebugrelay import relay_websocket
+from azdebugrelay.hybrid_connection import HybridConnectionForwarder, create_sas_token
+from azdebugrelay.relay_stand_in import LocalRelayServer
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def _echo(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        writer.write(data)
+        await writer.drain()
+    writer.close()
+
+
+async def _round_trip(port: int, payload: bytes) -> bytes:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(payload)
+        await writer.drain()
+        return await asyncio.wait_for(reader.readexactly(len(payload)), 10)
+    finally:
+        writer.close()
+
+
+class Tunnel(object):
+    """Echo server behind a remote forwarder (-R), reached through a local forwarder (-L) on `local_port`.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.stand_in = LocalRelayServer()
+        self.echo_server = None
+        self.remote = None
+        self.local = None
+        self.local_port = _free_port()
+
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+
+    async def start(self, **remote_options):
+        await self.stand_in.start()
+        self.echo_server = await asyncio.start_server(_echo, "127.0.0.1", 0)
+        echo_port = str(self.echo_server.sockets[0].getsockname()[1])
+        connection_string = self.stand_in.connection_string()
+        self.remote = HybridConnectionForwarder(connection_string, "test", True, "127.0.0.1", [echo_port])
+        for name, value in remote_options.items():
+            setattr(self.remote, name, value)
+        await self.remote.start()
+        self.local = HybridConnectionForwarder(
+            connection_string, "test", False, "127.0.0.1", [str(self.local_port)])
+        await self.local.start()
+
+
+    async def stop(self):
+        for forwarder in (self.local, self.remote):
+            if forwarder is not None:
+                await forwarder.stop()
+        if self.echo_server is not None:
+            self.echo_server.close()
+            await self.echo_server.wait_closed()
+        await self.stand_in.stop()
+
+
+@pytest.fixture
+def tunnel():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    tunnel = Tunnel(loop)
+    yield tunnel
+    tunnel.run(tunnel.stop())
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def test_round_trip(tunnel):
+    tunnel.run(tunnel.start())
+    # several websocket frames, both ways
+    payload = bytes(range(256)) * 1024
+    assert tunnel.run(_round_trip(tunnel.local_port, payload)) == payload
+    assert tunnel.run(_round_trip(tunnel.local_port, b"second connection")) == b"second connection"
+    assert tunnel.stand_in.connections_relayed == 2
+
+
+def test_wrong_key_is_rejected(tunnel):
+    tunnel.run(tunnel.stand_in.start())
+    connection_string = tunnel.stand_in.connection_string().replace(tunnel.stand_in.key, "d3Jvbmc=")
+    forwarder = HybridConnectionForwarder(connection_string, "test", True, "127.0.0.1", ["1"])
+    with pytest.raises(relay_websocket.WebSocketError) as error:
+        tunnel.run(forwarder.start())
+    assert error.value.status == 401
+    assert not forwarder.is_running
+
+
+def test_renewed_token_keeps_listener(tunnel):
+    tunnel.run(tunnel.start(token_ttl=3, token_renew_margin=2))
+    tunnel.run(asyncio.sleep(4))
+    assert tunnel.stand_in.token_renewals >= 2
+    assert tunnel.stand_in.listener_connections == 1
+    assert tunnel.run(_round_trip(tunnel.local_port, b"renewed")) == b"renewed"
+
+
+def test_expired_listener_reconnects(tunnel):
+    # the token expires long before it would be renewed
+    tunnel.run(tunnel.start(token_ttl=2, token_renew_margin=-60))
+    tunnel.run(asyncio.sleep(3))
+    assert tunnel.stand_in.token_renewals == 0
+    assert tunnel.stand_in.listener_connections >= 2
+    assert tunnel.run(_round_trip(tunnel.local_port, b"expired")) == b"expired"
+
+
+def test_invalid_renewal_closes_listener(tunnel):
+    stand_in = tunnel.stand_in
+    tunnel.run(stand_in.start())
+    resource_uri = "http://127.0.0.1/test"
+
+    async def renew_with_wrong_key():
+        listener = await relay_websocket.connect(
+            f"{stand_in.endpoint}$hc/test?sb-hc-action=listen",
+            headers={"ServiceBusAuthorization": create_sas_token(resource_uri, stand_in.key_name, stand_in.key)})
+        token = create_sas_token(resource_uri, stand_in.key_name, "d3Jvbmc=")
+        await listener.send(json.dumps({"renewToken": {"token": token}}))
+        return await asyncio.wait_for(listener.recv(), 10)
+
+    assert tunnel.run(renew_with_wrong_key()) is None
+    assert stand_in.rejected_renewals == 1
+
+
+def test_dropped_listener_reconnects(tunnel):
+    tunnel.run(tunnel.start())
+    tunnel.run(tunnel.stand_in.drop_listeners())
+
+    async def wait_for_listener():
+        while tunnel.stand_in.listener_connections < 2:
+            await asyncio.sleep(0.05)
+
+    tunnel.run(asyncio.wait_for(wait_for_listener(), 10))
+    assert tunnel.remote.is_running
+    assert tunnel.run(_round_trip(tunnel.local_port, b"reconnected")) == b"reconnected"
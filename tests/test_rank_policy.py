@@ -0,0 +1,45 @@
+"""First-error claims of RankPolicy (no relay needed).
+"""
+import os
+
+import pytest
+
+from azdebugrelay import RankInfo, RankPolicy, RankSelection
+
+
+def _ranks(claim_dir, job_id: str, world_size: int = 2):
+    return [RankPolicy(RankSelection.FirstError, rank_info=RankInfo(rank, rank, world_size, world_size, job_id),
+                       claim_dir=str(claim_dir)) for rank in range(world_size)]
+
+
+def test_first_error_is_claimed_once_per_run(tmp_path):
+    for run in range(2):
+        ranks = _ranks(tmp_path, "job")
+        assert ranks[1].claim_first_error()
+        assert not ranks[0].claim_first_error()
+        assert ranks[1].should_attach() and not ranks[0].should_attach()
+        for rank in ranks:
+            rank.close()
+        # the next run of the same job claims again
+        assert os.listdir(tmp_path) == []
+
+
+def test_first_error_of_many_ranks_requires_job_id(tmp_path, monkeypatch):
+    with pytest.raises(ValueError):
+        _ranks(tmp_path, None)
+    monkeypatch.setenv("AZDEBUGRELAY_JOB_ID", "launch-1")
+    monkeypatch.setenv("AZDEBUGRELAY_RANKS", "first-error")
+    monkeypatch.setenv("RANK", "1")
+    monkeypatch.setenv("WORLD_SIZE", "2")
+    policy = RankPolicy.from_environment(claim_dir=str(tmp_path))
+    assert policy.rank_info.job_id == "launch-1"
+    assert policy.claim_first_error()
+    policy.close()
+
+
+def test_single_process_claims_for_itself(tmp_path):
+    for run in range(2):
+        policy = _ranks(tmp_path, None, world_size=1)[0]
+        assert policy.claim_first_error()
+        policy.close()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,112 @@
+"""Relay daemon tests against the fake Azure Relay Bridge (no network access needed).
+"""
+import threading
+import time
+
+import pytest
+
+from azdebugrelay import RankInfo, RankPolicy
+from azdebugrelay.relay_daemon import (
+    RelayDaemon, RelayDaemonClient, connect_or_spawn_daemon, daemon_config, default_socket_path)
+from azdebugrelay.relay_registry import default_registry
+
+
+@pytest.fixture
+def daemon(fake_bridge):
+    # the ports two ranks of a node attach on (see RankPolicy.attach)
+    daemon = RelayDaemon(fake_bridge.relay(ports=["26000"]), base_port=26000, max_ports=2)
+    thread = threading.Thread(target=daemon.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            RelayDaemonClient(daemon.socket_path).close()
+            break
+        except OSError:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    yield daemon
+    with RelayDaemonClient(daemon.socket_path) as client:
+        client.stop()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def _bridges():
+    return [(record.pid, record.ports) for record in default_registry().records()]
+
+
+def _wait_for_leases(client: RelayDaemonClient, leases: int):
+    deadline = time.monotonic() + 10
+    while client.status()["leases"] != leases:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_second_rank_keeps_first_session(fake_bridge, daemon):
+    ranks = [RankPolicy(base_port=26000, rank_info=RankInfo(rank, rank, 2, 2)) for rank in range(2)]
+    relay = fake_bridge.relay(ports=["26000"])
+    try:
+        # no debugger listens, so attaching itself fails, but the ports stay leased
+        assert not ranks[0].attach(relay, connect_timeout=0.1)
+        first = _bridges()
+        assert len(first) == 1
+        assert first[0][1] == ["26000", "26001"]
+
+        assert not ranks[1].attach(relay, connect_timeout=0.1)
+        # the bridge rank 0 attached through is still the one running
+        assert _bridges() == first
+        assert ranks[1].daemon_client.status()["leases"] == 2
+
+        ranks[1].daemon_client.close()
+        _wait_for_leases(ranks[0].daemon_client, 1)
+        assert _bridges() == first
+    finally:
+        for rank in ranks:
+            if rank.daemon_client is not None:
+                rank.daemon_client.close()
+
+
+def test_port_outside_range_is_refused(daemon):
+    with RelayDaemonClient(daemon.socket_path) as client:
+        with pytest.raises(RuntimeError):
+            client.acquire(27000)
+
+
+def test_socket_is_specific_to_relay_configuration(fake_bridge, daemon):
+    relay = fake_bridge.relay(ports=["26000"])
+    assert default_socket_path(daemon_config(relay, 26000, 2)) == daemon.socket_path
+    for other in (daemon_config(fake_bridge.relay("other", ports=["26000"]), 26000, 2),
+                  daemon_config(relay, 26100, 2),
+                  daemon_config(relay, 26000, 4)):
+        assert default_socket_path(other) != daemon.socket_path
+
+
+def test_client_checks_configuration(daemon):
+    with RelayDaemonClient(daemon.socket_path, config=daemon.config) as client:
+        assert client.status()["config"] == daemon.config
+    with pytest.raises(RuntimeError):
+        RelayDaemonClient(daemon.socket_path, config="another")
+
+
+def test_live_socket_is_kept(fake_bridge, daemon):
+    other = RelayDaemon(fake_bridge.relay("other", ports=["26000"]), base_port=26000, max_ports=2,
+                        socket_path=daemon.socket_path)
+    with pytest.raises(RuntimeError):
+        other.run()
+    with RelayDaemonClient(daemon.socket_path, config=daemon.config) as client:
+        assert client.status()["leases"] == 0
+
+
+def test_spawned_daemon_has_same_configuration(fake_bridge):
+    relay = fake_bridge.relay(ports=["26200"])
+    client = connect_or_spawn_daemon(relay, base_port=26200, max_ports=2, idle_timeout=60)
+    try:
+        assert client.socket_path == default_socket_path(daemon_config(relay, 26200, 2))
+        assert client.acquire() == 26200
+        # a second process finds the running daemon instead of launching another one
+        with connect_or_spawn_daemon(relay, base_port=26200, max_ports=2) as second:
+            assert second.status()["leases"] == 1
+    finally:
+        client.stop()
+        client.close()
@@ -0,0 +1,45 @@
+"""RelayManifest.run_async() with relays that stop on their own, against the fake Azure Relay Bridge.
+"""
+import asyncio
+import io
+import os
+import signal
+
+from azdebugrelay.relay_manifest import RelayManifest, RelaySpec, STATUS_EXITED, STATUS_READY
+
+from conftest import FAKE_CONNECTION_STRING
+
+
+def _manifest(ports: list) -> RelayManifest:
+    return RelayManifest([
+        RelaySpec(f"relay{port}", "test", FAKE_CONNECTION_STRING, ports=[port], restart=False) for port in ports])
+
+
+def test_run_returns_once_no_relay_is_running(fake_bridge):
+    manifest = _manifest(["26300", "26301"])
+    manifest.create_relays()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def stop_bridges():
+        while len(manifest.results) < 2:
+            await asyncio.sleep(0.05)
+        first, second = (manifest.relays[name] for name in ("relay26300", "relay26301"))
+        os.kill(first.bridge_pid(), signal.SIGTERM)
+        while manifest.results["relay26300"]["status"] != STATUS_EXITED:
+            await asyncio.sleep(0.05)
+        # the other relay keeps running
+        assert manifest.results["relay26301"]["status"] == STATUS_READY
+        os.kill(second.bridge_pid(), signal.SIGTERM)
+
+    try:
+        stopper = asyncio.ensure_future(stop_bridges())
+        assert not loop.run_until_complete(asyncio.wait_for(manifest.run_async(stream=io.StringIO()), 30))
+        loop.run_until_complete(stopper)
+    finally:
+        loop.run_until_complete(manifest.close_async())
+        loop.close()
+        asyncio.set_event_loop(None)
+    for result in manifest.results.values():
+        assert result["status"] == STATUS_EXITED
+        assert result["error"] == "exited with code 0"
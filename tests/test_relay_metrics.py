@@ -0,0 +1,55 @@
+"""Metrics of relays opened with open_async(), against the fake Azure Relay Bridge.
+"""
+import asyncio
+import os
+import urllib.request
+
+import pytest
+
+import azdebugrelay
+
+
+@pytest.fixture
+def metrics():
+    metrics_registry = azdebugrelay.enable_metrics(http_port=0)
+    yield metrics_registry
+    azdebugrelay.disable_metrics()
+
+
+def _samples(text: str) -> dict:
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name.split("{")[0]] = float(value)
+    return samples
+
+
+def _scrape(metrics_registry) -> dict:
+    endpoint = metrics_registry.exporters[0]
+    with urllib.request.urlopen(f"http://{endpoint.host}:{endpoint.port}/metrics") as response:
+        return _samples(response.read().decode())
+
+
+def test_async_opened_relay_is_up(fake_bridge, metrics):
+    relay = fake_bridge.relay(ports=["26010"])
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(relay.open_async())
+        assert relay.is_running()
+        assert relay.uptime() is not None
+
+        samples = _scrape(metrics)
+        assert samples["azdebugrelay_relay_up"] == 1
+        assert samples["azdebugrelay_relay_uptime_seconds"] > 0
+        if os.path.isdir("/proc"):
+            assert samples["azdebugrelay_bridge_resident_memory_bytes"] > 0
+            assert "azdebugrelay_bridge_cpu_seconds_total" in samples
+
+        loop.run_until_complete(relay.close_async())
+        assert not relay.is_running()
+        assert relay.uptime() is None
+        assert _scrape(metrics)["azdebugrelay_relay_up"] == 0
+    finally:
+        loop.run_until_complete(relay.close_async())
+        loop.close()
@@ -0,0 +1,62 @@
+"""Waiting for registered bridges (and their process groups) to exit.
+"""
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from azdebugrelay import relay_registry
+from azdebugrelay.relay_registry import RelayRecord, wait_for_exit, wait_for_process
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="Process groups are POSIX only.")
+
+
+def _launch(script: str) -> subprocess.Popen:
+    return subprocess.Popen(["/bin/sh", "-c", script], start_new_session=True)
+
+
+def _record(process: subprocess.Popen) -> RelayRecord:
+    return RelayRecord(process.pid, process.pid, "test", ["26000"], "user", relay_registry._hostname(), os.getpid())
+
+
+def test_running_group_is_checked_without_scanning_processes(monkeypatch):
+    scans = []
+    original = relay_registry._live_process_groups
+    monkeypatch.setattr(relay_registry, "_live_process_groups", lambda: scans.append(1) or original())
+    process = _launch(f"exec \"{sys.executable}\" -c 'import time; time.sleep(0.3)'")
+    try:
+        record = _record(process)
+        assert wait_for_exit([record], 0.1) == [record]
+        assert not scans
+        assert wait_for_exit([record], 10) == []
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_group_outlives_its_leader():
+    # the shell exits (and stays a zombie until reaped) while its child keeps the group alive
+    process = _launch("sleep 0.5 & exit 0")
+    try:
+        record = _record(process)
+        assert wait_for_exit([record], 0.2) == [record]
+        assert wait_for_exit([record], 10) == []
+    finally:
+        process.wait()
+
+
+@pytest.mark.skipif(not hasattr(os, "pidfd_open"), reason="No pidfd support.")
+def test_process_of_another_launcher_is_waited_for_without_polling():
+    process = _launch(f"exec \"{sys.executable}\" -c 'import time; time.sleep(0.3)'")
+    record = _record(process)
+    record.started = relay_registry._process_start_time(process.pid)
+    started = time.monotonic()
+    try:
+        # returns when the process exits, long before the first poll would
+        wait_for_process(record, poll_interval=30)
+    finally:
+        process.kill()
+        process.wait()
+    assert time.monotonic() - started < 10